@@ -2,14 +2,36 @@
 
 import sys
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, request, Response, stream_with_context, g, has_request_context
+from werkzeug.http import is_resource_modified
 import re
+import math
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+import io
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import os
+import time
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import tempfile
+import shutil
+import atexit
+import json
+import zlib
+from itertools import chain, count
+from bisect import bisect_left, bisect_right
+import resource
+import cProfile
+import pstats
+import importlib.util
 
 
 # Here below there is the helper returned when the user write the -h parameter
@@ -21,30 +43,122 @@ helper = ("\n"
           "\tPort number\tArguments to specify on which port run the service. This must be a number between 1024 and 65535\n"
           "\n"
           "Options:\n"
-          "\t-h, --help\tShow this help message and exit"
+          "\t-h, --help\t\tShow this help message and exit\n"
+          "\t--jaspar-file PATH\tLoad the motifs from a local file in the Jaspar format, without using the internet connection\n"
+          "\t--snapshot PATH\t\tLoad the motifs from this binary snapshot, without parsing the file and computing the tables\n"
+          "\t\t\t\tof the motifs again. If it doesn't exist, it's created after loading the motifs, and it's\n"
+          "\t\t\t\tcreated again when the Jaspar file (downloaded or given with --jaspar-file) changes\n"
+          "\t--cache-dir DIR\t\tDirectory where the downloaded Jaspar file is kept, to download it again only when it changes\n"
+          "\t\t\t\t(default: the current directory)\n"
+          "\t--offline\t\tNever use the internet connection, only the snapshot or the file already downloaded\n"
+          "\t--data-dir DIR\t\tDirectory where the motifs added, modified or deleted are saved, so they are not lost when\n"
+          "\t\t\t\tthe service is restarted\n"
+          "\t--compact-every N\tNumber of changes after which all the database is saved again in the data directory\n"
+          "\t\t\t\t(default: 1000)\n"
+          "\t--workers N\t\tNumber of processes used to scan long sequences and FASTA files (default: 0, everything is\n"
+          "\t\t\t\tdone in the process of the service)\n"
+          "\t--graph-cache-mb N\tMegabytes of memory used to keep the graphs of the motifs already created (default: 64)\n"
+          "\t--prerender-graphs\tCreate the graphs of all the motifs in background after the start\n"
+          "\t--pseudocount X\t\tPseudocount added to each position of the motifs for the log-odds scores (default: 0.8)\n"
+          "\t--background A,C,G,T\tFrequencies of the nucleotides in the background DNA for the log-odds scores and the\n"
+          "\t\t\t\tp-values (default: 0.25,0.25,0.25,0.25)\n"
+          "\t--result-cache-mb N\tMegabytes of memory used to keep the scores of the sequences already asked (default: 16,\n"
+          "\t\t\t\t0 to disable it)\n"
+          "\t--result-cache-ttl N\tSeconds after which a score kept in memory is computed again (default: 300)\n"
+          "\t--profile-slow-ms N\tProfile the requests with cProfile and save the profiles of the ones that take more than N\n"
+          "\t\t\t\tmilliseconds (only one request at a time is profiled)\n"
+          "\t--profile-dir DIR\tDirectory where the profiles of the slow requests are saved (default: profiles)\n"
+          "\t--server NAME\t\tServer used to run the service: dev (the server of Flask, the default), waitress, gunicorn\n"
+          "\t\t\t\tor asgi (uvicorn), they need the package of the server to be installed\n"
+          "\t--host HOST\t\tAddress where the service is listening (default: 127.0.0.1, 0.0.0.0 for all of them)\n"
+          "\t--threads N\t\tThreads that answer the requests with waitress, gunicorn and asgi (default: 8)\n"
+          "\t--processes N\t\tProcesses of gunicorn, each with its own copy of the database (default: 1)\n"
+          "\t--heavy-jobs N\t\tSlow jobs (graphs, scans, best DNA sequences) done at the same time (default: the number\n"
+          "\t\t\t\tof cores)\n"
+          "\t--heavy-queue N\t\tSlow jobs that can wait, the next ones get 503 (default: 32)"
           "\n")
 
-# These lines of code below are to make sure that the user specify a right port to run the service or the -h parameter
+# These lines of code below are to make sure that the user specify a right port to run the service or the -h parameter,
+# and to read the other options (they all start with --, the ones that need a value are followed by it)
 
-try:
-    # sys.argv are the arguments specified by the user on the command line, if they are less than 2 it means the user
+opzioni_con_valore = ['--jaspar-file', '--snapshot', '--cache-dir', '--data-dir', '--compact-every', '--workers',
+                      '--graph-cache-mb', '--pseudocount', '--background', '--result-cache-mb', '--result-cache-ttl',
+                      '--profile-slow-ms', '--profile-dir', '--server', '--host', '--threads', '--processes',
+                      '--heavy-jobs', '--heavy-queue']
+# minimum value of the options that are numbers
+opzioni_numeriche = {'--compact-every': 1, '--workers': 0, '--graph-cache-mb': 0, '--result-cache-mb': 0,
+                     '--result-cache-ttl': 1, '--profile-slow-ms': 0, '--threads': 1, '--processes': 1,
+                     '--heavy-jobs': 1, '--heavy-queue': 0}
+opzioni_senza_valore = ['--offline', '--prerender-graphs']
+
+
+def leggi_argomenti(argv):
+    # argv are the arguments specified by the user on the command line, if they are less than 2 it means the user
     # only write the name of the script, but not the port number or the -h
-    if len(sys.argv) < 2:
+    if len(argv) < 2:
         raise ValueError("ERROR: It's necessary to specify a parameter, either the port number to run the web service or the -h for see the helper")
-    elif sys.argv[1] == '-h' or sys.argv[1] == '--help':
+    elif argv[1] == '-h' or argv[1] == '--help':
         print(helper)
         sys.exit(0)
-    elif sys.argv[1].isnumeric():
-        port = int(sys.argv[1])
+    elif argv[1].isnumeric():
+        port = int(argv[1])
         # the port before 1023 are usually reserved
         if port < 1023 or port > 65535:
             raise ValueError("ERROR: port number doesn't exist or is not available")
     else:
         raise ValueError('ERROR: Second parameter not valid, specifiy a port number or -h to see the helper')
 
-except ValueError as ve:
-    print(ve)
-    sys.exit(1)
+    opzioni = {}
+    argomenti = iter(argv[2:])
+    for argomento in argomenti:
+        if argomento in opzioni_senza_valore:
+            opzioni[argomento] = True
+        elif argomento in opzioni_con_valore:
+            valore = next(argomenti, None)
+            if valore is None:
+                raise ValueError(f'ERROR: the option {argomento} needs a value')
+            opzioni[argomento] = valore
+        else:
+            raise ValueError(f'ERROR: option {argomento} not valid, use -h to see the helper')
+
+    for opzione, minimo in opzioni_numeriche.items():
+        if opzione in opzioni:
+            if not opzioni[opzione].isnumeric() or int(opzioni[opzione]) < minimo:
+                raise ValueError(f'ERROR: the option {opzione} must be a number not smaller than {minimo}')
+            opzioni[opzione] = int(opzioni[opzione])
+
+    # the server must be one of the known ones, and its packages must be installed
+    if '--server' in opzioni:
+        if opzioni['--server'] not in server_disponibili:
+            raise ValueError(f'ERROR: the option --server must be one of {", ".join(server_disponibili)}')
+        for pacchetto in pacchetti_server.get(opzioni['--server'], ()):
+            if importlib.util.find_spec(pacchetto) is None:
+                raise ValueError(f'ERROR: the server {opzioni["--server"]} needs the package {pacchetto} '
+                                 f'(pip install {pacchetto})')
+    if opzioni.get('--processes', 1) > 1:
+        if opzioni.get('--server') != 'gunicorn':
+            raise ValueError('ERROR: the option --processes can be used only with --server gunicorn')
+        if '--data-dir' in opzioni:
+            raise ValueError('ERROR: the option --data-dir can be used only with a single process')
+
+    if '--pseudocount' in opzioni:
+        try:
+            opzioni['--pseudocount'] = float(opzioni['--pseudocount'])
+        except ValueError:
+            opzioni['--pseudocount'] = 0.0
+        if not opzioni['--pseudocount'] > 0:
+            raise ValueError('ERROR: the option --pseudocount must be a positive number')
+
+    if '--background' in opzioni:
+        try:
+            fondo = np.array([float(frequenza) for frequenza in opzioni['--background'].split(',')])
+        except ValueError:
+            fondo = np.zeros(0)
+        if len(fondo) != 4 or not (fondo > 0).all():
+            raise ValueError('ERROR: the option --background must be 4 positive numbers separated by commas (A,C,G,T)')
+        opzioni['--background'] = fondo / fondo.sum()
+
+    return port, opzioni
 
 
 welcome_msg = ("\n"
@@ -55,6 +169,8 @@ welcome_msg = ("\n"
           "\n"
           "- To get all motifs: curl -i http://localhost:5000/Motifs/motif\n"
           "\n"
+          "- To get only the IDs of the motifs, 100 at a time: curl -i \"http://localhost:5000/Motifs/motif?fields=motif_id&limit=100\"\n"
+          "\n"
           "- To get just a single motif: curl -i http://localhost:5000/Motifs/motif/MA0004.1\n"
           "\n"
           '- To add a new motif: curl -i -H "Content-type: application/json" -X POST -d "{\\"motif_id\\": \\"MA1234.1\\", \\"TF_name\\":\\"name\\", \\"PFM\\": {\\"A\\": [800, 807, 52, 61, 884, 851], \\"C\\": [68, 52, 29, 35, 22, 46], \\"G\\": [47, 44, 22, 28, 43, 42], \\"T\\": [85, 98, 898, 876, 51, 61]}}" http://localhost:5000/Motifs/motif\n'
@@ -63,88 +179,87 @@ welcome_msg = ("\n"
           "\n"
           "- To delete an existing motif: curl -i -X DELETE http://localhost:5000/Motifs/motif/MA1234.1\n"
           "\n"
+          "- To import all the motifs of a file (JASPAR, MEME or TRANSFAC): curl -i -X POST --data-binary @motifs.meme http://localhost:5000/Motifs/import\n"
+          "\n"
           "- To get the scores for a given sequence: curl -i  http://localhost:5000/Motifs/ATGC\n"
           "\n"
-          "- To get the visual representation for a motif: curl -i http://localhost:5000/Motifs/motif/graph/MA0004.1\n"
+          "- To get only the 5 best motifs for a given sequence, in json: curl -i \"http://localhost:5000/Motifs/ACGTACGTAC?top_k=5&format=json\"\n"
+          "\n"
+          "- To get the scores on both strands of a sequence, with the best strand of each motif: curl -i \"http://localhost:5000/Motifs/ACGTACGTAC?strand=both\"\n"
+          "\n"
+          "- To get the 10 best motifs that fit anywhere in a sequence, with their positions: curl -i \"http://localhost:5000/Motifs/ACGTACGTACGGATTACAGGCATTACG?mode=fit&top_k=10\"\n"
+          "\n"
+          "- To get the DNA sequences of a protein, page by page: curl -i \"http://localhost:5000/Motifs/MLSRW?cursor=0&limit=1000\"\n"
+          "\n"
+          "- To get the DNA sequences of a protein with the best scores: curl -i \"http://localhost:5000/Motifs/MLSR?mode=best&top_k=10\"\n"
+          "\n"
+          "- To scan a long sequence (also a FASTA file) on both strands, with a maximum p-value of 0.0001: curl -i -X POST --data-binary @sequence.fa \"http://localhost:5000/Motifs/scan\"\n"
+          "\n"
+          "- To scan with another maximum p-value, or with a minimum probability (min_score) instead: curl -i -X POST --data-binary @sequence.fa \"http://localhost:5000/Motifs/scan?max_pvalue=0.00001\"\n"
+          "\n"
+          "- To get the scores of all the sequences of a FASTA file (also gzipped), one json per line: curl -i -X POST --data-binary @peaks.fa.gz http://localhost:5000/Motifs/fasta\n"
+          "\n"
+          "- To get the visual representation for a motif (PNG, or SVG with ?format=svg): curl -o MA0004.1.png http://localhost:5000/Motifs/motif/graph/MA0004.1\n"
+          "\n"
+          "- To get the metrics of the service (requests, durations, memory) for Prometheus: curl -i http://localhost:5000/metrics\n"
+          "\n"
+          "- To know if the service is ready or still loading the database: curl -i http://localhost:5000/health/ready\n"
           "\n"
           "Just be carefull to typos: don't forget any brackets or escape characters or you will get errors.\n"
           "The suggestion is to copy the commands in the examples above and modify just the part that you need without changing the format.\n"
-          "Also make sure to have the internet connection."
+          "Also make sure to have the internet connection (or use the --jaspar-file or --snapshot options, see the helper)."
           "\n"
           "Now get ready to start and have fun!"
           "\n")
 
-print(welcome_msg)
-
-# The following block of code (about 50 lines) is to create a local copy of the Jaspar database taking it
-# directly from the web, without need to download it first, so there is no problem of path
-# you just need the internet connection
-# The final database will be a list of motifs, which will be dictionaries with 3 keys: motif_id, TF_name and PFM
-# which also will be a dictionaries with 4 keys (the 4 nucleotides) and as values the frequencies
-
-# URL of the Jaspar txt file
-url = 'https://jaspar.elixir.no/download/data/2024/CORE/JASPAR2024_CORE_non-redundant_pfms_jaspar.txt'
-
-response = requests.get(url)
-
-if response.status_code == 200:
-    with open('downloaded_file.txt', 'wb') as f:
-        f.write(response.content)
-else:
-    print('Failed to download the file')
-
-motifs_data = []
-
-with open('downloaded_file.txt', 'r') as file:
-    lines = file.readlines()
-
-for line in lines:
-    # if the line starts with '>' it means it's a new motif, it' a line with the motif_id and the TF_name
-    # So I extract them and put them in a local variable (current_motif) to save data of the current motif
-    # I also prepare the pfm as an empty dictionary
-    # Then put all the data in the list of motifs
-    if line.startswith('>'):
-        current_motif = {}
-        motif_id, tf_name = line.strip().split('\t')[0].split(' ')[0][1:], line.strip().split('\t')[1]
-        current_motif['motif_id'] = motif_id
-        current_motif['TF_name'] = tf_name
-        current_motif['PFM'] = {'A': [], 'C': [], 'G': [], 'T': []}
-        motifs_data.append(current_motif)
-    else:
-        # if it doesn't start with that symbol it means that it's the pfm, so I complete the values with the frequencies
-        nucleotide, freqs_str = line.strip().split('[')[0].strip(), line.strip().split('[')[1].split(']')[0]
-        current_motif['PFM'][nucleotide] = list(map(int, freqs_str.split()))
+# The function below is to display a nicer output to the user when he asks for motifs (for example in the get method),
+# instead of the dictionary. It gives the text of one motif at a time (only the fields asked), so the list of all
+# the motifs can be sent while it's created
+campi_motivi = ('motif_id', 'TF_name', 'PFM')
 
 
-# The function below is to display a nicer output to the user when he asks for motifs (for example in the get method),
-# instead of the dictionary
-def format_all_motifs(motifs_data):
-    formatted_output = ""
+def format_all_motifs(motifs_data, campi=campi_motivi):
     for motif in motifs_data:
-        formatted_output += f"Motif ID: {motif['motif_id']}\n"
-        formatted_output += f"TF Name: {motif['TF_name']}\n"
-        formatted_output += "PFM:\n"
-        for nucleotide, freqs in motif['PFM'].items():
-            formatted_output += f"{nucleotide}: {freqs}\n"
-        formatted_output += "\n"
-    return formatted_output
+        formatted_output = []
+        if 'motif_id' in campi:
+            formatted_output.append(f"Motif ID: {motif['motif_id']}\n")
+        if 'TF_name' in campi:
+            formatted_output.append(f"TF Name: {motif['TF_name']}\n")
+        if 'PFM' in campi:
+            formatted_output.append("PFM:\n")
+            for nucleotide, freqs in pfm_to_dict(motif['PFM']).items():
+                formatted_output.append(f"{nucleotide}: {freqs}\n")
+        formatted_output.append("\n")
+        yield ''.join(formatted_output)
 
 
 # The two function below are also to display nicer outputs, but they are needed with the jsonify objects that are
 # returned to the user when curl something
 
 def format_jsonify_output(json_output):
-    formatted_output = ""
-    for key, value in json_output.items():
-        formatted_output += f"{key}\n{value}\n"
-    return formatted_output
+    return ''.join(f"{key}\n{value}\n" for key, value in json_output.items())
 
 
+# The text is created only once (jsonify would serialize the data in json too, only to replace it)
 def jsonify_formatted(data, status=200):
-    response = jsonify(data)
-    response.status_code = status
-    response.data = format_jsonify_output(data)
-    return response
+    return Response(format_jsonify_output(data), status=status, mimetype='application/json')
+
+
+# Function to read a number (tipo is int or float) from the arguments of the request, or predefinito if it's not
+# given: request.args.get with type returns None for a value that is not a number (like top_k=abc), that would be
+# the same as not giving it, so the value is converted here and a wrong one is an error
+def argomento_numerico(nome, tipo, predefinito=None):
+    valore = request.args.get(nome)
+    if valore is None:
+        return predefinito
+    try:
+        numero = tipo(valore)
+    except ValueError:
+        numero = None
+    # (only the floats can be infinite or NaN: np.isfinite doesn't take the integers too big for numpy)
+    if numero is None or (isinstance(numero, float) and not math.isfinite(numero)):
+        raise ValueError(f'{nome} must be {"a whole number" if tipo is int else "a number"}, not {valore!r}')
+    return numero
 
 
 # Now I'm creating the web service: in the following mostly 150 lines of code I'm creating all the basic
@@ -153,54 +268,370 @@ def jsonify_formatted(data, status=200):
 app = Flask(__name__)
 
 
-# Function to get all the motifs (calling the functions defined above to display them in a nicer way)
+# The following block of code is to measure what the service is doing: GET /metrics returns the metrics in the text
+# format of Prometheus. There are the number of requests and a histogram of their duration for each route, a
+# histogram of the duration of each stage of the slowest requests (the validation, the scores, the sorting, the
+# formatting, the graphs and the loading of the database) and, when they are asked, the number of motifs, the memory
+# used by the process and the state of the caches.
+# The routes are the rules of Flask (for example /Motifs/<sequenza>), not the urls, so the metrics don't grow with
+# every sequence asked
+
+# upper limits (in seconds) of the intervals of the histograms
+limiti_istogrammi = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+descrizioni_metriche = {
+    'jaspar_http_requests_total': ('counter', 'Number of requests, for each route, method and status'),
+    'jaspar_http_request_duration_seconds': ('histogram', 'Duration of the requests, for each route'),
+    'jaspar_stage_duration_seconds': ('histogram', 'Duration of the stages of the requests and of the loading'),
+    'jaspar_profiles_saved_total': ('counter', 'Number of slow requests whose profile was saved'),
+    'jaspar_fit_windows_total': ('counter', 'Windows of the mode=fit scored to the end or dropped before by the bounds'),
+}
+
+
+class Metriche:
+
+    def __init__(self):
+        self.contatori = {}  # (name, labels) -> value
+        self.istogrammi = {}  # (name, labels) -> [requests in each interval (the last one is +Inf), sum, count]
+        self.in_corso = 0
+        self.lock = threading.Lock()
+
+    def incrementa(self, nome, etichette=(), valore=1):
+        with self.lock:
+            self.contatori[(nome, etichette)] = self.contatori.get((nome, etichette), 0) + valore
+
+    def osserva(self, nome, etichette, secondi):
+        with self.lock:
+            istogramma = self.istogrammi.get((nome, etichette))
+            if istogramma is None:
+                istogramma = self.istogrammi[(nome, etichette)] = [[0] * (len(limiti_istogrammi) + 1), 0.0, 0]
+            istogramma[0][bisect_left(limiti_istogrammi, secondi)] += 1
+            istogramma[1] += secondi
+            istogramma[2] += 1
+
+    # Context to measure a stage (for example with metriche.fase('graph_render'): ...)
+    @contextmanager
+    def fase(self, nome):
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.osserva('jaspar_stage_duration_seconds', (('stage', nome),), time.perf_counter() - inizio)
+
+    # For the stages that follow one after the other in the same function: it measures the stage that started at
+    # inizio and returns the start of the next one
+    def fine_fase(self, nome, inizio):
+        adesso = time.perf_counter()
+        self.osserva('jaspar_stage_duration_seconds', (('stage', nome),), adesso - inizio)
+        return adesso
+
+    def testo(self, valori_istantanei):
+        with self.lock:
+            contatori = sorted(self.contatori.items())
+            istogrammi = sorted((chiave, (list(intervalli), somma, numero))
+                                for chiave, (intervalli, somma, numero) in self.istogrammi.items())
+            valori_istantanei = [('jaspar_requests_in_progress', 'gauge', 'Requests being answered now',
+                                  self.in_corso)] + valori_istantanei
+
+        righe = []
+        scritte = set()
+
+        def intestazione(nome, tipo=None, descrizione=None):
+            if nome not in scritte:
+                scritte.add(nome)
+                if tipo is None:
+                    tipo, descrizione = descrizioni_metriche[nome]
+                righe.append(f'# HELP {nome} {descrizione}\n# TYPE {nome} {tipo}\n')
+
+        for (nome, etichette), valore in contatori:
+            intestazione(nome)
+            righe.append(f'{nome}{formato_etichette(etichette)} {valore}\n')
+        for (nome, etichette), (intervalli, somma, numero) in istogrammi:
+            intestazione(nome)
+            cumulativo = 0
+            for limite, richieste in zip(limiti_istogrammi + ('+Inf',), intervalli):
+                cumulativo += richieste
+                righe.append(f'{nome}_bucket{formato_etichette(etichette + (("le", str(limite)),))} {cumulativo}\n')
+            righe.append(f'{nome}_sum{formato_etichette(etichette)} {somma}\n')
+            righe.append(f'{nome}_count{formato_etichette(etichette)} {numero}\n')
+        for nome, tipo, descrizione, valore in valori_istantanei:
+            intestazione(nome, tipo, descrizione)
+            righe.append(f'{nome} {valore}\n')
+        return ''.join(righe)
+
+
+# the values of the labels are between quotes, so the backslashes, the quotes and the new lines must be escaped
+def formato_etichette(etichette):
+    if not etichette:
+        return ''
+    return '{' + ','.join(f'{nome}="{escape_etichetta(valore)}"' for nome, valore in etichette) + '}'
+
+
+def escape_etichetta(valore):
+    return str(valore).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metriche = Metriche()
+
+
+# Memory used by the process now (from /proc, only on Linux) and the maximum used since the start (ru_maxrss is in
+# kilobytes on Linux and in bytes on macOS)
+def memoria_processo():
+    massima = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    try:
+        with open('/proc/self/statm') as file:
+            attuale = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        attuale = massima
+    return attuale, massima
+
+
+# Profiles of the slow requests: with the option --profile-slow-ms the requests are measured with cProfile and, if
+# they take more than that time, their profile is saved in the directory of --profile-dir (it can be read with
+# python -m pstats or snakeviz). Only one request at a time is profiled (the others that arrive in the meantime are
+# not), so the service is slowed down only a little. cProfile measures only the thread where it's enabled, so the
+# slow jobs of the request (done in the threads of LavoriPesanti) have their own profile, that is saved together with
+# the one of the request
+soglia_profilo = None
+cartella_profili = 'profiles'
+lock_profilo = threading.Lock()
+numeri_profili = count(1)
+
+
+@app.before_request
+def inizio_richiesta():
+    g.inizio_richiesta = time.perf_counter()
+    g.profilo = None
+    with metriche.lock:
+        metriche.in_corso += 1
+    if soglia_profilo is not None and lock_profilo.acquire(blocking=False):
+        g.profili_lavori = []
+        g.profilo = cProfile.Profile()
+        g.profilo.enable()
+
+
+# Function to do a job of a profiled request in the thread of LavoriPesanti, with its profile
+def profila_lavoro(profili, funzione, *argomenti):
+    profilo = cProfile.Profile()
+    profili.append(profilo)
+    profilo.enable()
+    try:
+        return funzione(*argomenti)
+    finally:
+        profilo.disable()
+
+
+# The request is finished when its response is closed: for the responses sent while they are created (like the list
+# of the motifs or the FASTA files) this happens after the last line, so the duration is the one of all the response.
+# The context of the request doesn't exist anymore in that moment, so what is needed is taken before. If the request
+# ends with an error that Flask doesn't handle, there is no response and it's measured at the end of its context.
+# The list of the profiles of the jobs is left in g, because the jobs of a streamed response are done after this
+def dati_richiesta():
+    route = request.url_rule.rule if request.url_rule is not None else 'not_found'
+    return g.pop('inizio_richiesta'), g.pop('profilo'), g.get('profili_lavori'), route, request.method
+
+
+@app.after_request
+def registra_fine_richiesta(risposta):
+    dati = dati_richiesta()
+    risposta.call_on_close(lambda: fine_richiesta(*dati, risposta.status_code))
+    return risposta
+
+
+@app.teardown_request
+def errore_richiesta(errore):
+    if 'inizio_richiesta' in g:
+        fine_richiesta(*dati_richiesta(), 500)
+
+
+def fine_richiesta(inizio, profilo, profili_lavori, route, metodo, stato):
+    durata = time.perf_counter() - inizio
+    with metriche.lock:
+        metriche.in_corso -= 1
+    metriche.incrementa('jaspar_http_requests_total', (('route', route), ('method', metodo), ('status', str(stato))))
+    metriche.osserva('jaspar_http_request_duration_seconds', (('route', route),), durata)
+
+    if profilo is not None:
+        profilo.disable()
+        try:
+            if durata * 1000 >= soglia_profilo:
+                os.makedirs(cartella_profili, exist_ok=True)
+                nome = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+                pstats.Stats(profilo, *profili_lavori).dump_stats(os.path.join(
+                    cartella_profili, f'{time.strftime("%Y%m%d-%H%M%S")}-{next(numeri_profili)}-{nome}-{int(durata * 1000)}ms.prof'))
+                metriche.incrementa('jaspar_profiles_saved_total')
+        except OSError as e:
+            print(f'Failed to save the profile of a slow request: {e}')
+        finally:
+            lock_profilo.release()
+
+
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    versione = motif_store.snapshot()
+    memoria_attuale, memoria_massima = memoria_processo()
+    cache = risultati_cache.statistiche()
+    valori = [
+        ('jaspar_motifs', 'gauge', 'Number of motifs in the database', len(versione)),
+        ('jaspar_motif_lengths', 'gauge', 'Number of different lengths of the motifs', len(versione.buckets)),
+        ('jaspar_database_version', 'gauge', 'Number of changes done to the database since the start',
+         versione.numero),
+        ('process_resident_memory_bytes', 'gauge', 'Memory used by the process', memoria_attuale),
+        ('process_max_resident_memory_bytes', 'gauge', 'Maximum memory used by the process since the start',
+         memoria_massima),
+        ('process_start_time_seconds', 'gauge', 'Start of the service (unix time)', istante_avvio / 1000),
+        ('jaspar_result_cache_hits_total', 'counter', 'Scores taken from the cache', cache['hits']),
+        ('jaspar_result_cache_misses_total', 'counter', 'Scores not in the cache', cache['misses']),
+        ('jaspar_result_cache_evictions_total', 'counter', 'Scores deleted from the full cache', cache['evictions']),
+        ('jaspar_result_cache_invalidations_total', 'counter', 'Scores deleted from the cache by a change of the motifs',
+         cache['invalidations']),
+        ('jaspar_result_cache_entries', 'gauge', 'Scores in the cache', cache['entries']),
+        ('jaspar_result_cache_bytes', 'gauge', 'Estimated memory used by the cache of the scores', cache['bytes']),
+        ('jaspar_graph_cache_entries', 'gauge', 'Images in the cache of the graphs', len(grafici_cache.immagini)),
+        ('jaspar_graph_cache_bytes', 'gauge', 'Memory used by the cache of the graphs', grafici_cache.byte),
+    ]
+    return Response(metriche.testo(valori), mimetype='text/plain; version=0.0.4')
+
+
+# Function to get all the motifs (calling the functions defined above to display them in a nicer way).
+# The motifs are in alphabetical order of ID and they can be filtered by TF name (tf_name) and by length (length);
+# with limit they are returned a page at a time: the page ends with the cursor of the next one (also in the header
+# X-Next-Cursor), that is the last ID of the page, to give with the argument cursor. With fields only some of the
+# fields are returned (for example fields=motif_id,TF_name) and with format=ndjson the motifs are returned as one
+# json for line.
+# The response is sent while it's created, and it has the version of the database as ETag: who asks again with
+# If-None-Match gets only a 304 Not Modified if the database didn't change in the meantime, without downloading again
+# all the motifs. There is no Last-Modified, because its seconds can't tell apart two changes in the same second.
+# Without format, the format depends on the header Accept, so the response says it with Vary
+
+# The ETags of different starts of the service must be different, because the versions start again from 0
+istante_avvio = int(time.time() * 1000)
+
+
+def etag_versione(versione):
+    return f'{istante_avvio}-{versione.numero}'
+
+
+def intestazioni_cache(versione):
+    return {'ETag': f'"{etag_versione(versione)}"', 'Vary': 'Accept'}
+
+
+def motif_to_dict(motif, campi=campi_motivi):
+    return {campo: pfm_to_dict(motif[campo]) if campo == 'PFM' else motif[campo] for campo in campi}
+
+
 @app.route('/Motifs/motif', methods=['GET'])
 def getAllMotifs():
-    return jsonify_formatted({'Motifs:': format_all_motifs(motifs_data)})
+    versione = motif_store.snapshot()
+    intestazioni = intestazioni_cache(versione)
+    if not is_resource_modified(request.environ, etag=etag_versione(versione)):
+        return Response(status=304, headers=intestazioni)
+
+    try:
+        campi = tuple(request.args.get('fields', ','.join(campi_motivi)).split(','))
+        if not campi or not set(campi) <= set(campi_motivi):
+            raise ValueError(f'The fields must be some of {", ".join(campi_motivi)}')
+
+        formato = request.args.get('format')
+        if formato is None:
+            formato = 'ndjson' if request.accept_mimetypes.best_match(
+                ['text/plain', 'application/x-ndjson']) == 'application/x-ndjson' else 'text'
+        if formato not in ('text', 'ndjson'):
+            raise ValueError('The format must be text or ndjson')
+
+        limite = argomento_numerico('limit', int)
+        if limite is not None and limite < 1:
+            raise ValueError('The limit must be a positive number')
+
+        # the IDs of the motifs asked, in alphabetical order
+        tf_name = request.args.get('tf_name')
+        lunghezza = argomento_numerico('length', int)
+        if tf_name is None and lunghezza is None:
+            motif_ids = versione.ids_ordinati()
+        else:
+            motifs = versione.by_tf_name(tf_name) if tf_name is not None else versione.by_length(lunghezza)
+            motif_ids = sorted(motif['motif_id'] for motif in motifs
+                               if lunghezza is None or motif['PFM'].shape[1] == lunghezza)
+
+    except ValueError as ve:
+        return jsonify_formatted({'ERROR:': str(ve)}), 400
+
+    # the page starts after the cursor, and it ends after limit motifs
+    inizio = bisect_right(motif_ids, request.args['cursor']) if 'cursor' in request.args else 0
+    fine = len(motif_ids) if limite is None else min(inizio + limite, len(motif_ids))
+    prossimo_cursore = motif_ids[fine - 1] if fine < len(motif_ids) else None
+    if prossimo_cursore is not None:
+        intestazioni['X-Next-Cursor'] = prossimo_cursore
+
+    def genera_motivi():
+        motifs = (versione.motifs[motif_id] for motif_id in motif_ids[inizio:fine])
+        if formato == 'ndjson':
+            for motif in motifs:
+                yield json.dumps(motif_to_dict(motif, campi)) + '\n'
+            if prossimo_cursore is not None:
+                yield json.dumps({'next_cursor': prossimo_cursore}) + '\n'
+            return
+        yield 'Motifs:\n'
+        yield from format_all_motifs(motifs, campi)
+        yield '\n'
+        if prossimo_cursore is not None:
+            yield f'Next cursor:\n{prossimo_cursore}\n'
+
+    mimetype = 'application/x-ndjson' if formato == 'ndjson' else 'application/json'
+    return Response(stream_with_context(genera_motivi()), mimetype=mimetype, headers=intestazioni)
 
 
 # This function below is to check if a motif is really in the database
 def check_motif_id_exists(motif_id):
-    motif_ids = [motif['motif_id'] for motif in motifs_data]
-    return motif_id in motif_ids
+    return motif_id in motif_store
 
 
 # Function to get just one specific motif
 @app.route('/Motifs/motif/<motif_id>', methods=['GET'])
 def getMotif(motif_id):
     try:
-        # First I control if the motif is really in the database
-        if not check_motif_id_exists(motif_id):
+        # First I control if the motif is really in the database (taking it only once, because it could be deleted
+        # in the meantime by another request)
+        motif = motif_store.get(motif_id)
+        if motif is None:
             raise ValueError('Motif ID not found')
 
-        m = [motif for motif in motifs_data if (motif['motif_id'] == motif_id)]
-        return jsonify_formatted({f'motif {motif_id}:': format_all_motifs(m)})
+        m = [motif]
+        return jsonify_formatted({f'motif {motif_id}:': ''.join(format_all_motifs(m))})
 
     except ValueError as ve:
         return jsonify_formatted({'ERROR:': str(ve)}), 400
 
 
-# The following function is to check if the PFM has the right format
+# The following function is to check if the PFM has the right format, and to convert it in an array: it's used for the
+# single motifs (POST and PUT) and for each motif of the bulk requests and of the imports
 def validate_pfm(pfm):
     # Check if PFM data is a dictionary
     if not isinstance(pfm, dict):
         raise ValueError('PFM data is not a dictionary')
 
     # Check if keys are correct and in the correct order
-    expected_keys = ['A', 'C', 'G', 'T']
-    if list(pfm.keys()) != expected_keys:
+    if list(pfm.keys()) != nucleotidi:
         raise ValueError('Invalid PFM format: incorrect keys')
 
-    # Check if values are lists of numbers
-    length_of_list = None
-    for key, value in pfm.items():
-        if not isinstance(value, list) or not all(isinstance(num, (int, float)) for num in value):
+    # Check if values are lists of numbers (true and false are numbers for Python, but not counts)
+    for value in pfm.values():
+        if not isinstance(value, list) or \
+                not all(isinstance(num, (int, float)) and not isinstance(num, bool) for num in value):
             raise ValueError('Invalid PFM format: non-numeric values')
+    if len({len(value) for value in pfm.values()}) != 1:
+        raise ValueError('Invalid PFM format: list of nucleotides must be of the same dimension')
+    if not pfm['A']:
+        raise ValueError('Invalid PFM format: the lists of nucleotides are empty')
 
-        if length_of_list is None:
-            length_of_list = len(value)
-        elif len(value) != length_of_list:
-            raise ValueError('Invalid PFM format: list of nucleotides must be of the same dimension')
+    # and the counts must be finite and not negative (an integer too big for numpy is not a count either)
+    try:
+        matrice = pfm_to_array(pfm)
+    except OverflowError:
+        matrice = None
+    if matrice is None or not (np.isfinite(matrice) & (matrice >= 0)).all():
+        raise ValueError('Invalid PFM format: the counts must be positive numbers')
+    return matrice
 
 
 # Function to modify an already existing motif
@@ -211,19 +642,25 @@ def updateMotif(motif_id):
         if not check_motif_id_exists(motif_id):
             raise ValueError('Motif ID not found')
 
-        m = [motif for motif in motifs_data if (motif['motif_id'] == motif_id)]
         data = request.json
-        if 'TF_name' in data:
-            tf_name = data.get('TF_name')
-            m[0]['TF_name'] = tf_name
-
-        if 'PFM' in data:
-            pfm = data.get('PFM')
-
-        # here I check if the pfm has the right format with the function defined above
-            validate_pfm(pfm)
-
-            m[0]['PFM'] = pfm
+        if not isinstance(data, dict):
+            raise ValueError('The body must be a json with the fields of the motif')
+        tf_name = data.get('TF_name')
+        pfm = data.get('PFM')
+
+        if tf_name is not None and (not isinstance(tf_name, str) or not tf_name):
+            raise ValueError('The TF name must be a non-empty string')
+        if pfm is not None:
+            # here I check if the pfm has the right format with the function defined above
+            pfm = validate_pfm(pfm)
+
+        with motif_store.scrittura() as modifica:
+            modifica.update(motif_id, tf_name=tf_name, pfm=pfm)
+            numero = registra_modifica({'op': 'put', 'motif_id': motif_id, 'TF_name': tf_name,
+                                        'PFM': pfm_to_dict(pfm) if pfm is not None else None})
+        risultati_cache.invalida(modifica.buckets_copiati)
+        conferma_modifica(numero)
+        grafici_cache.invalida(motif_id)
 
         # If everything okay return a statement of successful update
         return jsonify_formatted({f'updated motif {motif_id}': 'Check again the database to see the difference'})
@@ -235,17 +672,23 @@ def updateMotif(motif_id):
 # function to post a new motif
 @app.route('/Motifs/motif', methods=['POST'])
 def CreateMotif():
-    data = request.json
-    motif_id = data.get('motif_id')
-    tf_name = data.get('TF_name')
-    pfm = data.get('PFM')
-
     try:
+        data = request.json
+        if not isinstance(data, dict):
+            raise ValueError('The body must be a json with the fields of the motif')
+        motif_id = data.get('motif_id')
+        tf_name = data.get('TF_name')
+        pfm = data.get('PFM')
+
         # controls that all fields are present and not omitted in the post request
         if motif_id is None:
             raise ValueError('Motif ID is missing')
+        if not isinstance(motif_id, str):
+            raise ValueError('Invalid motif ID format')
         if tf_name is None:
             raise ValueError('TF name is missing')
+        if not isinstance(tf_name, str) or not tf_name:
+            raise ValueError('The TF name must be a non-empty string')
         if pfm is None:
             raise ValueError('PFM data is missing')
 
@@ -260,14 +703,13 @@ def CreateMotif():
             raise ValueError('Invalid motif ID format')
 
         # here I check if the pfm has the right format with the function defined above
-        validate_pfm(pfm)
-
-        new_motif = {
-            'motif_id': motif_id,
-            'TF_name': tf_name,
-            'PFM': pfm
-        }
-        motifs_data.append(new_motif)
+        matrice = validate_pfm(pfm)
+
+        with motif_store.scrittura() as modifica:
+            modifica.add(motif_id, tf_name, matrice)
+            numero = registra_modifica({'op': 'put', 'motif_id': motif_id, 'TF_name': tf_name, 'PFM': pfm})
+        risultati_cache.invalida(modifica.buckets_copiati)
+        conferma_modifica(numero)
         # If everything okay return a statement of successful post
         return jsonify_formatted({f'The motif {motif_id} was added': 'Check again the database to see it in the end!'})
 
@@ -282,67 +724,1796 @@ def DeleteMotif(motif_id):
         if not check_motif_id_exists(motif_id):
             raise ValueError('Motif ID not found')
 
-        m = [motif for motif in motifs_data if (motif['motif_id'] == motif_id)]
-        motifs_data.remove(m[0])
+        with motif_store.scrittura() as modifica:
+            modifica.delete(motif_id)
+            numero = registra_modifica({'op': 'delete', 'motif_id': motif_id})
+        risultati_cache.invalida(modifica.buckets_copiati)
+        conferma_modifica(numero)
+        grafici_cache.invalida(motif_id)
         return jsonify_formatted({'Deletion done': f'The motif {motif_id} was deleted'})
 
     except ValueError as ve:
         return jsonify_formatted({'ERROR:': str(ve)}), 400
 
+
+# The following functions are to change many motifs with a single request: a list of motifs to add or replace and of
+# IDs to delete (POST /Motifs/bulk), or a whole file of motifs in the Jaspar, MEME or TRANSFAC format
+# (POST /Motifs/import). All the changes of a request are a single change of the database: they are checked all
+# before changing anything, the buckets are computed again once for each length, they are written in the log as a
+# single line and the readers see all of them together, or none of them if there is an error
+
+pattern_motif_id = re.compile(r'^MA\d{4}\.\d$')
+errori_mostrati = 20
+
+
+# Function to check many motifs together and convert their PFMs in arrays, with validate_pfm as for a single motif.
+# All the motifs are checked, so all the errors are returned together (the first ones).
+# It returns the motifs ready for MotifChange.upsert_many, or raises a ValueError with the errors found
+def valida_motivi(motifs):
+    errori, validi, visti = [], [], set()
+    for numero, motif in enumerate(motifs, 1):
+        if not isinstance(motif, dict):
+            errori.append(f'motif {numero}: it is not a dictionary')
+            continue
+        motif_id, tf_name, pfm = motif.get('motif_id'), motif.get('TF_name'), motif.get('PFM')
+        if not isinstance(motif_id, str) or not pattern_motif_id.match(motif_id):
+            errori.append(f'motif {numero}: Invalid motif ID format')
+        elif motif_id in visti:
+            errori.append(f'{motif_id}: Motif ID repeated')
+        elif not isinstance(tf_name, str):
+            errori.append(f'{motif_id}: TF name is missing')
+        else:
+            visti.add(motif_id)
+            try:
+                validi.append({'motif_id': motif_id, 'TF_name': tf_name, 'PFM': validate_pfm(pfm)})
+            except ValueError as ve:
+                errori.append(f'{motif_id}: {ve}')
+
+    if errori:
+        raise ValueError(f'{len(errori)} motifs are not valid, nothing was changed: '
+                         + '; '.join(errori[:errori_mostrati]) + ('; ...' if len(errori) > errori_mostrati else ''))
+    return validi
+
+
+# Function to do the changes of a bulk request in a single change of the database. It returns the number of motifs
+# added, replaced and deleted
+def applica_lotto(motifs, da_eliminare):
+    if len(set(da_eliminare)) != len(da_eliminare):
+        raise ValueError('Motif ID repeated in the list to delete')
+    comuni = set(da_eliminare).intersection(motif['motif_id'] for motif in motifs)
+    if comuni:
+        raise ValueError(f'Motif IDs both to add and to delete: {", ".join(sorted(comuni)[:errori_mostrati])}')
+
+    with motif_store.scrittura() as modifica:
+        mancanti = [motif_id for motif_id in da_eliminare if motif_id not in modifica]
+        if mancanti:
+            raise ValueError(f'Motif ID not found: {", ".join(mancanti[:errori_mostrati])}')
+        sostituiti = [motif['motif_id'] for motif in motifs if motif['motif_id'] in modifica]
+        eliminati = modifica.delete_many(da_eliminare)
+        aggiunti, aggiornati = modifica.upsert_many(motifs)
+        numero = registra_modifica({'op': 'batch', 'delete': da_eliminare,
+                                    'upsert': [{'motif_id': motif['motif_id'], 'TF_name': motif['TF_name'],
+                                                'PFM': pfm_to_dict(motif['PFM'])} for motif in motifs]})
+    risultati_cache.invalida(modifica.buckets_copiati)
+    conferma_modifica(numero)
+    for motif_id in chain(da_eliminare, sostituiti):
+        grafici_cache.invalida(motif_id)
+    return aggiunti, aggiornati, eliminati
+
+
+# The body is a json with the motifs to add or replace (the same fields of the POST of a single motif) and the IDs to
+# delete, for example {"upsert": [{"motif_id": "MA1234.1", "TF_name": "name", "PFM": {...}}], "delete": ["MA0004.1"]}
+@app.route('/Motifs/bulk', methods=['POST'])
+def BulkMotifs():
+    try:
+        data = request.json
+        if not isinstance(data, dict):
+            raise ValueError('The body must be a json with the list of motifs to upsert and of IDs to delete')
+        upsert, da_eliminare = data.get('upsert', []), data.get('delete', [])
+        if not isinstance(upsert, list) or not isinstance(da_eliminare, list) or \
+                not all(isinstance(motif_id, str) for motif_id in da_eliminare):
+            raise ValueError('upsert must be a list of motifs and delete a list of motif IDs')
+        if not upsert and not da_eliminare:
+            raise ValueError('There are no motifs to change')
+
+        with metriche.fase('bulk_validation'):
+            motifs = valida_motivi(upsert)
+        with metriche.fase('bulk_apply'):
+            aggiunti, aggiornati, eliminati = applica_lotto(motifs, da_eliminare)
+        return jsonify_formatted({'Bulk change done': f'{aggiunti} motifs added, {aggiornati} updated, '
+                                                      f'{eliminati} deleted'})
+
+    except ValueError as ve:
+        return jsonify_formatted({'ERROR:': str(ve)}), 400
+
+
+# The body is the file (also gzipped), the format is recognized from its first lines or given with the argument format.
+# The motifs of the file are added, or replaced if they already exist
+@app.route('/Motifs/import', methods=['POST'])
+def ImportMotifs():
+    try:
+        testo = ''.join(leggi_testo_richiesta(request.stream))
+        formato = request.args.get('format') or formato_file_motivi(testo)
+        if formato not in formati_import:
+            raise ValueError('The format must be jaspar, meme or transfac')
+        try:
+            motifs = list(formati_import[formato](testo.splitlines()))
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+            raise ValueError(f'The file is not a valid {formato} file: {e}')
+        if not motifs:
+            raise ValueError('There are no motifs in the file')
+        # the service uses only the IDs of Jaspar: the other IDs (like the M00001 of TRANSFAC or the names of MEME)
+        # are not changed into Jaspar IDs, because they would look like motifs of Jaspar that they are not
+        estranei = [motif['motif_id'] for motif in motifs if not pattern_motif_id.match(motif['motif_id'])]
+        if estranei:
+            raise ValueError(f'The motif IDs must have the Jaspar format MA followed by 4 digits, a dot and the version '
+                             f'(for example MA0004.1): change the IDs of the {formato} file before importing it. '
+                             f'Wrong IDs: {", ".join(estranei[:errori_mostrati])}'
+                             + (', ...' if len(estranei) > errori_mostrati else ''))
+
+        with metriche.fase('bulk_validation'):
+            motifs = valida_motivi(motifs)
+        with metriche.fase('bulk_apply'):
+            aggiunti, aggiornati, _ = applica_lotto(motifs, [])
+        return jsonify_formatted({f'Import of {len(motifs)} motifs ({formato} format) done':
+                                  f'{aggiunti} motifs added, {aggiornati} updated'})
+
+    except ValueError as ve:
+        return jsonify_formatted({'ERROR:': str(ve)}), 400
+
 # The following about 130 lines of codes are to create the additional function to get the score
 # for all motifs of the same length, given a sequence
 # I'm also giving the possibility to give an RNA sequence translating the U to T, and also if you try to give
-# a protein sequence I'm going to give you all the possible DNA sequences for that protein sequence, so you can retry
-# to get the score for one of the DNA sequences
+# a protein sequence I'm going to give you all the possible DNA sequences for that protein sequence (a page at a time),
+# so you can retry to get the score for one of the DNA sequences, or directly the ones with the best scores
 
-# First function is just to display a nicer output for the scores
+# First function is just to display a nicer output for the scores: a line for each motif with its ID, its score and
+# its p-value (only with the log-odds scores)
 def format_frequenzeMotivi_output(frequenze_motivi):
-    formatted_output = ""
-    for key, value in frequenze_motivi.items():
-        formatted_output += f"{key}\t{value}\n"
-    return formatted_output
+    return ''.join(f"{motif_id}\t{score}" + (f"\t{pvalore}" if pvalore is not None else "")
+                   + (f"\t{filamento}\n" if filamento is not None else "\n")
+                   for motif_id, score, pvalore, filamento in frequenze_motivi)
+
+
+# The score of a sequence is the product of the normalized frequencies of its letters in each position of the motif.
+# To avoid going through all the motifs (and normalizing them again) at each request, I'm precomputing the normalized
+# matrices only once: the motifs are grouped by length and for each length I keep a tensor of shape
+# (number of motifs x length x 4) with the probabilities and one with their logarithms.
+# In this way scoring a sequence is just taking the right nucleotide in each position and summing over one bucket,
+# and working with the logarithms the products of small probabilities don't underflow anymore for long motifs
+
+nucleotidi = ['A', 'C', 'G', 'T']
+
+# Table to convert a sequence into the indices of its nucleotides (4 for letters that are not nucleotides, like N)
+tabella_codifica = np.full(256, 4, dtype=np.uint8)
+for indice, nucleotide in enumerate(nucleotidi):
+    tabella_codifica[ord(nucleotide)] = indice
+    tabella_codifica[ord(nucleotide.lower())] = indice
+
+
+def codifica_sequenza(sequenza):
+    return tabella_codifica[np.frombuffer(sequenza.encode('ascii'), dtype=np.uint8)]
+
+
+# In the database the PFM of a motif is kept as an array of shape (4 x length), with the rows in the order A, C, G, T:
+# these two functions are to convert it from and to the dictionary used in the requests and in the outputs
+def pfm_to_array(pfm):
+    valori = [pfm[nucleotide] for nucleotide in nucleotidi]
+    if all(isinstance(num, int) for riga in valori for num in riga):
+        return np.array(valori, dtype=np.int64)
+    return np.array(valori, dtype=np.float64)
+
+
+def pfm_to_dict(pfm):
+    return dict(zip(nucleotidi, pfm.tolist()))
 
 
 # This function is to normalize the numbers in the pfm so the scores are normalized
 def normalizza_pfm(pfm):
-    pfm_normalizzata = {}
-    numero_colonne = len(list(pfm.values())[0])
+    somma_colonne = pfm.sum(axis=0)
+    # a column with all zeros would be a division by zero, I leave it with probability 0 for all the nucleotides
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(somma_colonne > 0, pfm / somma_colonne, 0.0)
+
+
+# The score above is 0 as soon as a nucleotide never appears in a position of the motif, and the scores of motifs of
+# different lengths can't be compared. So there is also the log-odds score (in bits) of the position weight matrix:
+# for each position the logarithm of the probability of the nucleotide in the motif (with a pseudocount, so it's
+# never 0) divided by its probability in the background DNA. The pseudocount and the background can be chosen with
+# the options --pseudocount and --background
+pseudoconteggio = 0.8
+frequenze_fondo = np.full(4, 0.25)
+
+
+def pwm_log_odds(pfm):
+    somma_colonne = pfm.sum(axis=0)
+    probabilita = (pfm + pseudoconteggio * frequenze_fondo[:, None]) / (somma_colonne + pseudoconteggio)
+    return np.log2(probabilita / frequenze_fondo[:, None]).T
+
+
+# To know how much a log-odds score is significant there is its p-value: the probability that a random sequence of
+# the background gets at least that score. For each motif I compute the distribution of the scores only once, when
+# the motif is added, with the dynamic programming on the positions: the score of each nucleotide at each position is
+# rounded to a whole number of intervals (intervalli_pvalori between the minimum and the maximum score of the motif),
+# and the distribution after a position is the one before it shifted by the intervals of each nucleotide (times the
+# probability of the nucleotide in the background). The table of a motif has the p-value of each interval.
+# The log-odds matrices used for all the scores are the rounded ones (the difference is less than a thousandth of the
+# range of the scores of the motif), so the interval of a score is exactly the sum of the intervals of its
+# nucleotides and getting a p-value at request time is just reading it in the table.
+# The reverse strand is scored with the reverse complement of the matrix, whose distribution is the one of the matrix
+# with the background of the complementary nucleotides: it's the same when the background has A=T and C=G (like the
+# default one), otherwise each motif has a second table for the reverse strand (code_inverse, that is empty when it
+# isn't needed)
+intervalli_pvalori = 2000
+
+
+def tabelle_pvalori(pwm):
+    minimi_colonne = pwm.min(axis=2)
+    minimi = minimi_colonne.sum(axis=1)
+    massimi = pwm.max(axis=2).sum(axis=1)
+    scale = intervalli_pvalori / np.maximum(massimi - minimi, 1e-9)  # intervals for each bit
+    interi = np.rint((pwm - minimi_colonne[:, :, None]) * scale[:, None, None]).astype(np.int64)
+    pwm_arrotondate = minimi_colonne[:, :, None] + interi / scale[:, None, None]
+
+    numero_motivi, lunghezza = pwm.shape[:2]
+    # with the rounding of each position the sum can go a bit after intervalli_pvalori
+    dimensione = intervalli_pvalori + lunghezza + 1
+
+    def code_fondo(fondo):
+        distribuzioni = np.zeros((numero_motivi, dimensione))
+        for motivo in range(numero_motivi):
+            distribuzione = np.zeros(dimensione)
+            distribuzione[0] = 1
+            fine = 1  # the scores after fine can't be reached yet
+            for posizione in range(lunghezza):
+                nuova = np.zeros(dimensione)
+                for nucleotide, spostamento in enumerate(interi[motivo, posizione]):
+                    nuova[spostamento:spostamento + fine] += distribuzione[:fine] * fondo[nucleotide]
+                fine += interi[motivo, posizione].max()
+                distribuzione = nuova
+            distribuzioni[motivo] = distribuzione
+        # p-value of each interval: probability of a score in that interval or in the following ones
+        return np.minimum(np.cumsum(distribuzioni[:, ::-1], axis=1)[:, ::-1], 1.0)
+
+    # (the complement of A, C, G, T is T, G, C, A, so the background of the complementary nucleotides is reversed)
+    if np.allclose(frequenze_fondo, frequenze_fondo[::-1]):
+        code_inverse = np.zeros((numero_motivi, 0))
+    else:
+        code_inverse = code_fondo(frequenze_fondo[::-1])
+    return pwm_arrotondate, minimi, scale, code_fondo(frequenze_fondo), code_inverse
+
+
+# The table of the p-values of a bucket for the forward strand or for the reverse one
+def tabella_pvalori(bucket, inverso=False):
+    return bucket['code_inverse'] if inverso and bucket['code_inverse'].shape[1] else bucket['code']
+
+
+# Function to get the p-values of the log-odds scores of some motifs of a bucket (righe are their positions):
+# inversi tells which scores are on the reverse strand (one for all the scores or one for each score)
+def pvalori(bucket, righe, score, inversi=False):
+    intervalli = np.rint((score - bucket['minimi'][righe]) * bucket['scale'][righe]).astype(np.int64)
+    intervalli = np.clip(intervalli, 0, bucket['code'].shape[1] - 1)
+    risultato = bucket['code'][righe, intervalli]
+    if bucket['code_inverse'].shape[1] and np.any(inversi):
+        risultato = np.where(inversi, bucket['code_inverse'][righe, intervalli], risultato)
+    return risultato
+
+
+# Function to get the minimum log-odds score of each motif of a bucket to have a p-value not bigger than max_pvalue
+# (infinite if no score is so rare), on one strand: it's the first interval of the table with a p-value small enough
+def soglie_pvalore(bucket, max_pvalue, inverso=False):
+    code = tabella_pvalori(bucket, inverso)
+    primi = (code > max_pvalue).sum(axis=1)
+    return np.where(primi < code.shape[1], bucket['minimi'] + (primi - 0.5) / bucket['scale'], np.inf)
+
+
+# Function to choose the best strand of each motif, from the scores on each strand (a row for each one) and their
+# keys to sort them: the one with the smallest key, with the same key the one with the biggest score, and the first
+# one if they are the same
+def filamenti_migliori(score, chiavi):
+    return np.lexsort((-score, chiavi), axis=0)[0]
+
+
+# All the arrays of a bucket, with a row for each motif
+campi_bucket = ('prob', 'log', 'pwm', 'minimi', 'scale', 'code', 'code_inverse', 'soglie_pvalori',
+                'soglie_pvalori_inverse', 'blocchi_log', 'spostamenti_log', 'limiti_log', 'blocchi_pwm',
+                'spostamenti_pwm', 'limiti_pwm')
+
+
+# The minimum log-odds score of each motif for some p-values (8 for each power of 10, from 1 to 1e-20), used by
+# cerca_motivi to skip the motifs and the windows without reading the tables of the p-values: the p-values of each
+# table only decrease, so the first interval with a p-value not bigger than each one of the grid is found with a
+# binary search (an empty table, like code_inverse when it isn't needed, gives no scores)
+griglia_pvalori = 10.0 ** (-np.arange(161) / 8)
+
+
+def soglie_griglia(minimi, scale, code):
+    if not code.shape[1]:
+        return np.zeros((len(code), 0))
+    primi = np.array([np.searchsorted(-riga, -griglia_pvalori) for riga in code]).reshape(len(code), len(griglia_pvalori))
+    return np.where(primi < code.shape[1], minimi[:, None] + (primi - 0.5) / scale[:, None] - 1e-9, np.inf)
+
+
+# Function to get the tables used by cerca_motivi for the log matrices or the log-odds ones. The motifs are divided
+# in blocks of 4 positions (the last one is completed with positions that count 0), and each block has the score of
+# each of the 256 4-mers (the 4-mer 64*a + 16*b + 4*c + d is the one with the nucleotides a, b, c, d), so 4 positions
+# of a window are scored with a single reading. The blocks are sorted from the one whose best score is farthest
+# from the score of a random sequence (the most selective one), because scoring them first drops more windows
+# earlier: spostamenti has the first position of each block in the motif, and limiti[:, j] the best score of the
+# blocks from j to the end (so limiti[:, 0] is the best score of the motif and the last column is 0), that are the
+# bounds of the search
+def tabelle_ricerca(matrici):
+    numero_motivi, lunghezza = matrici.shape[:2]
+    numero_blocchi = -(-lunghezza // 4)
+    colonne = np.zeros((numero_motivi, 4 * numero_blocchi, 4))
+    colonne[:, :lunghezza] = matrici
+    colonne = colonne.reshape(numero_motivi, numero_blocchi, 4, 4)
+    blocchi = (colonne[:, :, 0, :, None, None, None] + colonne[:, :, 1, None, :, None, None]
+               + colonne[:, :, 2, None, None, :, None] + colonne[:, :, 3, None, None, None, :]
+               ).reshape(numero_motivi, numero_blocchi, 256)
+
+    massimi = blocchi.max(axis=2)
+    # (a nucleotide that never appears in a position of the log matrix is -inf, so the score of a random sequence is
+    # computed without it)
+    medie = (np.where(np.isfinite(colonne), colonne, 0) * frequenze_fondo).sum(axis=(2, 3))
+    ordine = np.argsort(medie - massimi, axis=1, kind='stable')
+    massimi = np.take_along_axis(massimi, ordine, axis=1)
+    limiti = np.concatenate([np.cumsum(massimi[:, ::-1], axis=1)[:, ::-1], np.zeros((numero_motivi, 1))], axis=1)
+    return np.take_along_axis(blocchi, ordine[:, :, None], axis=1), 4 * ordine, limiti
+
+
+# Function to get the rows of a bucket (the probabilities, their logarithms, the log-odds matrix, the tables of the
+# p-values with the scores of some p-values, and the tables of cerca_motivi) for a list of PFMs of the same length
+def righe_bucket(pfms):
+    probabilita = np.stack([normalizza_pfm(pfm).T for pfm in pfms])
+    with np.errstate(divide='ignore'):
+        logaritmi = np.log(probabilita)
+    pwm, minimi, scale, code, code_inverse = tabelle_pvalori(np.stack([pwm_log_odds(pfm) for pfm in pfms]))
+    righe = {'prob': probabilita, 'log': logaritmi, 'pwm': pwm, 'minimi': minimi, 'scale': scale, 'code': code,
+             'code_inverse': code_inverse, 'soglie_pvalori': soglie_griglia(minimi, scale, code),
+             'soglie_pvalori_inverse': soglie_griglia(minimi, scale, code_inverse)}
+    for campo, matrici in (('log', logaritmi), ('pwm', pwm)):
+        righe[f'blocchi_{campo}'], righe[f'spostamenti_{campo}'], righe[f'limiti_{campo}'] = tabelle_ricerca(matrici)
+    return righe
+
+
+# Function to build the bucket of all the motifs of the same length
+def crea_bucket(motifs):
+    return {
+        'motif_ids': [motif['motif_id'] for motif in motifs],
+        **righe_bucket([motif['PFM'] for motif in motifs])
+    }
+
+
+# Function to compute the scores of a sequence (already converted in indices) for all the motifs of a bucket:
+# it returns the logarithm of the scores, in the same order of bucket['motif_ids']
+def calcola_score_bucket(bucket, indici):
+    return bucket['log'][:, np.arange(len(indici)), indici].sum(axis=1)
+
+
+# The database of the motifs: instead of a list, where finding a motif means going through all of them, the motifs
+# are in a dictionary by ID, with other two indexes by TF name and by length (the buckets above).
+# Each change updates the indexes and only the row of the motif in the bucket of its length, without normalizing
+# again all the other motifs, so all the operations don't depend on the number of motifs in the database.
+#
+# The service can answer many requests at the same time (with threads), so the database is never changed while someone
+# is reading it: each version of the database is never modified after it's created (MotifSnapshot), the requests
+# take the current version and read it without any lock. A change is done on a copy of the current version (copying
+# only the dictionaries and the buckets that are changed) and when it's complete the new version replaces the old one
+# all at once, so the readers see either all the change or nothing of it. Only the changes wait for each other.
+
+class MotifSnapshot:
+
+    def __init__(self, motifs, tf_names, buckets, posizioni, numero=0):
+        self.motifs = motifs
+        self.tf_names = tf_names
+        self.buckets = buckets
+        self.posizioni = posizioni
+        # number of the version and the moment when it was created
+        self.numero = numero
+        self.istante = time.time()
+        # the minimum and maximum length of the motifs (None if there are no motifs), to check the sequences
+        self.lunghezza_minima = min(buckets, default=None)
+        self.lunghezza_massima = max(buckets, default=None)
+        self._ids_ordinati = None
+        self._indici_ricerca = {}
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def __contains__(self, motif_id):
+        return motif_id in self.motifs
+
+    def __iter__(self):
+        return iter(self.motifs.values())
+
+    def get(self, motif_id):
+        return self.motifs.get(motif_id)
+
+    def by_tf_name(self, tf_name):
+        return [self.motifs[motif_id] for motif_id in self.tf_names.get(tf_name, ())]
+
+    def by_length(self, lunghezza):
+        bucket = self.buckets.get(lunghezza)
+        return [self.motifs[motif_id] for motif_id in bucket['motif_ids']] if bucket is not None else []
+
+    # The IDs in alphabetical order, for the pages of getAllMotifs: they are sorted only the first time they are
+    # needed in each version
+    def ids_ordinati(self):
+        if self._ids_ordinati is None:
+            self._ids_ordinati = sorted(self.motifs)
+        return self._ids_ordinati
+
+    # The index of cerca_motivi for the log matrices or the log-odds ones, created the first time it's needed in
+    # each version
+    def indice_ricerca(self, campo):
+        if campo not in self._indici_ricerca:
+            self._indici_ricerca[campo] = crea_indice_ricerca(self.buckets, campo)
+        return self._indici_ricerca[campo]
+
+
+# A change in progress on the copy of a version: the motifs are never modified (a modified motif is a new dictionary),
+# while the dictionaries of the indexes and the buckets are copied the first time they are changed
+class MotifChange:
+
+    def __init__(self, base):
+        self.base = base
+        self.motifs = dict(base.motifs)
+        self.tf_names = dict(base.tf_names)
+        self.buckets = dict(base.buckets)
+        self.posizioni = dict(base.posizioni)
+        self.tf_copiati = set()
+        self.buckets_copiati = set()
+
+    def __contains__(self, motif_id):
+        return motif_id in self.motifs
+
+    def get(self, motif_id):
+        return self.motifs.get(motif_id)
+
+    def add(self, motif_id, tf_name, pfm):
+        if motif_id in self.motifs:
+            raise ValueError('Motif ID already exists')
+        motif = {'motif_id': motif_id, 'TF_name': tf_name, 'PFM': pfm}
+        self.motifs[motif_id] = motif
+        self._aggiungi_indice_tf(motif)
+        self._aggiungi_al_bucket(motif)
+        return motif
+
+    def update(self, motif_id, tf_name=None, pfm=None):
+        if motif_id not in self.motifs:
+            raise ValueError('Motif ID not found')
+        vecchio = self.motifs[motif_id]
+        motif = {'motif_id': motif_id,
+                 'TF_name': tf_name if tf_name is not None else vecchio['TF_name'],
+                 'PFM': pfm if pfm is not None else vecchio['PFM']}
+        self.motifs[motif_id] = motif
+        if tf_name is not None:
+            self._togli_indice_tf(vecchio)
+            self._aggiungi_indice_tf(motif)
+        if pfm is not None:
+            if pfm.shape[1] == vecchio['PFM'].shape[1]:
+                # same length: I just replace the row of the motif in its bucket
+                bucket = self._bucket_modificabile(pfm.shape[1])
+                righe = righe_bucket([pfm])
+                for campo in campi_bucket:
+                    bucket[campo][self.posizioni[motif_id]] = righe[campo][0]
+            else:
+                self._togli_dal_bucket(vecchio)
+                self._aggiungi_al_bucket(motif)
+        return motif
+
+    def delete(self, motif_id):
+        if motif_id not in self.motifs:
+            raise ValueError('Motif ID not found')
+        motif = self.motifs.pop(motif_id)
+        self._togli_indice_tf(motif)
+        self._togli_dal_bucket(motif)
+        return motif
+
+    # Function to add or replace many motifs together (the bulk requests): the rows of the buckets are computed once
+    # for all the motifs of the same length, and each bucket is extended only once, instead of once for each motif.
+    # The IDs must be all different. It returns the number of motifs added and of motifs replaced
+    def upsert_many(self, motifs):
+        da_sostituire, da_aggiungere = {}, {}  # length -> {motif ID: motif}
+        aggiunti = 0
+        for motif in motifs:
+            motif_id, lunghezza = motif['motif_id'], motif['PFM'].shape[1]
+            vecchio = self.motifs.get(motif_id)
+            self.motifs[motif_id] = motif
+            if vecchio is None:
+                aggiunti += 1
+            else:
+                self._togli_indice_tf(vecchio)
+            self._aggiungi_indice_tf(motif)
+            if vecchio is not None and vecchio['PFM'].shape[1] == lunghezza:
+                da_sostituire.setdefault(lunghezza, {})[motif_id] = motif
+            else:
+                if vecchio is not None:
+                    self._togli_dal_bucket(vecchio)
+                da_aggiungere.setdefault(lunghezza, {})[motif_id] = motif
+
+        # the positions are read only now, because removing the motifs that changed length moves the other rows
+        for lunghezza, motivi in da_sostituire.items():
+            bucket = self._bucket_modificabile(lunghezza)
+            righe = righe_bucket([motif['PFM'] for motif in motivi.values()])
+            posizioni = [self.posizioni[motif_id] for motif_id in motivi]
+            for campo in campi_bucket:
+                bucket[campo][posizioni] = righe[campo]
+
+        for lunghezza, motivi in da_aggiungere.items():
+            if lunghezza not in self.buckets:
+                self.buckets[lunghezza] = crea_bucket(list(motivi.values()))
+                self.buckets_copiati.add(lunghezza)
+                inizio = 0
+            else:
+                bucket = self._bucket_modificabile(lunghezza)
+                righe = righe_bucket([motif['PFM'] for motif in motivi.values()])
+                inizio = len(bucket['motif_ids'])
+                bucket['motif_ids'].extend(motivi)
+                for campo in campi_bucket:
+                    bucket[campo] = np.concatenate([bucket[campo], righe[campo]])
+            for posizione, motif_id in enumerate(motivi, inizio):
+                self.posizioni[motif_id] = posizione
+
+        return aggiunti, len(motifs) - aggiunti
+
+    def delete_many(self, motif_ids):
+        for motif_id in motif_ids:
+            self.delete(motif_id)
+        return len(motif_ids)
+
+    def crea_versione(self):
+        # the arrays of the new version can't be changed anymore, so a mistake can't modify a version that is being read
+        for lunghezza in self.buckets_copiati:
+            if lunghezza in self.buckets:
+                for campo in campi_bucket:
+                    self.buckets[lunghezza][campo].flags.writeable = False
+        return MotifSnapshot(self.motifs, self.tf_names, self.buckets, self.posizioni, self.base.numero + 1)
+
+    def _aggiungi_indice_tf(self, motif):
+        tf_name = motif['TF_name']
+        if tf_name not in self.tf_copiati:
+            self.tf_names[tf_name] = dict(self.tf_names.get(tf_name, {}))
+            self.tf_copiati.add(tf_name)
+        self.tf_names.setdefault(tf_name, {})[motif['motif_id']] = None
+
+    def _togli_indice_tf(self, motif):
+        tf_name = motif['TF_name']
+        if tf_name not in self.tf_copiati:
+            self.tf_names[tf_name] = dict(self.tf_names[tf_name])
+            self.tf_copiati.add(tf_name)
+        del self.tf_names[tf_name][motif['motif_id']]
+        if not self.tf_names[tf_name]:
+            del self.tf_names[tf_name]
+
+    def _bucket_modificabile(self, lunghezza):
+        if lunghezza not in self.buckets_copiati:
+            bucket = self.buckets[lunghezza]
+            self.buckets[lunghezza] = {'motif_ids': list(bucket['motif_ids']),
+                                       **{campo: bucket[campo].copy() for campo in campi_bucket}}
+            self.buckets_copiati.add(lunghezza)
+        return self.buckets[lunghezza]
+
+    def _aggiungi_al_bucket(self, motif):
+        lunghezza = motif['PFM'].shape[1]
+        if lunghezza not in self.buckets:
+            self.buckets[lunghezza] = crea_bucket([motif])
+            self.buckets_copiati.add(lunghezza)
+            self.posizioni[motif['motif_id']] = 0
+            return
+        bucket = self._bucket_modificabile(lunghezza)
+        righe = righe_bucket([motif['PFM']])
+        self.posizioni[motif['motif_id']] = len(bucket['motif_ids'])
+        bucket['motif_ids'].append(motif['motif_id'])
+        for campo in campi_bucket:
+            bucket[campo] = np.concatenate([bucket[campo], righe[campo]])
+
+    # To remove a motif from its bucket, the last motif of the bucket is moved in its place and then the last row
+    # is removed, so the other rows don't have to be moved
+    def _togli_dal_bucket(self, motif):
+        lunghezza = motif['PFM'].shape[1]
+        bucket = self._bucket_modificabile(lunghezza)
+        posizione = self.posizioni.pop(motif['motif_id'])
+        ultimo_id = bucket['motif_ids'].pop()
+        if len(bucket['motif_ids']) == 0:
+            del self.buckets[lunghezza]
+            return
+        if ultimo_id != motif['motif_id']:
+            bucket['motif_ids'][posizione] = ultimo_id
+            for campo in campi_bucket:
+                bucket[campo][posizione] = bucket[campo][-1]
+            self.posizioni[ultimo_id] = posizione
+        for campo in campi_bucket:
+            bucket[campo] = bucket[campo][:-1]
+
+
+class MotifStore:
+
+    # The buckets can be given already computed (from a snapshot), otherwise they are computed from the motifs
+    def __init__(self, motifs=(), buckets=None):
+        motifs_per_id, tf_names, motivi_per_lunghezza = {}, {}, {}
+        for motif in motifs:
+            motifs_per_id[motif['motif_id']] = motif
+        for motif in motifs_per_id.values():
+            tf_names.setdefault(motif['TF_name'], {})[motif['motif_id']] = None
+            motivi_per_lunghezza.setdefault(motif['PFM'].shape[1], []).append(motif)
+        if buckets is None:
+            buckets = {lunghezza: crea_bucket(motifs) for lunghezza, motifs in motivi_per_lunghezza.items()}
+        posizioni = {motif_id: posizione for bucket in buckets.values()
+                     for posizione, motif_id in enumerate(bucket['motif_ids'])}
+        for bucket in buckets.values():
+            for campo in campi_bucket:
+                bucket[campo].flags.writeable = False
+
+        self._versione = MotifSnapshot(motifs_per_id, tf_names, buckets, posizioni)
+        # lock taken by who changes the database (the readers never take it)
+        self.lock = threading.Lock()
+
+    # The current version of the database: a request that has to read more things should take it once and use it
+    def snapshot(self):
+        return self._versione
+
+    # Context to change the database: all the changes done on the MotifChange are published together at the end,
+    # or none of them if there is an error
+    @contextmanager
+    def scrittura(self):
+        with self.lock:
+            modifica = MotifChange(self._versione)
+            yield modifica
+            self._versione = modifica.crea_versione()
+
+    # Shortcuts to read the current version (the changes are done only with scrittura)
+    @property
+    def buckets(self):
+        return self._versione.buckets
+
+    def __len__(self):
+        return len(self._versione)
+
+    def __contains__(self, motif_id):
+        return motif_id in self._versione
+
+    def __iter__(self):
+        return iter(self._versione)
+
+    def get(self, motif_id):
+        return self._versione.get(motif_id)
+
+    def by_tf_name(self, tf_name):
+        return self._versione.by_tf_name(tf_name)
+
+    def by_length(self, lunghezza):
+        return self._versione.by_length(lunghezza)
+
+
+# The sequence can be scored on the forward strand (the default), on the reverse strand or on both. The reverse strand
+# is scored with the reverse complement of the motifs, that is the matrix read backwards with A<->T and C<->G swapped
+# (with the order A, C, G, T it's the matrix reversed on both axes, so it doesn't need to be stored): the score of
+# the position i of the sequence is the one of the position L-1-i of the motif, for the complement of the nucleotide.
+# With both strands the positions and the nucleotides of the two strands are put one after the other, so the scores
+# of both come from a single indexing of the matrices, and for each motif the best strand is kept
+filamenti_punteggi = ('forward', 'reverse', 'both')
+
+
+def score_filamenti(matrici, indici, filamenti):
+    posizioni = np.arange(len(indici))
+    if filamenti == 'forward':
+        return matrici[:, posizioni, indici].sum(axis=1), np.zeros(len(matrici), dtype=np.int64)
+    if filamenti == 'reverse':
+        return matrici[:, posizioni[::-1], 3 - indici].sum(axis=1), np.ones(len(matrici), dtype=np.int64)
+    score = matrici[:, np.concatenate([posizioni, posizioni[::-1]]), np.concatenate([indici, 3 - indici])]
+    score = score.reshape(len(matrici), 2, len(indici)).sum(axis=2)
+    migliori = score.argmax(axis=1)
+    return score[np.arange(len(matrici)), migliori], migliori
+
+
+# Function to get the scores of a DNA sequence for the motifs of the same length (all in the same bucket, so they are
+# scored all at once), from the best to the worst. It returns the number of motifs scored and a list of
+# (motif ID, score, p-value, strand): with the probabilities the p-value is None, with the log-odds scores the best
+# ones are the ones with the smallest p-value. The strand ('+' or '-') is None when only the forward strand is scored.
+# Only the motifs with at least min_score and at most max_pvalue are returned, and only the best top_k: they are
+# found with a partial sort (argpartition), so only them are sorted and converted
+def seleziona_punteggi(sequenza, punteggio, top_k=None, min_score=None, max_pvalue=None, filamenti='forward'):
+    inizio = time.perf_counter()
+    bucket = motif_store.buckets.get(len(sequenza))
+    if bucket is None:
+        return 0, []
+    indici = codifica_sequenza(sequenza)
+    righe = np.arange(len(bucket['motif_ids']))
+
+    if punteggio == 'logodds':
+        # the best strand is the one with the smallest p-value, and the two strands have different tables when the
+        # background doesn't have A=T and C=G, so each strand is scored on its own
+        scelti = ('forward', 'reverse') if filamenti == 'both' else (filamenti,)
+        score = np.array([score_filamenti(bucket['pwm'], indici, filamento)[0] for filamento in scelti])
+        inversi = np.array([filamento == 'reverse' for filamento in scelti])
+        pvalori_filamenti = np.array([pvalori(bucket, righe, riga, inverso) for riga, inverso in zip(score, inversi)])
+        migliori = filamenti_migliori(score, pvalori_filamenti)
+        score, pvalori_motivi = score[migliori, righe], pvalori_filamenti[migliori, righe]
+        filamenti_motivi = inversi[migliori].astype(np.int64)
+        chiave = pvalori_motivi
+        validi = score >= min_score if min_score is not None else np.ones(len(righe), dtype=bool)
+    else:
+        score, filamenti_motivi = score_filamenti(bucket['log'], indici, filamenti)
+        pvalori_motivi = None
+        chiave = -score
+        validi = score >= np.log(min_score) if min_score is not None else np.ones(len(righe), dtype=bool)
+    if max_pvalue is not None:
+        validi &= pvalori_motivi <= max_pvalue
+    inizio = metriche.fine_fase(f'score_{punteggio}', inizio)
+
+    candidati = righe[validi]
+    if top_k is not None and top_k < len(candidati):
+        candidati = candidati[np.argpartition(chiave[candidati], top_k - 1)[:top_k]]
+    ordine = candidati[np.lexsort((candidati, -score[candidati], chiave[candidati]))]
+    metriche.fine_fase('score_sort', inizio)
+
+    score_ordinati = score[ordine] if punteggio == 'logodds' else np.exp(score[ordine])
+    pvalori_ordinati = pvalori_motivi[ordine].tolist() if punteggio == 'logodds' else [None] * len(ordine)
+    filamenti_ordinati = ['+-'[filamento] for filamento in filamenti_motivi[ordine]] if filamenti != 'forward' \
+        else [None] * len(ordine)
+    return len(righe), list(zip([bucket['motif_ids'][posizione] for posizione in ordine], score_ordinati.tolist(),
+                                pvalori_ordinati, filamenti_ordinati))
+
+
+def punteggi_da_log(motif_ids, log_score):
+    frequenze_motivi = {}
+    ordine = np.argsort(-log_score, kind='stable')
+    score_motivi = np.exp(log_score)
+    for posizione in ordine:
+        frequenze_motivi[motif_ids[posizione]] = float(score_motivi[posizione])
+    return frequenze_motivi
+
+
+# The following functions are for the mode=fit of getScore: the best motifs for a sequence among all the motifs that
+# fit in it (the ones not longer than the sequence), each one at its best position. Scoring all the motifs at all the
+# positions would be a lot of work for nothing, because almost all of them can't be among the best ones, so this is a
+# branch and bound search: the windows (a motif at a start of the sequence) are scored 4 positions at a time, with
+# the tables of the 4-mers of the buckets (blocchi_log and blocchi_pwm), and after each step a window is dropped if
+# its score so far plus the best score of the positions still missing (the bounds limiti_log and limiti_pwm) can't
+# reach the top_k motifs already found, or the best window of its own motif. A motif is skipped without looking at
+# its windows when its best score can't reach them.
+# Each motif is searched on each strand on its own (an entry of the search): the reverse strand is the forward strand
+# of the reverse complement of the sequence, with the table of the p-values of the reverse strand. The entries are
+# searched from the ones with the best possible key, so the top_k motifs are found soon and the others are skipped.
+# The motifs of a version are put one after the other in a single index, from the shortest, so the windows of all
+# the lengths are scored together and the motifs that fit in a sequence are the first ones of the index
+# Number of entries searched before the others (or 2 * top_k, if they are more), and number of windows that are
+# scored to the end without checking them anymore
+voci_iniziali_ricerca = 32
+finestre_minime_ricerca = 256
+# The bounds are sums in a different order than the scores, so they can be a bit smaller than the score of the window:
+# they are compared with this tolerance, so no window is dropped by mistake
+tolleranza_ricerca = 1e-9
+
+
+def crea_indice_ricerca(buckets, campo):
+    ordinati = [buckets[lunghezza] for lunghezza in sorted(buckets) if lunghezza > 0]
+    numeri_motivi = [len(bucket['motif_ids']) for bucket in ordinati]
+    lunghezze = np.repeat([bucket[campo].shape[1] for bucket in ordinati], numeri_motivi).astype(np.int64)
+    blocchi = np.repeat([bucket[f'blocchi_{campo}'].shape[1] for bucket in ordinati], numeri_motivi).astype(np.int64)
+    inizi_blocchi = np.cumsum(blocchi) - blocchi
+    totale = len(lunghezze)
+
+    def unisci(array, dtype=np.float64):
+        return np.concatenate(array) if array else np.zeros(0, dtype=dtype)
+
+    indice = {
+        'motif_ids': [motif_id for bucket in ordinati for motif_id in bucket['motif_ids']],
+        'lunghezze': lunghezze,
+        'blocchi': blocchi,
+        'tabelle': unisci([bucket[f'blocchi_{campo}'].ravel() for bucket in ordinati]),
+        'spostamenti': unisci([bucket[f'spostamenti_{campo}'].ravel() for bucket in ordinati], np.int64),
+        'inizi_blocchi': inizi_blocchi,
+        'limiti': unisci([bucket[f'limiti_{campo}'].ravel() for bucket in ordinati]),
+    }
+    # the entry f * totale + m is the motif m on the strand f (0 the forward one, 1 the reverse one): the arrays of
+    # the entries have the values of their motifs twice
+    inizi_limiti = inizi_blocchi + np.arange(totale)
+    indice.update(lunghezze_voci=np.tile(lunghezze, 2), blocchi_voci=np.tile(blocchi, 2),
+                  inizi_blocchi_voci=np.tile(inizi_blocchi, 2), inizi_limiti_voci=np.tile(inizi_limiti, 2),
+                  massimi_voci=np.tile(indice['limiti'][inizi_limiti], 2), filamenti_voci=np.repeat([0, 1], totale))
+    # with the log-odds scores the motifs are sorted by p-value, so also the tables of the p-values of each strand
+    # are needed (the ones of the forward strand when the reverse one has the same tables)
+    if campo == 'pwm':
+        larghezze = np.repeat([bucket['code'].shape[1] for bucket in ordinati], numeri_motivi).astype(np.int64)
+        inizi_code = np.cumsum(larghezze) - larghezze
+        code = [bucket['code'].ravel() for bucket in ordinati]
+        code_inverse = [tabella_pvalori(bucket, True).ravel() for bucket in ordinati]
+        indice.update(code=unisci(code + code_inverse), inizi_code=np.r_[inizi_code, inizi_code + larghezze.sum()],
+                      larghezze=np.tile(larghezze, 2),
+                      minimi=np.tile(unisci([bucket['minimi'] for bucket in ordinati]), 2),
+                      scale=np.tile(unisci([bucket['scale'] for bucket in ordinati]), 2))
+        soglie = [bucket['soglie_pvalori'] for bucket in ordinati] + \
+                 [bucket['soglie_pvalori_inverse'] if bucket['soglie_pvalori_inverse'].shape[1] else
+                  bucket['soglie_pvalori'] for bucket in ordinati]
+        indice['soglie_pvalori'] = np.concatenate(soglie) if soglie else np.zeros((0, len(griglia_pvalori)))
+    return indice
+
+
+# The key to sort the entries, from the best one: with the probabilities it's the opposite of the logarithm of the
+# score, with the log-odds scores it's the p-value (like in seleziona_punteggi)
+def chiavi_ricerca(indice, voci, score):
+    if 'code' not in indice:
+        return -score
+    intervalli = np.rint((score - indice['minimi'][voci]) * indice['scale'][voci]).astype(np.int64)
+    return indice['code'][indice['inizi_code'][voci] + np.clip(intervalli, 0, indice['larghezze'][voci] - 1)]
+
+
+# The opposite: the minimum score of each entry to have at most the key chiave. With the log-odds scores it's the
+# one of the first p-value of griglia_pvalori not smaller than chiave (in the column soglie_pvalori of the buckets),
+# so it's a bit smaller than the exact one and no window can be dropped by mistake
+def soglie_chiave(indice, chiave):
+    if 'code' not in indice or chiave == np.inf:
+        return np.full(len(indice['filamenti_voci']), -chiave)
+    return indice['soglie_pvalori'][:, max(int((griglia_pvalori >= chiave).sum()) - 1, 0)]
+
+
+# Function to get the best top_k motifs that fit in a DNA sequence, on one strand or on both: it returns the number
+# of motifs that fit and the list of the hits (motif ID, start, length, strand, score, p-value), like the scan, from
+# the best one. Only the windows with at least min_score and at most max_pvalue are considered, and the motifs with a
+# probability 0 at all the windows are never returned
+def cerca_motivi(sequenza, punteggio, top_k, min_score=None, max_pvalue=None, filamenti='forward'):
+    inizio = time.perf_counter()
+    campo = 'pwm' if punteggio == 'logodds' else 'log'
+    indice = motif_store.snapshot().indice_ricerca(campo)
+    indici = codifica_sequenza(sequenza).astype(np.int64)
+    lunghezza = len(indici)
+    totale = len(indice['lunghezze'])
+    numero_motivi = int(np.searchsorted(indice['lunghezze'], lunghezza, side='right'))
+    # the two strands one after the other (the reverse one is the reverse complement of the sequence), each followed
+    # by 3 A, so also the last positions have a 4-mer (the positions after the end of a motif count 0 in its tables)
+    sequenze = np.concatenate([indici, [0, 0, 0], 3 - indici[::-1], [0, 0, 0]])
+    kmeri = 64 * sequenze[:-3] + 16 * sequenze[1:-2] + 4 * sequenze[2:-1] + sequenze[3:]
+    # (the windows that are not valid in cerca_voci can read after the end)
+    kmeri = np.concatenate([kmeri, np.zeros(lunghezza, dtype=kmeri.dtype)])
+    lunghezze_voci, blocchi_voci, filamenti_voci = indice['lunghezze_voci'], indice['blocchi_voci'], indice['filamenti_voci']
+    scelti = {'forward': (0,), 'reverse': (1,), 'both': (0, 1)}[filamenti]
+    voci = np.concatenate([filamento * totale + np.arange(numero_motivi) for filamento in scelti])
+
+    # minimum score of each entry for min_score and max_pvalue (the exact ones are checked when a window is scored to
+    # the end), and the best score of each entry found until now with the start of its window on the forward strand:
+    # a motif is better than another if its key is smaller, and the windows of the same entry are better if their
+    # score is bigger (the p-value goes down with the score), or with the same score if they start before
+    soglia_minima = -np.inf if min_score is None else min_score if punteggio == 'logodds' else np.log(min_score)
+    soglie_fisse = np.full(2 * totale, soglia_minima)
+    if max_pvalue is not None:
+        soglie_fisse = np.maximum(soglie_fisse, soglie_chiave(indice, max_pvalue))
+    migliori = np.full(2 * totale, -np.inf)
+    inizi_migliori = np.zeros(2 * totale, dtype=np.int64)
+    chiavi_voci = np.full(2 * totale, np.inf)
+    soglie_top_k = np.full(2 * totale, -np.inf)
+    chiave_top_k = np.inf
+    numero_finestre = int((lunghezza - lunghezze_voci[voci] + 1).sum())
+    complete_totali = 0
+
+    # Function to keep the best window of each entry among some windows scored to the end, and to update the key of
+    # the top_k-th motif (the key of a motif is the best one of its strands) and the minimum score of each entry to
+    # reach it
+    def registra(voci_finestre, posizioni, score):
+        nonlocal complete_totali, chiave_top_k, soglie_top_k
+        complete_totali += len(voci_finestre)
+        validi = np.flatnonzero((score >= np.maximum(migliori - tolleranza_ricerca, soglia_minima)[voci_finestre])
+                                & (score > -np.inf))
+        if max_pvalue is not None:
+            validi = validi[chiavi_ricerca(indice, voci_finestre[validi], score[validi]) <= max_pvalue]
+        if not len(validi):
+            return
+        voci_finestre, posizioni, score = voci_finestre[validi], posizioni[validi], score[validi]
+        inizi = np.where(filamenti_voci[voci_finestre], 2 * lunghezza + 3 - posizioni - lunghezze_voci[voci_finestre],
+                         posizioni)
+        # the best window of each entry is the one with the biggest score, and with the same score the first one
+        # (the start of the entries whose score goes up is reset to the length of the sequence, after all the starts)
+        vecchi = migliori.copy()
+        np.maximum.at(migliori, voci_finestre, score)
+        cambiate = np.flatnonzero(migliori > vecchi)
+        inizi_migliori[cambiate] = lunghezza
+        uguali = np.flatnonzero(score == migliori[voci_finestre])
+        np.minimum.at(inizi_migliori, voci_finestre[uguali], inizi[uguali])
+        if not len(cambiate):
+            return
+        chiavi_voci[cambiate] = chiavi_ricerca(indice, cambiate, migliori[cambiate])
+
+        if top_k < numero_motivi:
+            chiavi_motivi = chiavi_voci.reshape(2, totale).min(axis=0)
+            chiavi_motivi = chiavi_motivi[chiavi_motivi < np.inf]
+            if len(chiavi_motivi) >= top_k:
+                chiave = np.partition(chiavi_motivi, top_k - 1)[top_k - 1]
+                if chiave < chiave_top_k:
+                    chiave_top_k, soglie_top_k = chiave, soglie_chiave(indice, chiave)
+
+    # Function to add to the partial scores of some windows the block blocco of their motifs
+    def leggi_blocco(voci_finestre, posizioni, blocco):
+        blocchi = indice['inizi_blocchi_voci'][voci_finestre] + blocco
+        return indice['tabelle'][256 * blocchi + kmeri[posizioni + indice['spostamenti'][blocchi]]]
+
+    # Function to score some windows to the end from the block blocco, without checking them after each block
+    def completa(voci_finestre, posizioni, parziali, blocco):
+        parziali = parziali.copy()
+        blocchi = blocchi_voci[voci_finestre]
+        for blocco in range(blocco, int(blocchi.max())):
+            da_leggere = np.flatnonzero(blocchi > blocco)
+            parziali[da_leggere] += leggi_blocco(voci_finestre[da_leggere], posizioni[da_leggere], blocco)
+        registra(voci_finestre, posizioni, parziali)
+
+    # Function to score some windows from the block blocco (parziali is the score of the blocks before it),
+    # dropping them as soon as they can't be among the best ones. When few windows are left, they are scored to the
+    # end without checking them after each block, that would take more time than scoring them
+    def cerca(voci_finestre, posizioni, parziali, blocco):
+        while True:
+            finite = blocchi_voci[voci_finestre] == blocco
+            # (the windows are selected with their positions, that is faster than with a boolean mask)
+            if finite.any():
+                complete = np.flatnonzero(finite)
+                registra(voci_finestre[complete], posizioni[complete], parziali[complete])
+            # (the minimum score so far of each entry is its threshold less the bound of the blocks still missing:
+            # it's NaN, and so all the windows are dropped, when the blocks missing can only give a probability 0)
+            with np.errstate(invalid='ignore'):
+                necessari = np.maximum(np.maximum(soglie_fisse, soglie_top_k), migliori) - \
+                    indice['limiti'][indice['inizi_limiti_voci'] + np.minimum(blocco, blocchi_voci)]
+            restano = np.flatnonzero(~finite & (parziali + tolleranza_ricerca >= necessari[voci_finestre])
+                                     & (parziali > -np.inf))
+            voci_finestre, posizioni, parziali = voci_finestre[restano], posizioni[restano], parziali[restano]
+            if len(voci_finestre) <= finestre_minime_ricerca:
+                break
+            parziali = parziali + leggi_blocco(voci_finestre, posizioni, blocco)
+            blocco += 1
+        if len(voci_finestre):
+            completa(voci_finestre, posizioni, parziali, blocco)
+
+    # Function to search some entries, apart from the ones whose best score can't reach the thresholds. The first
+    # block of all their windows is read at once, in a matrix with a row for each entry and a column for each start
+    # (the columns after the last window of an entry, for the entries longer than the shortest one, are not valid).
+    # Then the most promising window of each entry is scored to the end before the others, so the best score of the
+    # entry is known and its other windows are dropped earlier
+    def cerca_voci(scelte):
+        scelte = scelte[indice['massimi_voci'][scelte] + tolleranza_ricerca >=
+                        np.maximum(soglie_fisse, soglie_top_k)[scelte]]
+        if not len(scelte):
+            return
+        numeri = lunghezza - lunghezze_voci[scelte] + 1
+        colonne = np.arange(numeri.max())
+        blocchi = indice['inizi_blocchi_voci'][scelte]
+        inizi = (lunghezza + 3) * filamenti_voci[scelte]
+        parziali = indice['tabelle'][256 * blocchi[:, None] +
+                                     kmeri[(inizi + indice['spostamenti'][blocchi])[:, None] + colonne]]
+        parziali[colonne >= numeri[:, None]] = -np.inf
+
+        righe = np.arange(len(scelte))
+        promettenti = parziali.argmax(axis=1)
+        completa(scelte, inizi + promettenti, parziali[righe, promettenti], 1)
+        parziali[righe, promettenti] = -np.inf
+        with np.errstate(invalid='ignore'):
+            necessari = (np.maximum(np.maximum(soglie_fisse, soglie_top_k), migliori) -
+                         indice['limiti'][indice['inizi_limiti_voci'] + 1])[scelte]
+        righe, colonne = np.nonzero((parziali + tolleranza_ricerca >= necessari[:, None]) & (parziali > -np.inf))
+        cerca(scelte[righe], inizi[righe] + colonne, parziali[righe, colonne], 1)
+
+    # first the entries with the best possible key are searched, to have soon a threshold for the others
+    if len(voci):
+        ordine = voci[np.argsort(chiavi_ricerca(indice, voci, indice['massimi_voci'][voci]), kind='stable')]
+        primi = max(voci_iniziali_ricerca, 2 * top_k)
+        cerca_voci(ordine[:primi])
+        cerca_voci(ordine[primi:])
+    metriche.incrementa('jaspar_fit_windows_total', (('result', 'scored'),), complete_totali)
+    metriche.incrementa('jaspar_fit_windows_total', (('result', 'pruned'),), numero_finestre - complete_totali)
+    inizio = metriche.fine_fase(f'fit_{punteggio}', inizio)
+
+    # the best strand of each motif (the forward one if they are the same), and the best top_k motifs: all the ones
+    # with a key not worse than the top_k-th one are sorted, so the motifs with the same key are always the same ones
+    righe = np.arange(numero_motivi)
+    score = migliori.reshape(2, totale)[:, :numero_motivi]
+    chiavi = chiavi_voci.reshape(2, totale)[:, :numero_motivi]
+    filamento = filamenti_migliori(score, chiavi)
+    score, chiavi = score[filamento, righe], chiavi[filamento, righe]
+    candidati = righe[score > -np.inf]
+    if top_k < len(candidati):
+        candidati = candidati[chiavi[candidati] <= np.partition(chiavi[candidati], top_k - 1)[top_k - 1]]
+    motif_ids = [indice['motif_ids'][motivo] for motivo in candidati]
+    ordine = np.lexsort((np.array(motif_ids), -score[candidati], chiavi[candidati]))[:top_k]
+    hits = [(motif_ids[posizione], int(inizi_migliori[filamento[motivo] * totale + motivo]),
+             int(indice['lunghezze'][motivo]), '+-'[filamento[motivo]],
+             float(score[motivo]) if punteggio == 'logodds' else float(np.exp(score[motivo])),
+             float(chiavi[motivo]) if punteggio == 'logodds' else None)
+            for posizione, motivo in zip(ordine, candidati[ordine])]
+    metriche.fine_fase('fit_format', inizio)
+    return numero_motivi, hits
+
+
+# The database is empty until the motifs are loaded, when the service starts
+motif_store = MotifStore()
+
+
+# The following block of code is to load the Jaspar database. There are three possible sources:
+# - a local file in the Jaspar format (with the option --jaspar-file), without need of the internet connection
+# - the file downloaded from the Jaspar website: it's kept in a cache directory together with its ETag and
+#   Last-Modified headers, so at the next start it's asked to the website only if it has changed (and if there is no
+#   connection the one in the cache is used)
+# - a binary snapshot (with the option --snapshot), a numpy .npz file with all the PFMs one after the other in a single
+#   array plus the IDs, the TF names and the lengths of the motifs, and all the arrays of the buckets (the log-odds
+#   matrices, the tables of the p-values...), so it's loaded without parsing and without computing them again
 
-    # Get the sum for each column
-    somma_colonne = [sum(pfm[nucleotide][posizione] for nucleotide in pfm) for posizione in range(numero_colonne)]
+# URL of the Jaspar txt file
+url = 'https://jaspar.elixir.no/download/data/2024/CORE/JASPAR2024_CORE_non-redundant_pfms_jaspar.txt'
 
-    # Normalize numbers in the column
-    for nucleotide in pfm:
-        pfm_normalizzata[nucleotide] = [pfm[nucleotide][posizione] / somma_colonne[posizione] for posizione in
-                                        range(numero_colonne)]
+nome_file_scaricato = 'downloaded_file.txt'
+nome_file_cache = 'downloaded_file.json'
+tentativi_download = 3
+timeout_download = 30
+
+
+# Generator of the motifs of a file in the Jaspar format: a line that starts with '>' has the motif_id and the TF_name,
+# the next 4 lines are the frequencies of each nucleotide between square brackets
+def leggi_jaspar(file):
+    current_motif = None
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('>'):
+            if current_motif is not None:
+                yield current_motif
+            campi = line[1:].split('\t')
+            if len(campi) < 2:
+                campi = line[1:].split(None, 1)
+            current_motif = {'motif_id': campi[0].split(' ')[0], 'TF_name': campi[1].strip() if len(campi) > 1 else '',
+                             'PFM': {}}
+        else:
+            nucleotide, _, freqs_str = line.partition('[')
+            current_motif['PFM'][nucleotide.strip()] = list(map(int, freqs_str.partition(']')[0].split()))
+    if current_motif is not None:
+        yield current_motif
+
+
+# Generator of the motifs of a file in the MEME format: each motif starts with a line "MOTIF id name" and its matrix
+# comes after the line "letter-probability matrix: alength= 4 w= N nsites= S", with a line for each position with the
+# probabilities of A, C, G and T. The probabilities are multiplied by the number of sites (20 if it's not written)
+# to get back the counts
+def leggi_meme(righe):
+    current_motif, righe_attese = None, 0
+    for line in righe:
+        line = line.strip()
+        if line.startswith('MOTIF'):
+            if current_motif is not None:
+                yield controlla_matrice(current_motif, righe_attese)
+            campi = line.split()
+            current_motif = {'motif_id': campi[1], 'TF_name': campi[2] if len(campi) > 2 else '',
+                             'PFM': {nucleotide: [] for nucleotide in nucleotidi}}
+            righe_attese = 0
+        elif line.startswith('letter-probability matrix') and current_motif is not None:
+            parametri = dict(re.findall(r'(\w+)\s*=\s*(\S+)', line))
+            if parametri.get('alength', '4') != '4':
+                raise ValueError(f'the motif {current_motif["motif_id"]} has not 4 letters')
+            righe_attese = int(parametri['w'])
+            siti = float(parametri.get('nsites', 20))
+        elif righe_attese and len(current_motif['PFM']['A']) < righe_attese and line:
+            probabilita = [float(valore) for valore in line.split()]
+            if len(probabilita) != 4:
+                raise ValueError(f'a line of the motif {current_motif["motif_id"]} has not 4 probabilities')
+            for nucleotide, valore in zip(nucleotidi, probabilita):
+                current_motif['PFM'][nucleotide].append(valore * siti)
+    if current_motif is not None:
+        yield controlla_matrice(current_motif, righe_attese)
+
+
+# Generator of the motifs of a file in the TRANSFAC format: each motif ends with a line "//", the lines start with a
+# code of two letters (AC is the ID, ID and NA the name) and the matrix starts after the line "P0" (or "PO") with the
+# order of the nucleotides, a line for each position with its number and the counts
+def leggi_transfac(righe):
+    campi, ordine, posizioni = {}, None, []
+
+    def crea_motivo():
+        motif_id = campi.get('AC') or campi.get('ID')
+        if motif_id is None:
+            raise ValueError('a motif has no AC or ID line')
+        tf_name = campi.get('NA') or (campi.get('ID', '') if 'AC' in campi else '')
+        pfm = {nucleotide: [riga[colonna] for riga in posizioni] for colonna, nucleotide in enumerate(nucleotidi)}
+        return controlla_matrice({'motif_id': motif_id.split()[0], 'TF_name': tf_name, 'PFM': pfm}, len(posizioni))
+
+    for line in righe:
+        line = line.strip()
+        codice, valore = line[:2], line[2:].strip()
+        if line.startswith('//'):
+            if posizioni:
+                yield crea_motivo()
+            campi, ordine, posizioni = {}, None, []
+        elif codice in ('P0', 'PO'):
+            ordine = valore.split()
+            if sorted(ordine[:4]) != nucleotidi:
+                raise ValueError(f'the matrix must have the columns A, C, G and T, not {" ".join(ordine)}')
+            ordine = ordine[:4]
+        elif ordine is not None and line and line.split()[0].isdigit():
+            valori = [float(numero) for numero in line.split()[1:5]]
+            posizioni.append([valori[ordine.index(nucleotide)] for nucleotide in nucleotidi])
+        elif codice == 'XX':
+            ordine = None
+        elif codice.strip():
+            campi.setdefault(codice, valore)
+    if posizioni:
+        yield crea_motivo()
+
+
+def controlla_matrice(motif, lunghezza):
+    if lunghezza == 0 or any(len(frequenze) != lunghezza for frequenze in motif['PFM'].values()):
+        raise ValueError(f'the matrix of the motif {motif["motif_id"]} is missing or incomplete')
+    return motif
+
+
+# The formats of the files that can be imported, and a function to recognize them from their first lines
+formati_import = {'jaspar': leggi_jaspar, 'meme': leggi_meme, 'transfac': leggi_transfac}
+
+
+def formato_file_motivi(testo):
+    inizio = testo.lstrip()[:10000]
+    if inizio.startswith('>'):
+        return 'jaspar'
+    if inizio.startswith('MEME version') or re.search(r'^MOTIF\s', inizio, re.MULTILINE):
+        return 'meme'
+    if re.search(r'^(AC|ID|P0|PO)\s', inizio, re.MULTILINE):
+        return 'transfac'
+    raise ValueError('The format of the file is not recognized, give it with format=jaspar, meme or transfac')
+
+
+def carica_file_jaspar(percorso):
+    with metriche.fase('jaspar_parse'), open(percorso, 'r') as file:
+        motifs = [{**motif, 'PFM': pfm_to_array(motif['PFM'])} for motif in leggi_jaspar(file)]
+    with metriche.fase('jaspar_index'):
+        return MotifStore(motifs)
+
+
+# Function to download the Jaspar file only if it's different from the one in the cache directory.
+# It returns the path of the file and the headers that identify its version (None if there isn't any file)
+def scarica_jaspar(cartella_cache, offline=False):
+    percorso_file = os.path.join(cartella_cache, nome_file_scaricato)
+    percorso_cache = os.path.join(cartella_cache, nome_file_cache)
+
+    versione = None
+    if os.path.exists(percorso_file) and os.path.exists(percorso_cache):
+        with open(percorso_cache) as f:
+            versione = json.load(f)
+        if versione.get('url') != url:
+            versione = None
+
+    if offline:
+        return (percorso_file, versione) if versione is not None else (None, None)
+
+    headers = {}
+    if versione is not None:
+        if versione.get('etag'):
+            headers['If-None-Match'] = versione['etag']
+        if versione.get('last_modified'):
+            headers['If-Modified-Since'] = versione['last_modified']
+
+    for tentativo in range(tentativi_download):
+        try:
+            response = requests.get(url, headers=headers, timeout=timeout_download, stream=True)
+            if response.status_code == 304:
+                return percorso_file, versione
+            response.raise_for_status()
+
+            # the file is written with another name and renamed only at the end, so if the download is interrupted
+            # the file in the cache is still the old one
+            with open(percorso_file + '.tmp', 'wb') as f:
+                for blocco in response.iter_content(chunk_size=dimensione_blocco_lettura):
+                    f.write(blocco)
+            os.replace(percorso_file + '.tmp', percorso_file)
+
+            versione = {'url': url, 'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified')}
+            with open(percorso_cache, 'w') as f:
+                json.dump(versione, f)
+            return percorso_file, versione
+
+        except requests.RequestException as e:
+            print(f'Failed to download the file (attempt {tentativo + 1} of {tentativi_download}): {e}')
+            if tentativo + 1 < tentativi_download:
+                time.sleep(2 ** tentativo)
+
+    # if it's impossible to download the file, I use the one in the cache (if there is one)
+    if versione is not None:
+        print('Using the Jaspar file downloaded before')
+        return percorso_file, versione
+    return None, None
+
+
+# Functions to write and read the binary snapshot of the database. The version of the Jaspar file used to create it
+# is saved inside, so it's possible to know if it's still up to date.
+# The PFMs are all in a single array of floats, with a flag for the ones that were integers (the counts of Jaspar),
+# that are converted back when the snapshot is loaded, so a motif with frequencies (like the ones of MEME) doesn't
+# change the others. The arrays of the buckets depend also on the pseudocount, the background and the intervals of
+# the p-values, so they are saved with them and used only if they are still the same; otherwise the buckets are
+# computed again from the PFMs
+def parametri_buckets():
+    return {'formato': 2, 'pseudoconteggio': pseudoconteggio, 'fondo': frequenze_fondo.tolist(),
+            'intervalli_pvalori': intervalli_pvalori, 'campi': list(campi_bucket)}
+
+
+def salva_snapshot(store, percorso, versione=None):
+    motifs = list(store)
+    pfms = [motif['PFM'] for motif in motifs]
+    posizioni = {motif['motif_id']: posizione for posizione, motif in enumerate(motifs)}
+    buckets = {}
+    for lunghezza, bucket in store.buckets.items():
+        buckets[f'bucket_{lunghezza}_motivi'] = np.array([posizioni[motif_id] for motif_id in bucket['motif_ids']],
+                                                         dtype=np.int64)
+        buckets.update((f'bucket_{lunghezza}_{campo}', bucket[campo]) for campo in campi_bucket)
+    # the file is written with another name and renamed only when it's complete and on the disk
+    temporaneo = percorso + '.tmp'
+    with open(temporaneo, 'wb') as file:
+        np.savez(file,
+                 motif_ids=np.array([motif['motif_id'] for motif in motifs], dtype=str),
+                 tf_names=np.array([motif['TF_name'] for motif in motifs], dtype=str),
+                 lunghezze=np.array([pfm.shape[1] for pfm in pfms], dtype=np.int64),
+                 interi=np.array([np.issubdtype(pfm.dtype, np.integer) for pfm in pfms], dtype=bool),
+                 pfm=np.concatenate(pfms, axis=1).astype(np.float64) if pfms else np.zeros((4, 0)),
+                 lunghezze_buckets=np.array(sorted(store.buckets), dtype=np.int64),
+                 parametri=np.array(json.dumps(parametri_buckets())),
+                 versione=np.array(json.dumps(versione)),
+                 **buckets)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporaneo, percorso)
+
+
+def carica_snapshot(percorso):
+    with metriche.fase('snapshot_load'), np.load(percorso, allow_pickle=False) as snapshot:
+        motif_ids = snapshot['motif_ids'].tolist()
+        tf_names = snapshot['tf_names'].tolist()
+        pfms = np.split(snapshot['pfm'], np.cumsum(snapshot['lunghezze'])[:-1], axis=1) if motif_ids else []
+        # (the snapshots written before the flag have only integers)
+        interi = snapshot['interi'] if 'interi' in snapshot else np.ones(len(pfms), dtype=bool)
+        pfms = [pfm.astype(np.int64) if intero else pfm for pfm, intero in zip(pfms, interi)]
+        versione = json.loads(snapshot['versione'].item())
+        motifs = [{'motif_id': motif_id, 'TF_name': tf_name, 'PFM': pfm}
+                  for motif_id, tf_name, pfm in zip(motif_ids, tf_names, pfms)]
+
+        buckets = None
+        if 'parametri' in snapshot and json.loads(snapshot['parametri'].item()) == parametri_buckets():
+            buckets = {}
+            for lunghezza in snapshot['lunghezze_buckets'].tolist():
+                buckets[lunghezza] = {'motif_ids': [motif_ids[i] for i in snapshot[f'bucket_{lunghezza}_motivi']],
+                                      **{campo: snapshot[f'bucket_{lunghezza}_{campo}'] for campo in campi_bucket}}
+    with metriche.fase('jaspar_index'):
+        store = MotifStore(motifs, buckets)
+    return store, versione
+
+
+# The version of a local Jaspar file, to know if the snapshot was created from it as it is now
+def versione_file(percorso):
+    stato = os.stat(percorso)
+    return {'file': os.path.abspath(percorso), 'size': stato.st_size, 'mtime_ns': stato.st_mtime_ns}
+
+
+# Function that chooses from where to load the database, depending on the options of the command line
+def carica_database(opzioni):
+    percorso_snapshot = opzioni.get('--snapshot')
+    if '--jaspar-file' in opzioni:
+        versione = versione_file(opzioni['--jaspar-file'])
+        # the snapshot is used if it was created from the file as it is now, otherwise it's created again
+        if percorso_snapshot is not None and os.path.exists(percorso_snapshot):
+            store, versione_snapshot = carica_snapshot(percorso_snapshot)
+            if versione_snapshot == versione:
+                return store
+        store = carica_file_jaspar(opzioni['--jaspar-file'])
+        if percorso_snapshot is not None:
+            salva_snapshot(store, percorso_snapshot, versione)
+        return store
+
+    snapshot = None
+    if percorso_snapshot is not None and os.path.exists(percorso_snapshot):
+        snapshot = carica_snapshot(percorso_snapshot)
+        # offline there is no way to check if it's up to date, so the snapshot is used as it is
+        if opzioni.get('--offline'):
+            return snapshot[0]
+
+    with metriche.fase('jaspar_download'):
+        percorso_file, versione = scarica_jaspar(opzioni.get('--cache-dir', '.'), opzioni.get('--offline', False))
+    if percorso_file is None:
+        if snapshot is not None:
+            return snapshot[0]
+        raise ValueError('ERROR: there is no Jaspar database available, check the internet connection or the options')
+
+    # if the Jaspar file hasn't changed since the snapshot was created, the snapshot is used instead of parsing the file
+    if snapshot is not None and snapshot[1] == versione:
+        return snapshot[0]
+
+    store = carica_file_jaspar(percorso_file)
+    if percorso_snapshot is not None:
+        salva_snapshot(store, percorso_snapshot, versione)
+    return store
+
+
+# The following block of code is to save the changes done with POST, PUT and DELETE, so they survive a restart.
+# Each change is added at the end of a log file (one json per line) before being done in the database. To not wait
+# for the disk at each request, the log is written on the disk (with fsync) by a thread every few milliseconds,
+# all the changes of that moment together, and the requests wait only for that.
+# Every some changes, all the database is saved in a snapshot (the same format of the --snapshot option) with the
+# number of the last change, and the log is emptied: at the start the snapshot is loaded and only the changes of the
+# log after it are done again
+
+nome_snapshot_dati = 'motifs.npz'
+nome_log_dati = 'motifs.log'
+intervallo_fsync = 0.005
+modifiche_per_compattazione = 1000
+
+
+class MotifLog:
+
+    def __init__(self, cartella, ultimo_numero=0, modifiche_per_compattazione=modifiche_per_compattazione):
+        self.percorso_log = os.path.join(cartella, nome_log_dati)
+        self.percorso_snapshot = os.path.join(cartella, nome_snapshot_dati)
+        self.modifiche_per_compattazione = modifiche_per_compattazione
+        self.ultimo_numero = ultimo_numero
+        self.numero_su_disco = ultimo_numero
+        self.modifiche_nel_log = 0
+        self.file = open(self.percorso_log, 'a')
+        self.condizione = threading.Condition()
+        threading.Thread(target=self._scrivi_su_disco, daemon=True).start()
+
+    # Function to add a change to the log. It must be called while holding the lock of the database, so the changes
+    # are in the log in the same order they are done; then, after releasing the lock, with the number that it returns
+    # it's possible to wait that the change is safe on the disk
+    def append(self, modifica):
+        with self.condizione:
+            self.ultimo_numero += 1
+            self.file.write(json.dumps({'seq': self.ultimo_numero, **modifica}) + '\n')
+            self.modifiche_nel_log += 1
+            self.condizione.notify_all()
+            return self.ultimo_numero
+
+    def attendi(self, numero):
+        with self.condizione:
+            while self.numero_su_disco < numero:
+                self.condizione.wait()
+
+    def _scrivi_su_disco(self):
+        while True:
+            with self.condizione:
+                while self.numero_su_disco == self.ultimo_numero:
+                    self.condizione.wait()
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.numero_su_disco = self.ultimo_numero
+                self.condizione.notify_all()
+            # in the meantime the other requests can add their changes, that will be written all together
+            time.sleep(intervallo_fsync)
+
+    def deve_compattare(self):
+        return self.modifiche_nel_log >= self.modifiche_per_compattazione
+
+    # Function to save all the database in the snapshot and empty the log. The snapshot is renamed only at the end,
+    # so if the service stops in the middle there is still the old snapshot with the full log.
+    # Like append, it must be called while holding the lock of the database, so the snapshot has all the changes
+    # of the log and nothing more
+    def compatta(self, store):
+        with self.condizione:
+            salva_snapshot(store, self.percorso_snapshot, {'seq': self.ultimo_numero})
+            self.file.close()
+            self.file = open(self.percorso_log, 'w')
+            self.modifiche_nel_log = 0
+            # all the changes are in the snapshot now, so the requests that are waiting for the log can go on
+            self.numero_su_disco = self.ultimo_numero
+            self.condizione.notify_all()
+
+
+# Function to do again a change of the log on the database (on a MotifChange)
+def applica_modifica(modifica_store, modifica):
+    if modifica['op'] == 'batch':
+        modifica_store.delete_many([motif_id for motif_id in modifica['delete'] if motif_id in modifica_store])
+        modifica_store.upsert_many([{'motif_id': motif['motif_id'], 'TF_name': motif['TF_name'],
+                                     'PFM': pfm_to_array(motif['PFM'])} for motif in modifica['upsert']])
+        return
+    if modifica['op'] == 'delete':
+        if modifica['motif_id'] in modifica_store:
+            modifica_store.delete(modifica['motif_id'])
+        return
+    pfm = pfm_to_array(modifica['PFM']) if modifica.get('PFM') is not None else None
+    if modifica['motif_id'] in modifica_store:
+        modifica_store.update(modifica['motif_id'], tf_name=modifica.get('TF_name'), pfm=pfm)
+    else:
+        modifica_store.add(modifica['motif_id'], modifica['TF_name'], pfm)
 
-    return pfm_normalizzata
 
+# Function to open the data directory at the start: if there is a snapshot it replaces the database loaded from
+# Jaspar (that is used only the first time), then the changes of the log after the snapshot are done again
+def apri_dati_persistenti(cartella, carica_jaspar, modifiche_per_compattazione=modifiche_per_compattazione):
+    os.makedirs(cartella, exist_ok=True)
+    percorso_snapshot = os.path.join(cartella, nome_snapshot_dati)
+    percorso_log = os.path.join(cartella, nome_log_dati)
 
-# Function to compute the score: I'm multiplying the frequencies for each position in the motif corresponding to the same letter in the sequence
-def calcola_score(sequenza, pfm_normalizzata):
-    score = 1
-    for posizione, nucleotide in enumerate(sequenza):
-        score *= pfm_normalizzata[nucleotide][posizione]
-    return score
+    if os.path.exists(percorso_snapshot):
+        store, versione = carica_snapshot(percorso_snapshot)
+        ultimo_numero = versione['seq']
+    else:
+        store, ultimo_numero = carica_jaspar(), 0
+
+    modifiche_rifatte = 0
+    if os.path.exists(percorso_log):
+        fine_valida = 0
+        with open(percorso_log, 'rb') as file, store.scrittura() as modifica_store:
+            for riga in file:
+                # the last line could be incomplete if the service stopped while writing it (a change is confirmed
+                # only when all its line, with the new line, is on the disk)
+                if not riga.endswith(b'\n'):
+                    break
+                try:
+                    modifica = json.loads(riga)
+                except ValueError:
+                    break
+                fine_valida += len(riga)
+                if modifica['seq'] > ultimo_numero:
+                    applica_modifica(modifica_store, modifica)
+                    ultimo_numero = modifica['seq']
+                    modifiche_rifatte += 1
+        # what is after the last complete change is removed, otherwise the next changes would be written at the end
+        # of the incomplete line and they would be lost at the next start
+        if fine_valida < os.path.getsize(percorso_log):
+            with open(percorso_log, 'r+b') as file:
+                file.truncate(fine_valida)
+                os.fsync(file.fileno())
+
+    log = MotifLog(cartella, ultimo_numero, modifiche_per_compattazione)
+    log.modifiche_nel_log = modifiche_rifatte
+    if modifiche_rifatte:
+        with store.lock:
+            log.compatta(store.snapshot())
+    return store, log
+
+
+# The log is None when the option --data-dir is not used, and the changes are only in memory
+motif_log = None
+
+
+# Function called by the routes that change the database, inside motif_store.scrittura() and before doing the change:
+# it returns the number of the change in the log
+def registra_modifica(modifica):
+    if motif_log is not None:
+        return motif_log.append(modifica)
+
+
+# Function called by the routes after the change is done (outside motif_store.scrittura()): it waits that the change
+# is on the disk and, if there are too many changes in the log, it saves all the database in the snapshot
+def conferma_modifica(numero):
+    if motif_log is None:
+        return
+    motif_log.attendi(numero)
+    if motif_log.deve_compattare():
+        with motif_store.lock:
+            if motif_log.deve_compattare():
+                motif_log.compatta(motif_store.snapshot())
 
 
 # function to translate the proteic sequence into all the DNA sequences
-def dna_sequences_from_protein(protein_sequence, gencode):
-    dna_sequences = []
+# The possible DNA sequences are too many to be created all together (they grow exponentially with the length of the
+# protein), so they are created one at a time and only when they are needed.
+# Each sequence has a number, like in a counter where every digit is a codon of an amino acid: the last amino acid
+# changes faster (it's the same order of itertools.product). In this way I can start from any sequence (the cursor of
+# a page) without creating all the previous ones
+def codoni_proteina(protein_sequence, gencode):
+    return [gencode[amino_acid] for amino_acid in protein_sequence if amino_acid in gencode]
+
+
+def numero_sequenze_dna(codoni):
+    numero = 1
+    for codoni_amminoacido in codoni:
+        numero *= len(codoni_amminoacido)
+    return numero
+
+
+def dna_sequences_from_protein(protein_sequence, gencode, inizio=0):
+    codoni = codoni_proteina(protein_sequence, gencode)
+    if inizio >= numero_sequenze_dna(codoni):
+        return
+
+    # the digits of the first sequence
+    cifre = []
+    for codoni_amminoacido in reversed(codoni):
+        inizio, cifra = divmod(inizio, len(codoni_amminoacido))
+        cifre.append(cifra)
+    cifre.reverse()
+
+    while True:
+        yield ''.join(codoni_amminoacido[cifra] for codoni_amminoacido, cifra in zip(codoni, cifre))
+        # next sequence: the last digit is incremented, and when it goes back to 0 the previous one is incremented
+        posizione = len(cifre) - 1
+        while posizione >= 0:
+            cifre[posizione] += 1
+            if cifre[posizione] < len(codoni[posizione]):
+                break
+            cifre[posizione] = 0
+            posizione -= 1
+        if posizione < 0:
+            return
+
+
+# Function to find the DNA sequences, translated back from the protein, with the best scores, without creating all of
+# them: the score of a sequence is the sum of the scores of its codons (in logarithm), so for each motif I keep only
+# the best top_k partial scores after each amino acid (dynamic programming), and the best top_k sequences can only
+# be made by adding a codon to one of them.
+# It's done for all the motifs of the same length of the DNA sequences together, and then the best top_k couples of
+# motif and sequence are returned, as (DNA sequence, motif ID, score, p-value, strand) like in seleziona_punteggi.
+# The reverse strand is scored with the matrices reversed on both axes (like in score_filamenti); with both strands
+# the two matrices of a motif are searched like two motifs, and for each couple of sequence and motif only the best
+# strand is kept: 2 * top_k candidates are enough, because each couple can be there at most twice
+def migliori_sequenze_dna(protein_sequence, gencode, top_k, punteggio='probability', filamenti='forward'):
+    codoni = codoni_proteina(protein_sequence, gencode)
+    bucket = motif_store.buckets.get(3 * len(codoni))
+    if bucket is None:
+        raise ValueError(f'There are no motifs of the same length of the DNA sequences ({3 * len(codoni)})')
+
+    numero_motivi = len(bucket['motif_ids'])
+    matrici = bucket['pwm' if punteggio == 'logodds' else 'log']
+    filamenti_righe = {'forward': [0], 'reverse': [1], 'both': [0, 1]}[filamenti]
+    matrici = np.concatenate([matrici[:, ::-1, ::-1] if filamento else matrici for filamento in filamenti_righe])
+    numero_righe = len(matrici)
+    righe = np.arange(numero_righe)[:, None]
+    parziali = np.zeros((numero_righe, 1))
+    provenienze = []
+    for posizione, codoni_amminoacido in enumerate(codoni):
+        # score of each codon of this amino acid for each motif (motivi x codoni)
+        indici = np.array([codifica_sequenza(codone) for codone in codoni_amminoacido])
+        score_codoni = matrici[:, 3 * posizione + np.arange(3), indici].sum(axis=2)
+        candidati = (parziali[:, :, None] + score_codoni[:, None, :]).reshape(numero_righe, -1)
+        if candidati.shape[1] > top_k:
+            migliori = np.argpartition(-candidati, top_k - 1, axis=1)[:, :top_k]
+        else:
+            migliori = np.broadcast_to(np.arange(candidati.shape[1]), candidati.shape)
+        parziali = candidati[righe, migliori]
+        # for each partial score I remember which previous one and which codon it comes from
+        provenienze.append(np.divmod(migliori, len(codoni_amminoacido)))
+
+    # the best couples of all the motifs: with the log-odds scores the ones with the smallest p-value
+    score = parziali.ravel()
+    if punteggio == 'logodds':
+        inversi = np.array(filamenti_righe, dtype=bool)[righe // numero_motivi]
+        chiave = pvalori(bucket, righe % numero_motivi, parziali, inversi).ravel()
+    else:
+        chiave = -score
+    numero_migliori = min(top_k * len(filamenti_righe), len(score))
+    migliori = np.argpartition(chiave, numero_migliori - 1)[:numero_migliori]
+    migliori = migliori[np.lexsort((-score[migliori], chiave[migliori]))]
+
+    risultati, trovati = [], set()
+    for migliore in migliori:
+        riga, candidato = divmod(int(migliore), parziali.shape[1])
+        sequenza_codoni = []
+        for (precedenti, codici_codoni), codoni_amminoacido in zip(reversed(provenienze), reversed(codoni)):
+            sequenza_codoni.append(codoni_amminoacido[codici_codoni[riga, candidato]])
+            candidato = precedenti[riga, candidato]
+        dna, motif_id = ''.join(reversed(sequenza_codoni)), bucket['motif_ids'][riga % numero_motivi]
+        if (dna, motif_id) in trovati:
+            continue
+        trovati.add((dna, motif_id))
+        risultati.append((dna, motif_id,
+                          float(score[migliore]) if punteggio == 'logodds' else float(np.exp(score[migliore])),
+                          float(chiave[migliore]) if punteggio == 'logodds' else None,
+                          '+-'[filamenti_righe[riga // numero_motivi]] if filamenti != 'forward' else None))
+    return risultati[:top_k]
+
+
+# Number of DNA sequences in a page, if it's not given with the argument limit, and the maximum ones
+sequenze_dna_per_pagina = 1000
+sequenze_dna_massime_per_pagina = 10000
+top_k_massimo = 1000
+
+
+# Function for the protein sequences in getScore. By default it returns a page of the DNA sequences translated back
+# (the argument cursor is where the page starts, and the response has the cursor of the next page); with
+# stream=true it streams all of them, one for line; with mode=best it returns the top_k DNA sequences with the best
+# score, each with its motif (with the scoring and the strands asked, like for a DNA sequence). The pages and the
+# stream are only the sequences, so scoring, strand and the filters of the scores can't be used with them
+def risposta_proteina(sequenza, warning, punteggio='probability', filamenti='forward', filtri=()):
+    codoni = codoni_proteina(sequenza, gencode)
+    numero_sequenze = numero_sequenze_dna(codoni)
+
+    migliori_sequenze = request.args.get('mode') == 'best'
+    non_usati = [nome for nome in filtri if not migliori_sequenze or nome in ('min_score', 'max_pvalue', 'format')]
+    if non_usati:
+        raise ValueError(f"{', '.join(non_usati)} can't be used with a protein sequence"
+                         + (" and mode=best" if migliori_sequenze else ", only scoring and strand with mode=best"))
+
+    if migliori_sequenze:
+        top_k = argomento_numerico('top_k', int, 10)
+        if not 1 <= top_k <= top_k_massimo:
+            raise ValueError(f'top_k must be a number between 1 and {top_k_massimo}')
+        migliori = lavori_pesanti.esegui(migliori_sequenze_dna, sequenza, gencode, top_k, punteggio, filamenti)
+        colonne = ('DNA sequence\tMotif ID\t' + ('Log-odds score\tP-value' if punteggio == 'logodds' else 'Score')
+                   + ('\tStrand' if filamenti != 'forward' else ''))
+        return jsonify_formatted({
+            f'{warning}Number of possible DNA sequences: {numero_sequenze}. Best DNA sequences and their motifs:':
+                colonne + ''.join(f'\n{dna}\t{motif_id}\t{score}' + (f'\t{pvalore}' if pvalore is not None else '')
+                                  + (f'\t{filamento}' if filamento is not None else '')
+                                  for dna, motif_id, score, pvalore, filamento in migliori)})
+
+    if request.args.get('stream') == 'true':
+        def genera_sequenze():
+            for dna_sequence in dna_sequences_from_protein(sequenza, gencode):
+                yield dna_sequence + '\n'
+        return Response(stream_with_context(genera_sequenze()), mimetype='text/plain')
+
+    cursore = argomento_numerico('cursor', int, 0)
+    limite = argomento_numerico('limit', int, sequenze_dna_per_pagina)
+    if cursore < 0:
+        raise ValueError('The cursor must be a positive number')
+    if not 1 <= limite <= sequenze_dna_massime_per_pagina:
+        raise ValueError(f'The limit must be a number between 1 and {sequenze_dna_massime_per_pagina}')
+
+    dna_sequences = list(islice(dna_sequences_from_protein(sequenza, gencode, cursore), limite))
+    prossimo_cursore = cursore + limite if cursore + limite < numero_sequenze else None
+    return jsonify_formatted({
+        f'{warning}Choose one options in the following DNA sequences list and then retry to get the score:': dna_sequences,
+        f'Number of DNA sequences: {numero_sequenze}. Next cursor:': prossimo_cursore})
 
-    for amino_acid in protein_sequence:
-        if amino_acid in gencode:
-            dna_sequences.append(gencode[amino_acid])
+# genetic code
+gencode = {'I': ['ATA', 'ATC', 'ATT'], 'M': ['ATG'], 'T': ['ACA', 'ACC', 'ACG', 'ACT'], 'N': ['AAC', 'AAT'], 'K': ['AAA', 'AAG'], 'S': ['AGC', 'AGT', 'TCA', 'TCC', 'TCG', 'TCT'], 'R': ['AGA', 'AGG', 'CGA', 'CGC', 'CGG', 'CGT'], 'L': ['CTA', 'CTC', 'CTG', 'CTT', 'TTA', 'TTG'], 'P': ['CCA', 'CCC', 'CCG', 'CCT'], 'H': ['CAC', 'CAT'], 'Q': ['CAA', 'CAG'], 'V': ['GTA', 'GTC', 'GTG', 'GTT'], 'A': ['GCA', 'GCC', 'GCG', 'GCT'], 'D': ['GAC', 'GAT'], 'E': ['GAA', 'GAG'], 'G': ['GGA', 'GGC', 'GGG', 'GGT'], 'F': ['TTC', 'TTT'], 'Y': ['TAC', 'TAT'], 'C': ['TGC', 'TGT'], 'W': ['TGG']}
 
-    # generate all the possible sequences
-    from itertools import product
-    possible_dna_sequences = [''.join(seq) for seq in product(*dna_sequences)]
 
-    return possible_dna_sequences
+# The results of getScore are kept in memory, because the same sequences are asked many times: the key is the
+# sequence (in uppercase and with T instead of U) with the options of the scores, and the results are kept for
+# durata seconds at most, deleting the least recently used ones when they take more than byte_massimi.
+# When the motifs of a length change, the results of the sequences of that length are deleted: for each length
+# there is a generation, that increases at each change, and a result is saved only if it was computed in the
+# generation that is still the current one (otherwise it could be computed with the motifs before the change)
+byte_cache_risultati = 16 * 1024 * 1024
+durata_cache_risultati = 300
+
+
+class CacheRisultati:
+
+    def __init__(self, byte_massimi, durata):
+        self.byte_massimi = byte_massimi
+        self.durata = durata
+        self.byte = 0
+        self.risultati = OrderedDict()  # key -> (expiry, bytes, result)
+        self.per_lunghezza = {}  # length of the sequence -> keys of the results
+        self.generazioni = {}
+        self.successi = self.mancati = self.eliminati = self.invalidati = 0
+        self.lock = threading.Lock()
+
+    # The memory used by a result is only estimated: the sequence plus about 120 bytes for each motif
+    def _dimensione(self, chiave, risultato):
+        return 200 + len(chiave[0]) + 120 * len(risultato[1])
+
+    def generazione(self, lunghezza):
+        with self.lock:
+            return self.generazioni.get(lunghezza, 0)
+
+    def get(self, chiave):
+        with self.lock:
+            elemento = self.risultati.get(chiave)
+            if elemento is not None and elemento[0] < time.monotonic():
+                self._togli(chiave)
+                elemento = None
+            if elemento is None:
+                self.mancati += 1
+                return None
+            self.risultati.move_to_end(chiave)
+            self.successi += 1
+            return elemento[2]
+
+    def put(self, chiave, generazione, risultato):
+        lunghezza = len(chiave[0])
+        dimensione = self._dimensione(chiave, risultato)
+        with self.lock:
+            if generazione != self.generazioni.get(lunghezza, 0) or dimensione > self.byte_massimi:
+                return
+            if chiave in self.risultati:
+                self._togli(chiave)
+            self.risultati[chiave] = (time.monotonic() + self.durata, dimensione, risultato)
+            self.per_lunghezza.setdefault(lunghezza, set()).add(chiave)
+            self.byte += dimensione
+            while self.byte > self.byte_massimi:
+                self._togli(next(iter(self.risultati)))
+                self.eliminati += 1
+
+    def invalida(self, lunghezze):
+        with self.lock:
+            for lunghezza in lunghezze:
+                self.generazioni[lunghezza] = self.generazioni.get(lunghezza, 0) + 1
+                for chiave in list(self.per_lunghezza.get(lunghezza, ())):
+                    self._togli(chiave)
+                    self.invalidati += 1
+
+    def _togli(self, chiave):
+        self.byte -= self.risultati.pop(chiave)[1]
+        chiavi = self.per_lunghezza[len(chiave[0])]
+        chiavi.discard(chiave)
+        if not chiavi:
+            del self.per_lunghezza[len(chiave[0])]
+
+    def statistiche(self):
+        with self.lock:
+            richieste = self.successi + self.mancati
+            return {'hits': self.successi, 'misses': self.mancati,
+                    'hit_rate': self.successi / richieste if richieste else 0.0,
+                    'entries': len(self.risultati), 'bytes': self.byte, 'max_bytes': self.byte_massimi,
+                    'evictions': self.eliminati, 'invalidations': self.invalidati}
+
+
+risultati_cache = CacheRisultati(byte_cache_risultati, durata_cache_risultati)
+
+
+# Function to see how the cache of the results is working
+@app.route('/Motifs/cache/stats', methods=['GET'])
+def getCacheStats():
+    statistiche = risultati_cache.statistiche()
+    return jsonify_formatted({'Statistics of the cache of the scores:':
+                              ''.join(f'{nome}\t{valore}\n' for nome, valore in statistiche.items())})
+
+
+# The scores can be returned as the text of the other requests (the default), in json, as tab-separated values or
+# in a compact binary format (a numpy array, that can be read with numpy.load): the format is chosen with the
+# argument format or with the header Accept
+formati_punteggi = {'text': 'text/plain', 'json': 'application/json', 'tsv': 'text/tab-separated-values',
+                    'npy': 'application/x-npy'}
+
+
+def formato_punteggi():
+    formato = request.args.get('format')
+    if formato is None:
+        tipo = request.accept_mimetypes.best_match(list(formati_punteggi.values()))
+        formato = next((nome for nome, mimetype in formati_punteggi.items() if mimetype == tipo), 'text')
+    if formato not in formati_punteggi:
+        raise ValueError('The format must be text, json, tsv or npy')
+    return formato
+
+
+def risposta_punteggi(formato, sequenza, punteggio, numero_motivi, frequenze_motivi, warning, filamenti='forward'):
+    if formato == 'json':
+        risultati = [{'motif_id': motif_id, 'score': score, **({'p_value': pvalore} if pvalore is not None else {}),
+                      **({'strand': filamento} if filamento is not None else {})}
+                     for motif_id, score, pvalore, filamento in frequenze_motivi]
+        dati = {'sequence': sequenza, 'scoring': punteggio, 'strand': filamenti, 'motifs_analyzed': numero_motivi,
+                'results': risultati}
+        if warning is not None:
+            dati['warning'] = warning.strip()
+        return Response(json.dumps(dati), mimetype='application/json')
+
+    if formato == 'tsv':
+        intestazione = 'motif_id\tscore' + ('\tp_value' if punteggio == 'logodds' else '') \
+            + ('\tstrand\n' if filamenti != 'forward' else '\n')
+        return Response(intestazione + format_frequenzeMotivi_output(frequenze_motivi),
+                        mimetype='text/tab-separated-values')
+
+    lunghezza_id = max((len(motif_id.encode()) for motif_id, *_ in frequenze_motivi), default=1)
+    con_filamento = filamenti != 'forward'
+    campi = [('motif_id', f'S{lunghezza_id}'), ('score', '<f8')] + ([('p_value', '<f8')] if punteggio == 'logodds' else []) \
+        + ([('strand', 'S1')] if con_filamento else [])
+    array = np.array([(motif_id.encode(), score) + ((pvalore,) if punteggio == 'logodds' else ())
+                      + ((filamento.encode(),) if con_filamento else ())
+                      for motif_id, score, pvalore, filamento in frequenze_motivi], dtype=campi)
+    dati = io.BytesIO()
+    np.save(dati, array, allow_pickle=False)
+    return Response(dati.getvalue(), mimetype='application/x-npy')
+
+
+# Function for the mode=fit of getScore: the best top_k motifs (10 if it's not given) among all the ones that fit in
+# the sequence, each with its best position, displayed like the hits of the scan
+def risposta_fit(formato, sequenza_originale, sequenza, punteggio, top_k, min_score, max_pvalue, filamenti, warning):
+    top_k = top_k if top_k is not None else 10
+    if top_k > top_k_massimo:
+        raise ValueError(f'top_k must be a number between 1 and {top_k_massimo}')
+    if formato == 'npy':
+        raise ValueError('The format of mode=fit must be text, json or tsv')
+    numero_motivi, hits = cerca_motivi(sequenza, punteggio, top_k, min_score, max_pvalue, filamenti)
+
+    if formato == 'json':
+        risultati = [{'motif_id': motif_id, 'start': inizio + 1, 'end': inizio + lunghezza, 'strand': filamento,
+                      'score': score, **({'p_value': pvalore} if pvalore is not None else {})}
+                     for motif_id, inizio, lunghezza, filamento, score, pvalore in hits]
+        dati = {'sequence': sequenza_originale, 'scoring': punteggio, 'strand': filamenti, 'mode': 'fit',
+                'motifs_analyzed': numero_motivi, 'results': risultati}
+        if warning is not None:
+            dati['warning'] = warning.strip()
+        return Response(json.dumps(dati), mimetype='application/json')
 
-# genetic code
-gencode = {'I': ['ATA', 'ATC', 'ATT'], 'M': ['ATG'], 'T': ['ACA', 'ACC', 'ACG', 'ACT'], 'N': ['AAC', 'AAT'], 'K': ['AAA', 'AAG'], 'S': ['AGC', 'AGT', 'TCA', 'TCC', 'TCG', 'TCT'], 'R': ['AGA', 'AGG', 'CGA', 'CGC', 'CGG', 'CGT'], 'L': ['CTA', 'CTC', 'CTG', 'CTT', 'TTA', 'TTG'], 'P': ['CCA', 'CCC', 'CCG', 'CCT'], 'H': ['CAC', 'CAT'], 'Q': ['CAA', 'CAG'], 'V': ['GTA', 'GTC', 'GTG', 'GTT'], 'A': ['GCA', 'GCC', 'GCG', 'GCT'], 'D': ['GAC', 'GAT'], 'E': ['GAA', 'GAG'], 'G': ['GGA', 'GGC', 'GGG', 'GGT'], 'F': ['TTC', 'TTT'], 'Y': ['TAC', 'TAT'], 'C': ['TGC', 'TGT'], 'W': ['TGG']}
+    intestazione = 'motif_id\tstart\tend\tstrand\tscore' + ('\tp_value\n' if punteggio == 'logodds' else '\n')
+    if formato == 'tsv':
+        return Response(intestazione + format_hits_output(hits), mimetype='text/tab-separated-values')
+    return jsonify_formatted({
+        f'{warning or ""}Given sequence: {sequenza_originale}. Number of motifs that fit in it: {numero_motivi}':
+            f'Best motifs and their positions:\n{intestazione}{format_hits_output(hits)}'})
 
 
 # This is the function to get the score
@@ -350,12 +2521,37 @@ gencode = {'I': ['ATA', 'ATC', 'ATT'], 'M': ['ATG'], 'T': ['ACA', 'ACC', 'ACG',
 def getScore(sequenza):
     sequenza_originale = sequenza
     warning = None
+    inizio = time.perf_counter()
 
     # control that in the sequence there are only letters
     try:
         if not sequenza.isalpha():
             raise ValueError('The sequence must include only letters')
 
+        # the scores can be the probabilities (the default) or the log-odds scores with their p-values
+        max_pvalue = argomento_numerico('max_pvalue', float)
+        punteggio = request.args.get('scoring', 'probability' if max_pvalue is None else 'logodds')
+        if punteggio not in ('probability', 'logodds'):
+            raise ValueError('The scoring must be probability or logodds')
+        if max_pvalue is not None and (punteggio != 'logodds' or not 0 < max_pvalue <= 1):
+            raise ValueError('The maximum p-value must be a number between 0 and 1, and only for the log-odds scores')
+
+        # optionally only the best top_k motifs, and only the ones with at least min_score
+        top_k = argomento_numerico('top_k', int)
+        if top_k is not None and top_k < 1:
+            raise ValueError('top_k must be a positive number')
+        min_score = argomento_numerico('min_score', float)
+        if min_score is not None and punteggio == 'probability' and min_score <= 0:
+            raise ValueError('The minimum score must be a positive number')
+
+        # the sequence is scored as it is (forward, the default), on its reverse complement (reverse) or on both
+        # strands, keeping for each motif the best one
+        filamenti = request.args.get('strand', 'forward')
+        if filamenti not in filamenti_punteggi:
+            raise ValueError('The strand must be forward, reverse or both')
+
+        formato = formato_punteggi()
+
         # Transforming all letters in uppercase
         sequenza = sequenza.upper()
 
@@ -366,85 +2562,671 @@ def getScore(sequenza):
             raise ValueError('The sequence contains both T and U. Please choose between DNA or RNA')
 
         # Now I'm distinguishing between different cases: DNA, RNA or protein
-        # DNA
-        if set(sequenza) <= set('ACGT'):
-            dna_sequences = [sequenza]
-
+        # A DNA sequence can be scored as it is, so I only have to handle the other two cases
         # RNA
-        elif set(sequenza) <= set('ACGU'):
+        if not set(sequenza) <= set('ACGT') and set(sequenza) <= set('ACGU'):
             warning = 'WARNING: The sequence contains U, it could be an RNA. I will replace U with T\n'
             sequenza = sequenza.replace('U', 'T')
-            dna_sequences = [sequenza]
 
         # protein
-        else:
+        elif not set(sequenza) <= set('ACGT'):
             warning = 'WARNING: The sequence contains lots of letters, it could be a protein sequence. I will translate it back to DNA.\n'
-            dna_sequences = dna_sequences_from_protein(sequenza, gencode)
-            return jsonify_formatted({
-                                f'{warning}Choose one options in the following DNA sequences list and then retry to get the score:': dna_sequences})
+            return risposta_proteina(sequenza, warning, punteggio, filamenti,
+                                     [nome for nome in ('scoring', 'strand', 'min_score', 'max_pvalue', 'format')
+                                      if nome in request.args])
 
         lunghezza_sequenza = len(sequenza)
 
-        # Find the maximum and minimum possible length of all motifs
-        lunghezza_minima = min(len(motif['PFM']['A']) for motif in motifs_data)
-        lunghezza_massima = max(len(motif['PFM']['A']) for motif in motifs_data)
+        # The maximum and minimum possible length of all motifs (kept in the version of the database)
+        versione = motif_store.snapshot()
+        if versione.lunghezza_minima is None:
+            raise ValueError('There are no motifs in the database')
+        lunghezza_minima = versione.lunghezza_minima
+        lunghezza_massima = versione.lunghezza_massima
 
-        # Check if the given sequence is too long or too short
+        # Check if the given sequence is too long or too short (with mode=fit all the motifs not longer than the
+        # sequence are scored, so it can't be too long)
         if lunghezza_sequenza < lunghezza_minima:
             return jsonify_formatted({'ERROR': f"The sequence is too short, the minimum lenght of a motif is {lunghezza_minima}"})
+        elif request.args.get('mode') == 'fit':
+            metriche.fine_fase('score_validation', inizio)
+            return risposta_fit(formato, sequenza_originale, sequenza, punteggio, top_k, min_score, max_pvalue,
+                                filamenti, warning)
         elif lunghezza_sequenza > lunghezza_massima:
             return jsonify_formatted({'ERROR': f"The sequence is too long, the maximum lenght of a motif is {lunghezza_massima}"})
 
-        frequenze_motivi = {}
+        # the generation is taken before computing the scores, so if the motifs change in the meantime the result
+        # is not saved
+        inizio = metriche.fine_fase('score_validation', inizio)
+        chiave = (sequenza, punteggio, top_k, min_score, max_pvalue, filamenti)
+        risultato = risultati_cache.get(chiave)
+        if risultato is None:
+            generazione = risultati_cache.generazione(len(sequenza))
+            risultato = seleziona_punteggi(sequenza, punteggio, top_k, min_score, max_pvalue, filamenti)
+            risultati_cache.put(chiave, generazione, risultato)
+        numero_motivi, frequenze_motivi = risultato
+        inizio = metriche.fine_fase('score_compute', inizio)
+
+        if not numero_motivi:
+            raise ValueError('There are no motifs of the same length of your sequence')
 
-        # for each motif(after normalizing it) computing the score with the functions above
-        for elemento in motifs_data:
-            pfm = elemento['PFM']
-            lunghezza_motivo = len(pfm['A'])  # all values have the same length
-            for seq in dna_sequences:
-                if lunghezza_motivo == len(seq):
-                    pfm_normalizzata = normalizza_pfm(pfm)
-                    score_motivo = calcola_score(seq, pfm_normalizzata)
-                    frequenze_motivi[elemento['motif_id']] = score_motivo
+        with metriche.fase(f'score_format_{formato}'):
+            if formato != 'text':
+                return risposta_punteggi(formato, sequenza_originale, punteggio, numero_motivi, frequenze_motivi,
+                                         warning, filamenti)
 
-        if not frequenze_motivi:
-            raise ValueError('There are no motifs of the same length of your sequence')
+            frequenze_motivi_bello = format_frequenzeMotivi_output(frequenze_motivi)
 
-        frequenze_motivi_ordinati = dict(sorted(frequenze_motivi.items(), key=lambda x: x[1], reverse=True))
-        frequenze_motivi_bello = format_frequenzeMotivi_output(frequenze_motivi_ordinati)
-        numero_motivi = len(frequenze_motivi_ordinati)
+            if punteggio == 'logodds':
+                frequenze_motivi_bello = f'(log-odds score and p-value)\n{frequenze_motivi_bello}'
+            if filamenti == 'both':
+                frequenze_motivi_bello = f'(best strand of each motif)\n{frequenze_motivi_bello}'
+            elif filamenti == 'reverse':
+                frequenze_motivi_bello = f'(reverse complement of the sequence)\n{frequenze_motivi_bello}'
 
-        if warning is not None:
+            if warning is not None:
+                return jsonify_formatted({
+                        f'{warning}Given sequence: {sequenza_originale}. Number of motifs analized: {numero_motivi}': f'Scores of motifs:\n{frequenze_motivi_bello}'})
             return jsonify_formatted({
-                    f'{warning}Given sequence: {sequenza_originale}. Number of motifs analized: {numero_motivi}': f'Scores of motifs:\n{frequenze_motivi_bello}'})
-        return jsonify_formatted({
-                f'Given sequence: {sequenza_originale}. Number of motifs analized: {numero_motivi}': f'Score of motifs:\n{frequenze_motivi_bello}'})
+                    f'Given sequence: {sequenza_originale}. Number of motifs analized: {numero_motivi}': f'Score of motifs:\n{frequenze_motivi_bello}'})
 
     except ValueError as ve:
         return jsonify_formatted({'ERROR:': str(ve)}), 400
 
 
+# The following functions are to scan a sequence of any length (a promoter, a peak or a whole chromosome) with all
+# the motifs, on both strands, returning the positions where the score is above a threshold.
+# Every window of the sequence is scored at the same time like in a convolution: the windows are a view on the
+# sequence (with the stride tricks of numpy, without copying anything), they are converted in one-hot vectors
+# and then a single matrix product with the log matrices of a bucket gives the scores of all windows and all motifs.
+# With a maximum p-value instead of a minimum score the log-odds matrices are used, and each motif has its own minimum
+# log-odds score (the one with that p-value, read from its table)
+
+# Default maximum p-value of a hit (used when neither min_score nor max_pvalue are given) and number of windows scored
+# together (to limit the memory used for long sequences). The default is a p-value and not a minimum probability
+# because the same probability means very different things for motifs of different lengths: 1e-4 is less than the
+# probability of any 6-mer for a random motif, so almost every window would be a hit of the short motifs, while a
+# p-value of 1e-4 gives about one hit every 10000 windows for each motif, whatever its length
+pvalore_scan_predefinito = 1e-4
+finestre_per_blocco = 65536
+# A long sequence is scanned (and its hits are sent) one piece at a time, of this number of windows (or of the windows
+# of a job for each process of the pool)
+finestre_per_pezzo_scan = 1000000
+
+# The logarithm of a probability 0 is -inf, that can't be used in a matrix product (0 * -inf is nan), so in the scan
+# it's replaced by a very low value: a window with that nucleotide can never be a hit anyway
+log_minimo = -1e4
+# The windows are selected with the scores in single precision a bit below the threshold, and then the exact scores are
+# compared again with it, so the rounding of the single precision can't lose any hit
+tolleranza_scan = 1e-3
+
+
+# Function to prepare the matrices of a bucket (its array of logarithms) for the scan, with both strands together:
+# the reverse complement of a motif is the motif read backwards with A<->T and C<->G swapped, that with the order
+# ACGT is just reversing both the positions and the nucleotides.
+# The product is done in single precision to be faster, so it returns also the exact matrices to compute again
+# the score of the hits (they are few) with the same precision of getScore
+def matrici_scan(logaritmi):
+    esatte = np.concatenate([logaritmi, logaritmi[:, ::-1, ::-1]])
+    matrici = np.maximum(esatte, log_minimo).astype(np.float32)
+    return matrici.reshape(len(matrici), -1).T, esatte
+
+
+# The windows that contain letters that are not nucleotides (like N) can't be hits: to know it quickly for each window
+# I count how many of these letters there are before each position
+def prepara_indici_scan(indici):
+    non_nucleotidi = np.concatenate([[0], np.cumsum(indici > 3)])
+    return np.minimum(indici, 3), non_nucleotidi
+
+
+# Function to scan a sequence with the motifs of one bucket: it returns the columns of the hits in the matrices (the
+# first half of the columns are the motifs on the forward strand, the second half on the reverse one), the starts of
+# the hits and their logarithmic scores. The threshold (soglie) is one number for all the motifs or an array with one
+# for each column. When the sequence is a piece of a longer one, only the windows that start before fine_finestre
+# are scanned, because the next ones are the first windows of the next piece
+def scansiona_bucket(indici, non_nucleotidi, lunghezza, matrici, esatte, soglie, fine_finestre=None):
+    numero_finestre = len(indici) - lunghezza + 1
+    if fine_finestre is not None:
+        numero_finestre = min(numero_finestre, fine_finestre)
+    colonne = np.arange(lunghezza) * 4
+    finestre_valide = non_nucleotidi[lunghezza:lunghezza + numero_finestre] == non_nucleotidi[:numero_finestre]
+    soglie = np.broadcast_to(soglie, matrici.shape[1])
+    soglie_scan = (soglie - tolleranza_scan).astype(np.float32)
+
+    hits_colonne, hits_inizi, hits_score = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+    for inizio in range(0, numero_finestre, finestre_per_blocco):
+        fine = min(inizio + finestre_per_blocco, numero_finestre)
+        finestre = sliding_window_view(indici[inizio:fine + lunghezza - 1], lunghezza)
+        one_hot = np.zeros((fine - inizio, lunghezza * 4), dtype=np.float32)
+        one_hot[np.arange(fine - inizio)[:, None], colonne + finestre] = 1
+        score = one_hot @ matrici
+
+        posizioni, colonne_hits = np.divmod(np.flatnonzero(score >= soglie_scan), matrici.shape[1])
+        valide = finestre_valide[posizioni + inizio]
+        posizioni, colonne_hits = posizioni[valide], colonne_hits[valide]
+
+        score_esatti = esatte[colonne_hits[:, None], np.arange(lunghezza), finestre[posizioni]].sum(axis=1)
+        sopra_soglia = score_esatti >= soglie[colonne_hits]
+        hits_colonne.append(colonne_hits[sopra_soglia])
+        hits_inizi.append(posizioni[sopra_soglia] + inizio)
+        hits_score.append(score_esatti[sopra_soglia])
+
+    return np.concatenate(hits_colonne), np.concatenate(hits_inizi), np.concatenate(hits_score)
+
+
+# Function to get the thresholds of a scan: which matrices of the buckets are used ('log' for the probabilities,
+# 'pwm' for the log-odds scores) and the threshold of each bucket. With max_pvalue each motif has its own threshold
+# for each strand, otherwise all the motifs have the minimum score given
+def soglie_scan(versione, soglia_log, max_pvalue=None):
+    if max_pvalue is None:
+        return 'log', {lunghezza: soglia_log for lunghezza in versione.buckets}
+    return 'pwm', {lunghezza: np.concatenate([soglie_pvalore(bucket, max_pvalue),
+                                              soglie_pvalore(bucket, max_pvalue, inverso=True)])
+                   for lunghezza, bucket in versione.buckets.items()}
+
+
+# Function to convert the results of scansiona_bucket for all the buckets of a version of the database into the list
+# of the hits (motif ID, start, length, strand, score, p-value), ordered by start. With the probabilities the score
+# is the probability and there is no p-value (None), with the log-odds scores the score is in bits
+def hits_da_risultati(versione, risultati, campo='log'):
+    hits_motivi, hits_inizi, hits_lunghezze, hits_filamenti, hits_score, hits_pvalori = [], [], [], [], [], []
+    for lunghezza, (colonne_hits, inizi, score) in risultati.items():
+        bucket = versione.buckets[lunghezza]
+        numero_motivi = len(bucket['motif_ids'])
+        hits_motivi.extend(bucket['motif_ids'][c % numero_motivi] for c in colonne_hits)
+        hits_filamenti.extend('+' if c < numero_motivi else '-' for c in colonne_hits)
+        hits_lunghezze.extend([lunghezza] * len(colonne_hits))
+        hits_inizi.append(inizi)
+        hits_score.append(score)
+        if campo == 'pwm':
+            hits_pvalori.append(pvalori(bucket, colonne_hits % numero_motivi, score, colonne_hits >= numero_motivi))
+
+    if not hits_motivi:
+        return []
+
+    inizi = np.concatenate(hits_inizi)
+    if campo == 'pwm':
+        score = np.concatenate(hits_score)
+        pvalori_hits = np.concatenate(hits_pvalori).tolist()
+    else:
+        score = np.exp(np.concatenate(hits_score))
+        pvalori_hits = [None] * len(score)
+    ordine = np.lexsort((hits_motivi, inizi))
+    return [(hits_motivi[i], int(inizi[i]), hits_lunghezze[i], hits_filamenti[i], float(score[i]), pvalori_hits[i])
+            for i in ordine]
+
+
+# soglie is the result of soglie_scan for the same version of the database
+def scansiona_sequenza(indici, soglie, versione):
+    campo, soglie_buckets = soglie
+
+    # a long sequence is divided between the processes of the pool (if there is one)
+    if scoring_pool is not None and scoring_pool.conviene(len(indici) * len(versione)):
+        return hits_da_risultati(versione, scoring_pool.scansiona(versione, indici, campo, soglie_buckets), campo)
+
+    indici, non_nucleotidi = prepara_indici_scan(indici)
+    risultati = {}
+    for lunghezza, bucket in versione.buckets.items():
+        if lunghezza <= len(indici):
+            matrici, esatte = matrici_scan(bucket[campo])
+            risultati[lunghezza] = scansiona_bucket(indici, non_nucleotidi, lunghezza, matrici, esatte,
+                                                    soglie_buckets[lunghezza])
+    return hits_da_risultati(versione, risultati, campo)
+
+
+# Generator of the hits of a sequence, one list for each piece of the sequence (each piece has also the first bases
+# of the next one, to complete its last windows, and the hits that start in the next piece are left to it), so the
+# hits of a chromosome are sent while the next pieces are still being scanned and they are never all in memory.
+# The first piece is scanned by the slow jobs at once, so a busy service answers 503 before starting the response;
+# the next ones wait for their turn, because the response has already started
+def genera_hits(indici, soglie, versione):
+    passo = (finestre_per_pezzo_scan if scoring_pool is None
+             else max(finestre_per_pezzo_scan, finestre_per_lavoro * scoring_pool.numero_workers))
+    lunghezza_massima = versione.lunghezza_massima or 1
+    primo = True
+    for inizio in range(0, max(len(indici), 1), passo):
+        pezzo = indici[inizio:inizio + passo + lunghezza_massima - 1]
+        with metriche.fase('scan'):
+            hits = lavori_pesanti.esegui(scansiona_sequenza, pezzo, soglie, versione, attesa=not primo)
+        primo = False
+        yield [(motif_id, inizio_hit + inizio, lunghezza, filamento, score, pvalore)
+               for motif_id, inizio_hit, lunghezza, filamento, score, pvalore in hits if inizio_hit < passo]
+
+
+# The hits are displayed like the scores, one per line: motif ID, start and end (1-based, both included), strand and
+# score, and the p-value when the scores are log-odds
+def format_hits_output(hits):
+    return ''.join(f"{motif_id}\t{inizio + 1}\t{inizio + lunghezza}\t{filamento}\t{score}"
+                   + (f"\t{pvalore}\n" if pvalore is not None else "\n")
+                   for motif_id, inizio, lunghezza, filamento, score, pvalore in hits)
+
+
+# Function to check a sequence to scan and convert it in DNA (the proteins are not accepted here, because each of
+# them would be many DNA sequences)
+def prepara_sequenza_dna(sequenza):
+    if not sequenza:
+        raise ValueError('The sequence is empty')
+    if not sequenza.isalpha():
+        raise ValueError('The sequence must include only letters')
+    sequenza = sequenza.upper()
+    if 'T' in sequenza and 'U' in sequenza:
+        raise ValueError('The sequence contains both T and U. Please choose between DNA or RNA')
+    sequenza = sequenza.replace('U', 'T')
+    return sequenza
+
+
+# Function to read the threshold of a scan from the arguments of the request: the minimum score (a probability) or,
+# if it's given, the maximum p-value of the log-odds scores. Without both of them the maximum p-value is
+# pvalore_scan_predefinito
+def leggi_soglia_scan():
+    soglia = argomento_numerico('min_score', float)
+    if soglia is not None and soglia <= 0:
+        raise ValueError('The minimum score must be a positive number')
+    max_pvalue = argomento_numerico('max_pvalue', float)
+    if max_pvalue is not None and not 0 < max_pvalue <= 1:
+        raise ValueError('The maximum p-value must be a number between 0 and 1')
+    if soglia is None and max_pvalue is None:
+        max_pvalue = pvalore_scan_predefinito
+    return soglia, max_pvalue
+
+
+# The sequence can be long, so it has to be sent in the body of the request, as plain text (also a FASTA with a single
+# record) or as a json with the key "sequence"
+@app.route('/Motifs/scan', methods=['POST'])
+def scanSequence():
+    try:
+        if request.is_json:
+            sequenza = request.json.get('sequence')
+            if sequenza is None:
+                raise ValueError('Sequence is missing')
+        else:
+            sequenza = request.get_data(as_text=True)
+        righe = sequenza.splitlines()
+        # a FASTA file with many records is not one sequence: they are scanned one by one by /Motifs/fasta
+        if sum(line.startswith('>') for line in righe) > 1:
+            raise ValueError('The body has more than one FASTA record: to scan each of them use '
+                             'POST /Motifs/fasta?mode=scan')
+        sequenza = ''.join(line.strip() for line in righe if not line.startswith('>'))
+        sequenza = prepara_sequenza_dna(sequenza)
+        soglia, max_pvalue = leggi_soglia_scan()
+
+        versione = motif_store.snapshot()
+        soglie = soglie_scan(versione, None if max_pvalue is not None else np.log(soglia), max_pvalue)
+        # the first piece is scanned here, so the errors (and the 503 of a busy service) are sent before the response
+        pezzi = genera_hits(codifica_sequenza(sequenza), soglie, versione)
+        primi_hits = next(pezzi)
+
+    except ValueError as ve:
+        return jsonify_formatted({'ERROR:': str(ve)}), 400
+
+    # The hits are sent while the sequence is scanned, so their number is written at the end
+    def genera_risposta():
+        if max_pvalue is not None:
+            yield (f'Given sequence of length {len(sequenza)}. Hits with p-value below {max_pvalue}:\n'
+                   'Motif ID\tStart\tEnd\tStrand\tLog-odds score\tP-value\n')
+        else:
+            yield (f'Given sequence of length {len(sequenza)}. Hits with score above {soglia}:\n'
+                   'Motif ID\tStart\tEnd\tStrand\tScore\n')
+        numero_hits = 0
+        for hits in chain([primi_hits], pezzi):
+            numero_hits += len(hits)
+            yield format_hits_output(hits)
+        yield f'Number of hits: {numero_hits}\n'
+
+    return Response(stream_with_context(genera_risposta()), mimetype='text/plain')
+
+
+# The following functions are to score many sequences with a single request: the sequences are sent as a FASTA file
+# (also compressed with gzip) in the body of a POST request and the results are sent back one record at a time, while
+# the file is still being read. In this way the memory used is always the one of a single record, whatever the size
+# of the file, and there is no need to do a request for each sequence
+
+dimensione_blocco_lettura = 65536
+
+
+# Generator of the text of the body of the request, read a block at a time and decompressed if it's a gzip file
+# (I'm looking at the first two bytes, that in a gzip file are always 1f 8b)
+def leggi_testo_richiesta(stream):
+    blocco = stream.read(dimensione_blocco_lettura)
+    decompressore = zlib.decompressobj(16 + zlib.MAX_WBITS) if blocco[:2] == b'\x1f\x8b' else None
+    while blocco:
+        if decompressore is not None:
+            dati = decompressore.decompress(blocco)
+            # a gzip file can be made of many members one after the other (for example with cat)
+            while decompressore.eof and decompressore.unused_data:
+                resto = decompressore.unused_data
+                decompressore = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                dati += decompressore.decompress(resto)
+            blocco = dati
+        yield blocco.decode('ascii', errors='replace')
+        blocco = stream.read(dimensione_blocco_lettura)
+
+
+# Generator of the records of a FASTA file as couples (header, sequence), reading the lines of the blocks of text
+# (a line can be split between two blocks, so the last piece of each block is kept for the next one, and a final
+# new line is added to be sure to read also the last line of the file)
+def leggi_fasta(blocchi):
+    header, parti_sequenza, resto = None, [], ''
+    for blocco in chain(blocchi, ['\n']):
+        righe = (resto + blocco).split('\n')
+        resto = righe.pop()
+        for riga in righe:
+            riga = riga.strip()
+            if riga.startswith('>'):
+                if header is not None or parti_sequenza:
+                    yield header, ''.join(parti_sequenza)
+                header, parti_sequenza = riga[1:].strip(), []
+            elif riga:
+                parti_sequenza.append(riga)
+    if header is not None or parti_sequenza:
+        yield header, ''.join(parti_sequenza)
+
+
+# Function to check the sequence of a record, it returns the sequence converted in indices
+def prepara_record(sequenza, modalita):
+    sequenza = prepara_sequenza_dna(sequenza)
+    if modalita == 'score' and not set(sequenza) <= set('ACGT'):
+        raise ValueError('The sequence contains letters that are not nucleotides')
+    return codifica_sequenza(sequenza)
+
+
+def risultato_scan(header, lunghezza_sequenza, hits):
+    risultati_hits = []
+    for motif_id, inizio, lunghezza, filamento, score, pvalore in hits:
+        hit = {'motif_id': motif_id, 'start': inizio + 1, 'end': inizio + lunghezza, 'strand': filamento, 'score': score}
+        if pvalore is not None:
+            hit['p_value'] = pvalore
+        risultati_hits.append(hit)
+    return {'id': header, 'length': lunghezza_sequenza, 'hits': risultati_hits}
+
+
+# Function to get the results of a single record: with the mode "score" (the default) the scores of all the motifs
+# of the same length, like in getScore; with the mode "scan" the hits on both strands, like in scanSequence
+def risultati_record(header, sequenza, modalita, soglie, versione):
+    try:
+        indici = prepara_record(sequenza, modalita)
+    except ValueError as ve:
+        return {'id': header, 'error': str(ve)}
+    if modalita == 'scan':
+        return risultato_scan(header, len(indici), scansiona_sequenza(indici, soglie, versione))
+    bucket = versione.buckets.get(len(indici))
+    punteggi = punteggi_da_log(bucket['motif_ids'], calcola_score_bucket(bucket, indici)) if bucket is not None else {}
+    return {'id': header, 'length': len(indici), 'scores': punteggi}
+
+
+# The results are written as NDJSON (one json for each record) or as TSV (one line for each score or hit)
+def format_record_ndjson(risultato):
+    return json.dumps(risultato) + '\n'
+
+
+def format_record_tsv(risultato):
+    if 'error' in risultato:
+        return f"{risultato['id']}\tERROR\t{risultato['error']}\n"
+    if 'hits' in risultato:
+        return ''.join(f"{risultato['id']}\t{hit['motif_id']}\t{hit['start']}\t{hit['end']}\t{hit['strand']}\t{hit['score']}"
+                       + (f"\t{hit['p_value']}\n" if 'p_value' in hit else "\n")
+                       for hit in risultato['hits'])
+    return ''.join(f"{risultato['id']}\t{motif_id}\t{score}\n" for motif_id, score in risultato['scores'].items())
+
+
+# Like the scan, a FASTA file is sent to the processes of the pool only if it's big enough: the first records are read
+# until their work (positions x motifs) is enough for the pool, or until the end of a small file. It returns the
+# records (the ones already read and the others) and if the pool has to be used
+def conviene_pool_fasta(records, versione):
+    if scoring_pool is None:
+        return records, False
+    primi, lavoro = [], 0
+    for record in records:
+        primi.append(record)
+        lavoro += len(record[1]) * len(versione)
+        if scoring_pool.conviene(lavoro):
+            return chain(primi, records), True
+    return iter(primi), False
+
+
+@app.route('/Motifs/fasta', methods=['POST'])
+def scoreFasta():
+    try:
+        modalita = request.args.get('mode', 'score')
+        if modalita not in ('score', 'scan'):
+            raise ValueError('The mode must be score or scan')
+
+        formato = request.args.get('format')
+        if formato is None:
+            formato = 'tsv' if request.accept_mimetypes.best_match(
+                ['application/x-ndjson', 'text/tab-separated-values']) == 'text/tab-separated-values' else 'ndjson'
+        if formato not in ('ndjson', 'tsv'):
+            raise ValueError('The format must be ndjson or tsv')
+
+        soglia, max_pvalue = leggi_soglia_scan()
+
+    except ValueError as ve:
+        return jsonify_formatted({'ERROR:': str(ve)}), 400
+
+    formatta = format_record_tsv if formato == 'tsv' else format_record_ndjson
+    stream = request.stream
+
+    def genera_risultati():
+        # all the records are scored with the same version of the database
+        versione = motif_store.snapshot()
+        soglie = soglie_scan(versione, None if max_pvalue is not None else np.log(soglia), max_pvalue)
+        records, usa_pool = conviene_pool_fasta(leggi_fasta(leggi_testo_richiesta(stream)), versione)
+        if usa_pool:
+            risultati = scoring_pool.risultati_fasta(versione, records, modalita, soglie)
+        else:
+            risultati = (risultati_record(header, sequenza, modalita, soglie, versione)
+                         for header, sequenza in records)
+        for risultato in risultati:
+            yield formatta(risultato)
+
+    mimetype = 'text/tab-separated-values' if formato == 'tsv' else 'application/x-ndjson'
+    return Response(stream_with_context(genera_risultati()), mimetype=mimetype)
+
+
+# The following block of code is to use more processes (and so more cores) for the heavy scoring jobs: the scan of
+# long sequences, that is divided in pieces, and the FASTA files, that are divided in groups of records.
+# The matrices of the motifs are not sent to the processes with each job: for each version of the database they are
+# written once in a file in /dev/shm (so in memory), that the processes open with mmap, sharing the same memory.
+# The processes receive only the names of the files and the position of each bucket in them
+
+finestre_per_lavoro = 1000000
+finestre_minime_per_lavoro = 20000
+lavoro_minimo_pool = 20000000
+record_per_lavoro = 256
+
+
+# Function to write the matrices of a version of the database for the processes: all the matrices of the buckets are
+# one after the other in two files (the exact ones and the ones in single precision for the scan), both the ones of
+# the probabilities ('log') and the log-odds ones ('pwm')
+def scrivi_matrici_condivise(versione, cartella):
+    schema, esatte, matrici = [], [], []
+    posizione_esatte, posizione_matrici = 0, 0
+    for campo in ('log', 'pwm'):
+        for lunghezza, bucket in versione.buckets.items():
+            matrici_bucket, esatte_bucket = matrici_scan(bucket[campo])
+            schema.append((campo, lunghezza, len(bucket['motif_ids']), posizione_esatte, posizione_matrici))
+            esatte.append(esatte_bucket.ravel())
+            matrici.append(matrici_bucket.ravel())
+            posizione_esatte += esatte_bucket.size
+            posizione_matrici += matrici_bucket.size
+
+    percorsi = []
+    for nome, array, dtype in (('esatte', esatte, np.float64), ('matrici', matrici, np.float32)):
+        percorso = os.path.join(cartella, f'{nome}_{versione.numero}.npy')
+        np.save(percorso + '.tmp.npy', np.concatenate(array) if array else np.zeros(0, dtype=dtype))
+        os.replace(percorso + '.tmp.npy', percorso)
+        percorsi.append(percorso)
+    return tuple(percorsi), schema
+
+
+# In each process the files that are open are kept in memory (only the last ones, the older versions are closed)
+matrici_aperte = OrderedDict()
+
+
+def apri_matrici_condivise(percorsi, schema):
+    if percorsi not in matrici_aperte:
+        esatte, matrici = (np.load(percorso, mmap_mode='r') for percorso in percorsi)
+        buckets = {}
+        for campo, lunghezza, numero_motivi, posizione_esatte, posizione_matrici in schema:
+            dimensione = 2 * numero_motivi * lunghezza * 4
+            buckets[campo, lunghezza] = (
+                matrici[posizione_matrici:posizione_matrici + dimensione].reshape(lunghezza * 4, 2 * numero_motivi),
+                esatte[posizione_esatte:posizione_esatte + dimensione].reshape(2 * numero_motivi, lunghezza, 4))
+        matrici_aperte[percorsi] = buckets
+        while len(matrici_aperte) > 2:
+            matrici_aperte.popitem(last=False)
+    return matrici_aperte[percorsi]
+
+
+# The jobs done by the processes: they return only numbers (the results of scansiona_bucket and the logarithmic
+# scores), converted back to the IDs of the motifs by the main process
+def lavoro_scan(percorsi, schema, indici, campo, soglie_buckets, fine_finestre=None):
+    indici, non_nucleotidi = prepara_indici_scan(indici)
+    risultati = {}
+    for (campo_bucket, lunghezza), (matrici, esatte) in apri_matrici_condivise(percorsi, schema).items():
+        if campo_bucket == campo and lunghezza <= len(indici):
+            risultati[lunghezza] = scansiona_bucket(indici, non_nucleotidi, lunghezza, matrici, esatte,
+                                                    soglie_buckets[lunghezza], fine_finestre)
+    return risultati
+
+
+def lavoro_records(percorsi, schema, records, modalita, soglie):
+    if modalita == 'scan':
+        return [lavoro_scan(percorsi, schema, indici, *soglie) for indici in records]
+    buckets = apri_matrici_condivise(percorsi, schema)
+    risultati = []
+    for indici in records:
+        if ('log', len(indici)) not in buckets:
+            risultati.append(None)
+            continue
+        esatte = buckets['log', len(indici)][1]
+        # the first half of the exact matrices are the motifs on the forward strand, the ones of getScore
+        risultati.append(esatte[:len(esatte) // 2, np.arange(len(indici)), indici].sum(axis=1))
+    return risultati
+
+
+class ScoringPool:
+
+    def __init__(self, numero_workers):
+        self.numero_workers = numero_workers
+        # the processes are started from zero (spawn), because copying this process (fork) with its threads is not safe
+        self.executor = ProcessPoolExecutor(numero_workers, mp_context=multiprocessing.get_context('spawn'))
+        self.cartella = tempfile.mkdtemp(prefix='jaspar_matrici_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self.lock = threading.Lock()
+        # for each version written in the files: the files, the position of the buckets and how many jobs are using it
+        self.versioni = {}
+        atexit.register(self.chiudi)
+
+    # A job is sent to the processes only if it's big enough (number of positions x number of motifs), otherwise
+    # sending it would take longer than doing it
+    def conviene(self, lavoro):
+        return lavoro >= lavoro_minimo_pool
+
+    @contextmanager
+    def matrici_condivise(self, versione):
+        with self.lock:
+            if versione.numero not in self.versioni:
+                percorsi, schema = scrivi_matrici_condivise(versione, self.cartella)
+                self.versioni[versione.numero] = [percorsi, schema, 0]
+            self.versioni[versione.numero][2] += 1
+            percorsi, schema, _ = self.versioni[versione.numero]
+        try:
+            yield percorsi, schema
+        finally:
+            with self.lock:
+                self.versioni[versione.numero][2] -= 1
+                # the files of the old versions are deleted when nobody is using them anymore
+                ultima = max(self.versioni)
+                for numero in [numero for numero, (_, _, usi) in self.versioni.items() if numero < ultima and usi == 0]:
+                    for percorso in self.versioni.pop(numero)[0]:
+                        os.remove(percorso)
+
+    # The sequence is divided in pieces, one for each process (and not longer than finestre_per_lavoro windows):
+    # each piece has also the first bases of the next one, to complete its last windows
+    def scansiona(self, versione, indici, campo, soglie_buckets):
+        lunghezza_massima = versione.lunghezza_massima
+        passo = min(finestre_per_lavoro,
+                    max(finestre_minime_per_lavoro, -(-len(indici) // self.numero_workers)))
+        with self.matrici_condivise(versione) as (percorsi, schema):
+            lavori = [(inizio, self.executor.submit(lavoro_scan, percorsi, schema,
+                                                    indici[inizio:inizio + passo + lunghezza_massima - 1],
+                                                    campo, soglie_buckets, passo))
+                      for inizio in range(0, len(indici), passo)]
+            parti = [(inizio, lavoro.result()) for inizio, lavoro in lavori]
+
+        risultati = {}
+        for lunghezza in versione.buckets:
+            pezzi = [(colonne, inizi + inizio, score) for inizio, parte in parti if lunghezza in parte
+                     for colonne, inizi, score in [parte[lunghezza]]]
+            if pezzi:
+                risultati[lunghezza] = tuple(np.concatenate(valori) for valori in zip(*pezzi))
+        return risultati
+
+    # The records are sent to the processes in groups, keeping at most two groups for each process in progress
+    # (so the memory doesn't grow with the size of the file) and giving back the results in the same order
+    def risultati_fasta(self, versione, records, modalita, soglie):
+        with self.matrici_condivise(versione) as (percorsi, schema):
+            in_corso = deque()
+            for gruppo in iter(lambda: list(islice(records, record_per_lavoro)), []):
+                preparati = []
+                for header, sequenza in gruppo:
+                    try:
+                        preparati.append((header, prepara_record(sequenza, modalita)))
+                    except ValueError as ve:
+                        preparati.append((header, str(ve)))
+                validi = [indici for _, indici in preparati if not isinstance(indici, str)]
+                in_corso.append((preparati, self.executor.submit(lavoro_records, percorsi, schema, validi, modalita,
+                                                                 soglie)))
+                if len(in_corso) >= 2 * self.numero_workers:
+                    yield from self._risultati_gruppo(versione, modalita, soglie[0], *in_corso.popleft())
+            while in_corso:
+                yield from self._risultati_gruppo(versione, modalita, soglie[0], *in_corso.popleft())
+
+    def _risultati_gruppo(self, versione, modalita, campo, preparati, lavoro):
+        risultati = iter(lavoro.result())
+        for header, indici in preparati:
+            if isinstance(indici, str):
+                yield {'id': header, 'error': indici}
+            elif modalita == 'scan':
+                yield risultato_scan(header, len(indici), hits_da_risultati(versione, next(risultati), campo))
+            else:
+                log_score = next(risultati)
+                punteggi = {} if log_score is None else punteggi_da_log(
+                    versione.buckets[len(indici)]['motif_ids'], log_score)
+                yield {'id': header, 'length': len(indici), 'scores': punteggi}
+
+    def chiudi(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self.cartella, ignore_errors=True)
+
+
+# The pool is None when the option --workers is not used, and everything is done in this process
+scoring_pool = None
+
+
 # Finally in the following lasts lines I'm doing an extra function to get a nice graph of the motif
-# The graph will be save into an image in the same directory where the script is running
-# and also the link to display it will be available after the curl
+# The graph is returned directly as an image (PNG or SVG), and the images already done are kept in memory, because
+# creating them with matplotlib is slow
 
 
-# Function to create the graph
-def create_motif_graph(motif):
+# Function to create the graph, it returns the bytes of the image in the given format (png or svg).
+# It doesn't use pyplot, that has only one current figure for all the program, so more graphs can be created
+# at the same time by different requests
+def create_motif_graph(motif, formato='png'):
     pfm = motif['PFM']
     pfm_norm = normalizza_pfm(pfm)
-    positions = np.arange(len(pfm_norm['A']))  # Posizioni nel motivo
+    positions = np.arange(pfm_norm.shape[1])  # Posizioni nel motivo
 
-    fig, ax = plt.subplots()
+    fig = Figure()
+    ax = fig.subplots()
     width = 0.35
 
     # creation of a bar for each nucelotide
     bars = []
-    bottom = np.zeros(len(pfm_norm['A']))  # initial position of the bars
-    nucleotides = ['A', 'C', 'G', 'T']
-    for nucleotide in nucleotides:
-        bars.append(ax.bar(positions, pfm_norm[nucleotide], width, bottom=bottom, label=nucleotide))
-        bottom += np.array(pfm_norm[nucleotide])  # update the position for the next bar
+    bottom = np.zeros(pfm_norm.shape[1])  # initial position of the bars
+    for nucleotide, frequenze in zip(nucleotidi, pfm_norm):
+        bars.append(ax.bar(positions, frequenze, width, bottom=bottom, label=nucleotide))
+        bottom += frequenze  # update the position for the next bar
 
     # Add of labels and legend
     ax.set_ylabel('Frequency')
@@ -456,38 +3238,299 @@ def create_motif_graph(motif):
 
     ax.text(0.5, 1.08, f'Motif ID: {motif["motif_id"]}', horizontalalignment='center', transform=ax.transAxes)
 
-    # Save the graph as an image
-    filename = f'motif_graph_{motif["motif_id"]}.png'
-    plt.savefig(filename)
-    plt.close()
+    # Save the graph in memory
+    immagine = io.BytesIO()
+    fig.savefig(immagine, format=formato)
+    return immagine.getvalue()
+
+
+formati_grafici = {'png': 'image/png', 'svg': 'image/svg+xml'}
+byte_cache_grafici = 64 * 1024 * 1024
+
+
+# The cache of the images: the least recently used ones are deleted when the images take more than byte_massimi.
+# Each motif has a version, that changes when the motif is modified or deleted: the images are saved with the
+# version of the motif when they were created, so an image of the old motif created by a request that was already
+# running during the change can't be returned anymore
+class CacheGrafici:
+
+    def __init__(self, byte_massimi):
+        self.byte_massimi = byte_massimi
+        self.byte = 0
+        self.immagini = OrderedDict()  # (motif ID, version, format) -> bytes of the image
+        self.versioni = {}
+        self.lock = threading.Lock()
+
+    def versione(self, motif_id):
+        with self.lock:
+            return self.versioni.get(motif_id, 0)
+
+    def get(self, chiave):
+        with self.lock:
+            immagine = self.immagini.get(chiave)
+            if immagine is not None:
+                self.immagini.move_to_end(chiave)
+            return immagine
+
+    def put(self, chiave, immagine):
+        with self.lock:
+            # (an image bigger than the whole cache would only delete all the others)
+            if chiave[1] != self.versioni.get(chiave[0], 0) or chiave in self.immagini or \
+                    len(immagine) > self.byte_massimi:
+                return
+            self.immagini[chiave] = immagine
+            self.byte += len(immagine)
+            while self.byte > self.byte_massimi:
+                self.byte -= len(self.immagini.popitem(last=False)[1])
+
+    def invalida(self, motif_id):
+        with self.lock:
+            versione = self.versioni.get(motif_id, 0)
+            self.versioni[motif_id] = versione + 1
+            for formato in formati_grafici:
+                immagine = self.immagini.pop((motif_id, versione, formato), None)
+                if immagine is not None:
+                    self.byte -= len(immagine)
+
+
+grafici_cache = CacheGrafici(byte_cache_grafici)
+
+
+# The requests create the missing images with the threads of the slow jobs (esecutore), while the background thread
+# of --prerender-graphs creates them itself
+def grafico_motivo(motif_id, formato, esecutore=None):
+    versione = grafici_cache.versione(motif_id)
+    immagine = grafici_cache.get((motif_id, versione, formato))
+    if immagine is None:
+        motif = motif_store.get(motif_id)
+        if motif is None:
+            raise ValueError('Motif ID not found')
+        with metriche.fase(f'graph_render_{formato}'):
+            if esecutore is not None:
+                immagine = esecutore.esegui(create_motif_graph, motif, formato)
+            else:
+                immagine = create_motif_graph(motif, formato)
+        grafici_cache.put((motif_id, versione, formato), immagine)
+    return immagine
+
+
+# With the option --prerender-graphs the images (PNG) of all the motifs are created in background after the start,
+# so that also the first request of each graph is fast
+def prerender_grafici():
+    for motif in motif_store.snapshot():
+        motif_id = motif['motif_id']
+        try:
+            grafico_motivo(motif_id, 'png')
+        except ValueError:
+            pass  # deleted in the meantime
+
+
+# Function to obtain the graph of a single motif, the format is chosen with the argument format or with the
+# header Accept (PNG by default)
+@app.route('/Motifs/motif/graph/<motif_id>', methods=['GET'])
+def getMotifGraph(motif_id):
+    try:
+        formato = request.args.get('format')
+        if formato is None:
+            formato = 'svg' if request.accept_mimetypes.best_match(
+                ['image/png', 'image/svg+xml']) == 'image/svg+xml' else 'png'
+        if formato not in formati_grafici:
+            raise ValueError('The format must be png or svg')
+
+        # Create the graph for the given motif (or take it from the cache)
+        return Response(grafico_motivo(motif_id, formato, lavori_pesanti), mimetype=formati_grafici[formato])
 
-    return filename
+    except ValueError as ve:
+        return jsonify_formatted({'ERROR:': str(ve)}), 400
 
 
-def get_image_link(filename):
-    abs_path = os.path.abspath(filename)  # get the path of the image
-    return f'file://{abs_path}'
+# The following block of code is to run the service in production. The development server of Flask (the default)
+# is replaced with --server by waitress (more threads), gunicorn (more processes, each with its threads) or an ASGI
+# server (uvicorn): these packages are imported only when they are chosen, so they are not needed to use the service
+# as before.
+# The port is opened immediately and the database is loaded in background: until it's ready the requests get a
+# 503 with Retry-After, and /health/ready says "loading", so an orchestrator doesn't send traffic to the service
+# before it's ready and doesn't restart it while it's loading (/health/live answers as soon as the process is up).
+# The slow jobs (the graphs, the scans and the best DNA sequences of a protein) are done by a limited number of
+# threads: the others wait in a queue and, when also the queue is full, get a 503 at once. In this way the slow
+# requests can't take all the threads of the server, and there are always threads for the short requests and the
+# health checks
 
+server_disponibili = ('dev', 'waitress', 'gunicorn', 'asgi')
+threads_server = 8
+lavori_pesanti_massimi = os.cpu_count() or 2
+coda_lavori_pesanti = 32
 
-# Function to obtain the graph of a single motif
-@app.route('/Motifs/motif/graph/<motif_id>', methods=['GET'])
-def getMotifGraph(motif_id):
+# 'ready' when the database can be used, 'loading' while it's loaded in background and 'failed' if it's impossible
+# to load it (the service has to be restarted). Who imports this script and fills motif_store itself finds it ready
+stato_database = 'ready'
+errore_database = None
+
+
+class ServizioOccupato(Exception):
+    pass
+
+
+class LavoriPesanti:
+
+    def __init__(self, lavori, coda):
+        self.esecutore = ThreadPoolExecutor(max_workers=lavori, thread_name_prefix='lavori-pesanti')
+        self.posti = threading.BoundedSemaphore(lavori + coda)
+
+    # It runs the function in one of the threads and returns its result (or raises its exception). With attesa it
+    # waits for a free place instead of raising ServizioOccupato (for the jobs of a response already started)
+    def esegui(self, funzione, *argomenti, attesa=False):
+        if not self.posti.acquire(blocking=attesa):
+            raise ServizioOccupato('There are too many slow requests at the moment, try again in a few seconds')
+        # (the job of a profiled request is profiled in its thread)
+        profili = g.get('profili_lavori') if has_request_context() else None
+        if profili is not None:
+            funzione, argomenti = profila_lavoro, (profili, funzione, *argomenti)
+        try:
+            futuro = self.esecutore.submit(funzione, *argomenti)
+        except BaseException:
+            self.posti.release()
+            raise
+        futuro.add_done_callback(lambda _: self.posti.release())
+        return futuro.result()
+
+
+lavori_pesanti = LavoriPesanti(lavori_pesanti_massimi, coda_lavori_pesanti)
+
+
+@app.errorhandler(ServizioOccupato)
+def handle_busy(error):
+    return jsonify_formatted({'ERROR': str(error)}), 503, {'Retry-After': '1'}
+
+
+def stato_vita():
+    if stato_database == 'failed':
+        return 503, {'status': 'failed', 'error': errore_database}
+    return 200, {'status': 'alive'}
+
+
+def stato_prontezza():
+    if stato_database != 'ready':
+        return 503, {'status': stato_database, **({'error': errore_database} if errore_database else {})}
+    return 200, {'status': 'ready', 'motifs': len(motif_store)}
+
+
+@app.route('/health/live', methods=['GET'])
+def liveHealth():
+    stato, dati = stato_vita()
+    return jsonify_formatted(dati, stato)
+
+
+@app.route('/health/ready', methods=['GET'])
+def readyHealth():
+    stato, dati = stato_prontezza()
+    return jsonify_formatted(dati, stato)
+
+
+# the requests that are answered also while the database is loading
+sempre_disponibili = ('liveHealth', 'readyHealth', 'getMetrics')
+
+
+@app.before_request
+def controlla_database():
+    if stato_database != 'ready' and request.endpoint not in sempre_disponibili:
+        return (jsonify_formatted({'ERROR': 'The database is still loading, try again in a few seconds'
+                                   if stato_database == 'loading' else 'It was impossible to load the database'}),
+                503, {'Retry-After': '5'})
+
+
+# Function that loads the database (in background) and prepares what needs it: the processes of --workers and the
+# graphs of --prerender-graphs
+def carica_servizio(opzioni):
+    global motif_store, motif_log, scoring_pool, stato_database, errore_database
     try:
-        # First I control if the motif is really in the database
-        if not check_motif_id_exists(motif_id):
-            raise ValueError('Motif ID not found')
+        with metriche.fase('database_load'):
+            if '--data-dir' in opzioni:
+                motif_store, motif_log = apri_dati_persistenti(
+                    opzioni['--data-dir'], lambda: carica_database(opzioni),
+                    opzioni.get('--compact-every', modifiche_per_compattazione))
+            else:
+                motif_store = carica_database(opzioni)
+    except (ValueError, OSError) as e:
+        print(e)
+        errore_database = str(e)
+        stato_database = 'failed'
+        return
 
-        motif = [motif for motif in motifs_data if motif['motif_id'] == motif_id][0]
+    if opzioni.get('--workers'):
+        scoring_pool = ScoringPool(opzioni['--workers'])
+    stato_database = 'ready'
+    print(f'Database loaded: {len(motif_store)} motifs')
+    if '--prerender-graphs' in opzioni:
+        prerender_grafici()
 
-        # Create the graph for the given motif
-        motif_graph_filename = create_motif_graph(motif)
-        image_link = get_image_link(motif_graph_filename)
 
-        # return a message with the link of the image
-        return jsonify({'image_link': image_link}), 200
+def avvia_caricamento(opzioni):
+    global stato_database
+    stato_database = 'loading'
+    threading.Thread(target=carica_servizio, args=(opzioni,), daemon=True).start()
 
-    except ValueError as ve:
-        return jsonify_formatted({'ERROR:': str(ve)}), 400
+
+def avvia_waitress(host, port, opzioni):
+    from waitress import serve
+    avvia_caricamento(opzioni)
+    serve(app, host=host, port=port, threads=opzioni.get('--threads', threads_server))
+
+
+# With gunicorn each process (--processes) loads its own copy of the database, after it's started. The changes done
+# with POST, PUT and DELETE are done only in the process that receives them, so more processes are only for the
+# services that don't change the motifs (that's why they can't be used with --data-dir)
+def avvia_gunicorn(host, port, opzioni):
+    from gunicorn.app.base import BaseApplication
+
+    class ServizioGunicorn(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', opzioni.get('--processes', 1))
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', opzioni.get('--threads', threads_server))
+            # the loading of the database doesn't block the process, so the usual timeout is enough
+            self.cfg.set('post_worker_init', lambda worker: avvia_caricamento(opzioni))
+
+        def load(self):
+            return app
+
+    ServizioGunicorn().run()
+
+
+# With an ASGI server the requests of Flask are done by a pool of threads (--threads), while the event loop only
+# receives and sends them: the health checks are answered directly by the event loop, so they are fast also when all
+# the threads are busy
+def avvia_asgi(host, port, opzioni):
+    import uvicorn
+    from a2wsgi import WSGIMiddleware
+
+    app_wsgi = WSGIMiddleware(app, workers=opzioni.get('--threads', threads_server))
+    controlli = {'/health/live': stato_vita, '/health/ready': stato_prontezza}
+
+    async def app_asgi(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in controlli:
+            stato, dati = controlli[scope['path']]()
+            corpo = format_jsonify_output(dati).encode()
+            await send({'type': 'http.response.start', 'status': stato,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'content-length', str(len(corpo)).encode())]})
+            await send({'type': 'http.response.body', 'body': corpo})
+            return
+        await app_wsgi(scope, receive, send)
+
+    avvia_caricamento(opzioni)
+    uvicorn.run(app_asgi, host=host, port=port, lifespan='off')
+
+
+def avvia_dev(host, port, opzioni):
+    avvia_caricamento(opzioni)
+    app.run(host=host, port=port, threaded=True)
+
+
+avvio_server = {'dev': avvia_dev, 'waitress': avvia_waitress, 'gunicorn': avvia_gunicorn, 'asgi': avvia_asgi}
+pacchetti_server = {'waitress': ('waitress',), 'gunicorn': ('gunicorn',), 'asgi': ('uvicorn', 'a2wsgi')}
 
 
 # This is just to catch errors deriving from some typos in the request of the users like forgotting a curly
@@ -503,5 +3546,31 @@ def handle_not_found(error):
 
 
 if __name__ == '__main__':
-    app.run(port=port)
+    try:
+        port, opzioni = leggi_argomenti(sys.argv)
+    except ValueError as ve:
+        print(ve)
+        sys.exit(1)
+
+    print(welcome_msg)
+
+    # the options of the log-odds scores are needed before loading the motifs
+    pseudoconteggio = opzioni.get('--pseudocount', pseudoconteggio)
+    frequenze_fondo = opzioni.get('--background', frequenze_fondo)
+
+    if '--graph-cache-mb' in opzioni:
+        grafici_cache.byte_massimi = opzioni['--graph-cache-mb'] * 1024 * 1024
+    if '--result-cache-mb' in opzioni:
+        risultati_cache.byte_massimi = opzioni['--result-cache-mb'] * 1024 * 1024
+    if '--result-cache-ttl' in opzioni:
+        risultati_cache.durata = opzioni['--result-cache-ttl']
+    if '--profile-slow-ms' in opzioni:
+        soglia_profilo = opzioni['--profile-slow-ms']
+        cartella_profili = opzioni.get('--profile-dir', cartella_profili)
+    if '--heavy-jobs' in opzioni or '--heavy-queue' in opzioni:
+        lavori_pesanti = LavoriPesanti(opzioni.get('--heavy-jobs', lavori_pesanti_massimi),
+                                       opzioni.get('--heavy-queue', coda_lavori_pesanti))
+
+    # the database is loaded in background by the function of the server, after the port is open
+    avvio_server[opzioni.get('--server', 'dev')](opzioni.get('--host', '127.0.0.1'), port, opzioni)
 
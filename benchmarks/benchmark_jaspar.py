@@ -0,0 +1,359 @@
+
+# Benchmarks of the JASPAR web service: they don't need the internet connection, because the motifs are created
+# randomly (always the same ones) in a file in the Jaspar format.
+# There are two parts: the micro-benchmarks, that measure the single functions (reading the Jaspar file, building
+# the database, the scores, the scan, also of 1 Mb with the processes of --workers, the back-translation of the
+# proteins and the graphs), and the load test, where more clients do requests at the same time to the web service
+# (through the test client of Flask, or to a service already running with --url) and I measure how many requests per
+# second it answers and the latency (p50 and p99).
+# The load test is done --load-runs times and each result is the median of the runs, because a single run on a busy
+# machine can have a p99 far from the usual one. With --allow-writes the load test also adds, modifies and deletes
+# some motifs (with IDs from MA5000.1, that are deleted at the end of each cycle), so the reads are measured while
+# the database changes: they are not done by default, because with --url they change the database of the service.
+# With --url the memory of the service is read from its /metrics (the one of this process is the memory of the
+# micro-benchmarks).
+# At the end the results are compared with a baseline saved before (baseline.json), and the script exits with 1 if
+# something is slower than the baseline more than the tolerance, so it can be used to check every change (the p99
+# latencies have their own, wider, tolerance).
+#
+# Examples:
+#   python benchmarks/benchmark_jaspar.py                      (compare with benchmarks/baseline.json)
+#   python benchmarks/benchmark_jaspar.py --save-baseline      (save the results as the new baseline)
+#   python benchmarks/benchmark_jaspar.py --url http://localhost:5000 --clients 16 --duration 30
+#   python benchmarks/benchmark_jaspar.py --allow-writes         (the load test with the changes of the motifs)
+#
+# The baseline depends on the machine, so it has to be saved again on the machine where the benchmarks are used
+
+import sys
+import os
+import time
+import json
+import random
+import resource
+import tempfile
+import threading
+import argparse
+from itertools import count
+
+import numpy as np
+
+cartella_benchmark = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(cartella_benchmark))
+
+import JASPAR_WEB_SERVICE as servizio
+
+percorso_baseline = os.path.join(cartella_benchmark, 'baseline.json')
+
+
+# Function to write a random Jaspar file with numero_motivi motifs (with lengths like the real ones, from 6 to 21):
+# some counts are 0, like in the real motifs, so also the pseudocounts are used
+def crea_jaspar_sintetico(percorso, numero_motivi, seme=0):
+    generatore = np.random.default_rng(seme)
+    with open(percorso, 'w') as file:
+        for numero in range(numero_motivi):
+            lunghezza = int(generatore.integers(6, 22))
+            conteggi = generatore.integers(0, 1000, size=(4, lunghezza))
+            conteggi[generatore.random((4, lunghezza)) < 0.1] = 0
+            file.write(f'>MA{numero:04d}.1\tTF{numero}\n')
+            for nucleotide, riga in zip('ACGT', conteggi):
+                file.write(f'{nucleotide}  [ ' + ' '.join(f'{valore:5d}' for valore in riga) + ' ]\n')
+
+
+# Maximum memory used by this process until now (ru_maxrss is in kilobytes on Linux and in bytes on macOS)
+def memoria_massima_mb():
+    memoria = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return memoria / (1024 * 1024) if sys.platform == 'darwin' else memoria / 1024
+
+
+def percentile(valori, percentuale):
+    return float(np.percentile(valori, percentuale)) if len(valori) else 0.0
+
+
+# Function to measure a function: it's called ripetizioni times and it returns the median time in milliseconds
+def misura(funzione, ripetizioni):
+    tempi = []
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append((time.perf_counter() - inizio) * 1000)
+    return float(np.median(tempi))
+
+
+def sequenza_casuale(generatore, lunghezza):
+    return ''.join(generatore.choice('ACGT') for _ in range(lunghezza))
+
+
+# Function to read the motifs of a Jaspar file without building the database (carica_file_jaspar does both)
+def leggi_file_jaspar(percorso):
+    with open(percorso) as file:
+        return [{**motif, 'PFM': servizio.pfm_to_array(motif['PFM'])} for motif in servizio.leggi_jaspar(file)]
+
+
+# The micro-benchmarks: the results are in milliseconds (median of the repetitions)
+def micro_benchmark(percorso_jaspar, ripetizioni, numero_workers):
+    generatore = random.Random(1)
+    risultati = {}
+
+    risultati['parse_jaspar_ms'] = misura(lambda: leggi_file_jaspar(percorso_jaspar), max(1, ripetizioni // 5))
+    motifs = leggi_file_jaspar(percorso_jaspar)
+    risultati['build_store_ms'] = misura(lambda: servizio.MotifStore(motifs), max(1, ripetizioni // 5))
+    servizio.motif_store = servizio.MotifStore(motifs)
+
+    sequenze = [sequenza_casuale(generatore, generatore.randint(6, 21)) for _ in range(200)]
+    risultati['score_probability_200_ms'] = misura(
+        lambda: [servizio.seleziona_punteggi(sequenza, 'probability') for sequenza in sequenze], ripetizioni)
+    risultati['score_logodds_top5_200_ms'] = misura(
+        lambda: [servizio.seleziona_punteggi(sequenza, 'logodds', top_k=5) for sequenza in sequenze], ripetizioni)
+    risultati['score_both_strands_200_ms'] = misura(
+        lambda: [servizio.seleziona_punteggi(sequenza, 'probability', filamenti='both') for sequenza in sequenze],
+        ripetizioni)
+    # the best motifs of the sequences of 20-50 bp among all the motifs that fit in them (mode=fit)
+    sequenze_lunghe = [sequenza_casuale(generatore, generatore.randint(20, 50)) for _ in range(200)]
+    risultati['fit_probability_top10_200_ms'] = misura(
+        lambda: [servizio.cerca_motivi(sequenza, 'probability', 10) for sequenza in sequenze_lunghe], ripetizioni)
+    risultati['fit_logodds_top10_200_ms'] = misura(
+        lambda: [servizio.cerca_motivi(sequenza, 'logodds', 10) for sequenza in sequenze_lunghe], ripetizioni)
+
+    versione = servizio.motif_store.snapshot()
+    # with a minimum probability of 1e-4 the short motifs have a hit almost everywhere, so that scan is done
+    # on a shorter sequence
+    indici = servizio.codifica_sequenza(sequenza_casuale(generatore, 100000))
+    soglie_probabilita = servizio.soglie_scan(versione, np.log(1e-4))
+    soglie_pvalore = servizio.soglie_scan(versione, None, 1e-4)
+    risultati['scan_10kb_probability_ms'] = misura(
+        lambda: servizio.scansiona_sequenza(indici[:10000], soglie_probabilita, versione), max(1, ripetizioni // 5))
+    risultati['scan_100kb_pvalue_ms'] = misura(
+        lambda: servizio.scansiona_sequenza(indici, soglie_pvalore, versione), max(1, ripetizioni // 5))
+    # a genome-scale scan (1 Mb) in this process and divided between numero_workers processes, as with --workers.
+    # The processes are started and get the matrices before the measure, with a first scan
+    indici_lunghi = np.tile(indici, 10)
+    risultati['scan_1mb_pvalue_ms'] = misura(
+        lambda: servizio.scansiona_sequenza(indici_lunghi, soglie_pvalore, versione), max(1, ripetizioni // 10))
+    servizio.scoring_pool = servizio.ScoringPool(numero_workers)
+    try:
+        servizio.scansiona_sequenza(indici_lunghi, soglie_pvalore, versione)
+        risultati['scan_1mb_pvalue_workers_ms'] = misura(
+            lambda: servizio.scansiona_sequenza(indici_lunghi, soglie_pvalore, versione), max(1, ripetizioni // 10))
+    finally:
+        servizio.scoring_pool.chiudi()
+        servizio.scoring_pool = None
+
+    risultati['backtranslate_page_1000_ms'] = misura(
+        lambda: list(zip(range(1000), servizio.dna_sequences_from_protein('MLSRLLSA', servizio.gencode, 5000))),
+        ripetizioni)
+    risultati['backtranslate_best_10_ms'] = misura(
+        lambda: servizio.migliori_sequenze_dna('MLSRW', servizio.gencode, 10), ripetizioni)
+
+    motif = motifs[0]
+    risultati['render_graph_png_ms'] = misura(lambda: servizio.create_motif_graph(motif, 'png'),
+                                              max(1, ripetizioni // 5))
+    return risultati
+
+
+# The requests of the load test: mostly scores (also the same sequences many times, like in the real traffic, so
+# the cache of the results is used), some lists of motifs, single motifs and graphs, and with scritture some changes
+# of the database ('write': each client does the next one of its own, see scritture_client)
+def crea_richieste(numero, scritture=False, seme=2):
+    generatore = random.Random(seme)
+    sequenze_comuni = [sequenza_casuale(generatore, generatore.randint(6, 21)) for _ in range(50)]
+    richieste = []
+    for _ in range(numero):
+        tipo = generatore.random()
+        if tipo < 0.5:
+            richieste.append(f'/Motifs/{generatore.choice(sequenze_comuni)}?top_k=5')
+        elif tipo < 0.8:
+            richieste.append(f'/Motifs/{sequenza_casuale(generatore, generatore.randint(6, 21))}')
+        elif tipo < 0.9:
+            richieste.append(f'/Motifs/motif/MA{generatore.randrange(100):04d}.1')
+        elif tipo < 0.95:
+            richieste.append('/Motifs/motif?fields=motif_id,TF_name&limit=100')
+        elif tipo < 0.97:
+            richieste.append(f'/Motifs/motif/graph/MA{generatore.randrange(100):04d}.1')
+        elif scritture:
+            richieste.append('write')
+        else:
+            richieste.append(f'/Motifs/{generatore.choice(sequenze_comuni)}?top_k=5')
+    return richieste
+
+
+# The changes of the database done by a client of the load test: a new motif is added (POST), modified (PUT) and
+# deleted (DELETE), and so on with the next one. Each client has its own IDs, so the changes never conflict
+def scritture_client(numero_client, seme=3):
+    generatore = np.random.default_rng(seme + numero_client)
+
+    def pfm(lunghezza):
+        return {nucleotide: generatore.integers(1, 100, size=lunghezza).tolist() for nucleotide in 'ACGT'}
+
+    for contatore in count():
+        motif_id = f'MA{5000 + (100 * numero_client + contatore % 100) % 5000:04d}.1'
+        lunghezza = int(generatore.integers(6, 22))
+        yield 'post', '/Motifs/motif', {'motif_id': motif_id, 'TF_name': 'benchmark', 'PFM': pfm(lunghezza)}
+        yield 'put', f'/Motifs/motif/{motif_id}', {'PFM': pfm(lunghezza)}
+        yield 'delete', f'/Motifs/motif/{motif_id}', None
+
+
+# The load test: numero_client threads do the requests one after the other for durata seconds, through the test
+# client of Flask (the service in this process) or with requests to the url of a service already running
+def test_carico(numero_client, durata, url=None, con_scritture=False):
+    richieste = crea_richieste(10000, con_scritture)
+    latenze = [[] for _ in range(numero_client)]
+    latenze_scritture = [[] for _ in range(numero_client)]
+    errori = [0] * numero_client
+    fine = time.perf_counter() + durata
+
+    # the responses are closed like a real server does, otherwise the service doesn't know that they are finished
+    def client(numero):
+        if url is None:
+            sessione = servizio.app.test_client()
+            indirizzo = ''
+        else:
+            import requests
+            sessione = requests.Session()
+            indirizzo = url
+
+        def esegui(metodo, percorso, dati=None):
+            with getattr(sessione, metodo)(indirizzo + percorso, **({'json': dati} if dati is not None else {})) \
+                    as risposta:
+                return risposta.status_code
+        scritture = scritture_client(numero)
+        posizione = numero
+        while time.perf_counter() < fine:
+            richiesta = richieste[posizione % len(richieste)]
+            inizio = time.perf_counter()
+            stato = esegui(*next(scritture)) if richiesta == 'write' else esegui('get', richiesta)
+            latenze[numero].append((time.perf_counter() - inizio) * 1000)
+            if richiesta == 'write':
+                latenze_scritture[numero].append(latenze[numero][-1])
+            if stato >= 500:
+                errori[numero] += 1
+            posizione += numero_client
+
+    inizio = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(numero,)) for numero in range(numero_client)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    durata_reale = time.perf_counter() - inizio
+
+    tutte = [latenza for latenze_client in latenze for latenza in latenze_client]
+    scritture = [latenza for latenze_client in latenze_scritture for latenza in latenze_client]
+    risultati = {
+        'load_throughput_rps': len(tutte) / durata_reale,
+        'load_p50_ms': percentile(tutte, 50),
+        'load_p99_ms': percentile(tutte, 99),
+        'load_errors': sum(errori),
+    }
+    if con_scritture:
+        risultati['load_write_p99_ms'] = percentile(scritture, 99)
+    return risultati
+
+
+# The load test done numero_prove times: each result is the median of the runs (the errors are summed)
+def prove_carico(numero_prove, *argomenti):
+    prove = [test_carico(*argomenti) for _ in range(numero_prove)]
+    return {nome: sum(prova[nome] for prova in prove) if nome == 'load_errors'
+            else float(np.median([prova[nome] for prova in prove])) for nome in prove[0]}
+
+
+# The memory of a service already running, from its metrics (in megabytes)
+def memoria_servizio_mb(url):
+    import requests
+    valori = {}
+    for riga in requests.get(url + '/metrics', timeout=10).text.splitlines():
+        if riga.startswith('process_') and ' ' in riga:
+            nome, valore = riga.rsplit(' ', 1)
+            valori[nome] = float(valore) / (1024 * 1024)
+    return {'server_rss_mb': valori['process_resident_memory_bytes'],
+            'server_peak_rss_mb': valori['process_max_resident_memory_bytes']}
+
+
+# The comparison with the baseline: the times (_ms) and the memory (_mb) can't grow more than the tolerance, the
+# requests per second (_rps) can't decrease more than it, and there can't be errors. The times of less than a
+# millisecond change a lot from a run to the other, so a time is a regression only if it's also at least
+# differenza_minima milliseconds more than the baseline, and the p99 latencies (_p99_ms), that depend on the few
+# slowest requests, can grow up to tolleranza_code. It returns the list of the regressions
+def confronta(risultati, baseline, tolleranza, differenza_minima, tolleranza_code):
+    regressioni = []
+    for nome, valore in risultati.items():
+        if nome == 'load_errors':
+            if valore > 0:
+                regressioni.append(f'{nome}: {valore} requests failed')
+            continue
+        if nome not in baseline:
+            continue
+        riferimento = baseline[nome]
+        limite = tolleranza_code if nome.endswith('_p99_ms') else tolleranza
+        if nome.endswith('_rps'):
+            if valore < riferimento / (1 + tolleranza):
+                regressioni.append(f'{nome}: {valore:.1f} (baseline {riferimento:.1f})')
+        elif valore > riferimento * (1 + limite) and (not nome.endswith('_ms')
+                                                          or valore - riferimento >= differenza_minima):
+            regressioni.append(f'{nome}: {valore:.2f} (baseline {riferimento:.2f})')
+    return regressioni
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks of the JASPAR web service')
+    parser.add_argument('--motifs', type=int, default=900, help='number of random motifs (default: 900)')
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions of the micro-benchmarks (default: 20)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                        help='processes of the scan of 1 Mb with --workers (default: the number of cores)')
+    parser.add_argument('--clients', type=int, default=8, help='clients of the load test (default: 8)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of the load test (default: 10)')
+    parser.add_argument('--url', help='url of a service already running, instead of the test client')
+    parser.add_argument('--baseline', default=percorso_baseline, help='file of the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown allowed compared to the baseline (default: 0.25, that is 25%%)')
+    parser.add_argument('--tail-tolerance', type=float, default=1.0,
+                        help='growth allowed of the p99 latencies of the load test (default: 1, that is 100%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='minimum slowdown in milliseconds of a time to be a regression (default: 1)')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--skip-load', action='store_true', help='only the micro-benchmarks')
+    parser.add_argument('--load-runs', type=int, default=3,
+                        help='runs of the load test, the results are their median (default: 3)')
+    parser.add_argument('--allow-writes', action='store_true',
+                        help='the load test also adds, modifies and deletes motifs (from MA5000.1)')
+    argomenti = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as cartella:
+        percorso_jaspar = os.path.join(cartella, 'jaspar_sintetico.txt')
+        crea_jaspar_sintetico(percorso_jaspar, argomenti.motifs)
+        risultati = micro_benchmark(percorso_jaspar, argomenti.repeat, argomenti.workers)
+
+    if not argomenti.skip_load:
+        risultati.update(prove_carico(argomenti.load_runs, argomenti.clients, argomenti.duration, argomenti.url,
+                                      argomenti.allow_writes))
+    risultati['peak_rss_mb'] = memoria_massima_mb()
+    if argomenti.url is not None:
+        risultati.update(memoria_servizio_mb(argomenti.url))
+
+    for nome, valore in risultati.items():
+        print(f'{nome:32s}{valore:12.2f}')
+
+    if argomenti.save_baseline:
+        with open(argomenti.baseline, 'w') as file:
+            json.dump(risultati, file, indent=2)
+        print(f'\nBaseline saved in {argomenti.baseline}')
+        return 0
+
+    if not os.path.exists(argomenti.baseline):
+        print(f'\nThere is no baseline in {argomenti.baseline}, save it with --save-baseline')
+        return 0
+
+    with open(argomenti.baseline) as file:
+        baseline = json.load(file)
+    regressioni = confronta(risultati, baseline, argomenti.tolerance, argomenti.min_delta_ms,
+                            argomenti.tail_tolerance)
+    if regressioni:
+        print('\nREGRESSIONS compared to the baseline:')
+        for regressione in regressioni:
+            print(f'\t{regressione}')
+        return 1
+    print('\nNo regressions compared to the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import JASPAR_WEB_SERVICE as servizio
+
+
+# Random motifs of some lengths (always the same ones), with the counts of a Jaspar file
+def motivi_casuali(numero=60, lunghezze=(5, 6, 8, 11, 15), seme=0):
+    generatore = np.random.default_rng(seme)
+    motifs = []
+    for i in range(numero):
+        lunghezza = lunghezze[i % len(lunghezze)]
+        pfm = generatore.integers(0, 100, size=(4, lunghezza))
+        pfm[generatore.integers(0, 4, size=lunghezza), np.arange(lunghezza)] += 200
+        motifs.append({'motif_id': f'MA{i + 1:04d}.1', 'TF_name': f'TF{i + 1}', 'PFM': pfm})
+    return motifs
+
+
+def sequenza_casuale(lunghezza, seme=0):
+    return ''.join(np.random.default_rng(seme).choice(list('ACGT'), size=lunghezza))
+
+
+# Every test starts from a new database of random motifs, without the log, the pool and the cached results and
+# graphs of the other tests
+@pytest.fixture
+def motif_store(monkeypatch):
+    store = servizio.MotifStore(motivi_casuali())
+    monkeypatch.setattr(servizio, 'motif_store', store)
+    monkeypatch.setattr(servizio, 'motif_log', None)
+    monkeypatch.setattr(servizio, 'scoring_pool', None)
+    monkeypatch.setattr(servizio, 'stato_database', 'ready')
+    monkeypatch.setattr(servizio, 'risultati_cache', servizio.CacheRisultati(servizio.byte_cache_risultati,
+                                                                             servizio.durata_cache_risultati))
+    monkeypatch.setattr(servizio, 'grafici_cache', servizio.CacheGrafici(servizio.byte_cache_grafici))
+    return store
+
+
+@pytest.fixture
+def client(motif_store):
+    return servizio.app.test_client()
@@ -0,0 +1,112 @@
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from test_motif_store import controlla_buckets
+
+
+def motivo(motif_id, conteggi=(10, 0, 5, 3, 7, 1)):
+    return {'motif_id': motif_id, 'TF_name': 'new',
+            'PFM': {'A': list(conteggi), 'C': [1] * len(conteggi), 'G': [2] * len(conteggi), 'T': [0] * len(conteggi)}}
+
+
+def test_bulk_is_a_single_version(client, motif_store):
+    vecchia = motif_store.snapshot()
+    risposta = client.post('/Motifs/bulk', json={'upsert': [motivo('MA9000.1'), motivo('MA0002.1', (1, 2, 3))],
+                                                 'delete': ['MA0003.1', 'MA0004.1']})
+    assert risposta.status_code == 200
+    assert '1 motifs added, 1 updated, 2 deleted' in risposta.get_data(as_text=True)
+
+    nuova = motif_store.snapshot()
+    assert nuova.numero == vecchia.numero + 1
+    assert 'MA9000.1' in nuova and 'MA0003.1' not in nuova and 'MA0004.1' not in nuova
+    assert nuova.get('MA0002.1')['PFM'].shape == (4, 3)
+    controlla_buckets(nuova)
+
+
+@pytest.mark.parametrize('richiesta', [
+    # a motif with a wrong count after valid ones
+    {'upsert': [motivo('MA9000.1'), motivo('MA9001.1', (1, -2, 3))]},
+    # true and false are not counts, also together with numbers
+    {'upsert': [motivo('MA9000.1'), motivo('MA9001.1', (1, True, 3))]},
+    {'upsert': [motivo('MA9000.1', (True, False))]},
+    # a motif to delete that doesn't exist
+    {'upsert': [motivo('MA9000.1')], 'delete': ['MA0003.1', 'MA9999.1']},
+    # the same motif to add and to delete
+    {'upsert': [motivo('MA9000.1')], 'delete': ['MA9000.1']},
+])
+def test_an_error_changes_nothing(client, motif_store, richiesta):
+    vecchia = motif_store.snapshot()
+    assert client.post('/Motifs/bulk', json=richiesta).status_code == 400
+    assert motif_store.snapshot() is vecchia
+
+
+def test_an_error_while_writing_changes_nothing(motif_store, monkeypatch):
+    def registra_modifica(modifica):
+        raise OSError('No space left on device')
+
+    vecchia = motif_store.snapshot()
+    monkeypatch.setattr(servizio, 'registra_modifica', registra_modifica)
+    with pytest.raises(OSError):
+        servizio.applica_lotto(servizio.valida_motivi([motivo('MA9000.1')]), ['MA0003.1'])
+    assert motif_store.snapshot() is vecchia
+
+
+def test_import_with_a_wrong_motif_changes_nothing(client, motif_store):
+    testo = ('>MA9000.1 new\nA [ 1 2 3 ]\nC [ 1 2 3 ]\nG [ 1 2 3 ]\nT [ 1 2 3 ]\n'
+             '>MA9001.1 new\nA [ 1 2 3 ]\nC [ 1 2 3 ]\nG [ 1 -2 3 ]\nT [ 1 2 3 ]\n')
+    vecchia = motif_store.snapshot()
+    risposta = client.post('/Motifs/import?format=jaspar', data=testo)
+    assert risposta.status_code == 400
+    assert 'MA9001.1' in risposta.get_data(as_text=True)
+    assert motif_store.snapshot() is vecchia
+
+
+@pytest.mark.parametrize('conteggi', [[1, True, 3], [False, 0, 1]])
+def test_single_motif_with_booleans(client, motif_store, conteggi):
+    dati = motivo('MA9000.1')
+    dati['PFM']['A'] = conteggi
+    dati['PFM'] = {nucleotide: valori[:3] for nucleotide, valori in dati['PFM'].items()}
+    assert client.post('/Motifs/motif', json=dati).status_code == 400
+    assert client.put('/Motifs/motif/MA0001.1', json={'PFM': dati['PFM']}).status_code == 400
+    assert 'MA9000.1' not in motif_store.snapshot()
+
+
+# The counts of the single motifs and of the bulk requests are checked in the same way (the json of Python reads
+# also NaN and Infinity)
+@pytest.mark.parametrize('conteggi', ['[]', '[1, -2, 3]', '[1, NaN, 3]', '[1, Infinity, 3]', '[1, 1e999, 3]',
+                                      '[1, 100000000000000000000000, 3]'])
+def test_wrong_counts_are_rejected_everywhere(client, motif_store, conteggi):
+    altre = '[]' if conteggi == '[]' else '[1, 2, 3]'
+    pfm = f'{{"A": {conteggi}, "C": {altre}, "G": {altre}, "T": {altre}}}'
+    vecchia = motif_store.snapshot()
+    intestazione = {'Content-Type': 'application/json'}
+    risposte = [client.post('/Motifs/motif', data=f'{{"motif_id": "MA9000.1", "TF_name": "new", "PFM": {pfm}}}',
+                            headers=intestazione),
+                client.put('/Motifs/motif/MA0001.1', data=f'{{"PFM": {pfm}}}', headers=intestazione),
+                client.post('/Motifs/bulk', data=f'{{"upsert": [{{"motif_id": "MA9000.1", "TF_name": "new", '
+                                                 f'"PFM": {pfm}}}]}}', headers=intestazione)]
+    assert [risposta.status_code for risposta in risposte] == [400, 400, 400]
+    assert all('Invalid PFM format' in risposta.get_data(as_text=True) for risposta in risposte)
+    assert motif_store.snapshot() is vecchia
+
+
+@pytest.mark.parametrize('tf_name', [['a', 'b'], {'a': 1}, 3, ''])
+def test_single_motif_with_a_wrong_tf_name(client, motif_store, tf_name):
+    dati = motivo('MA9000.1')
+    dati['TF_name'] = tf_name
+    vecchia = motif_store.snapshot()
+    assert client.post('/Motifs/motif', json=dati).status_code == 400
+    assert client.put('/Motifs/motif/MA0001.1', json={'TF_name': tf_name}).status_code == 400
+    assert motif_store.snapshot() is vecchia
+
+
+@pytest.mark.parametrize('dati', [[1, 2], 'MA9000.1'])
+def test_single_motif_with_a_body_that_is_not_a_dictionary(client, motif_store, dati):
+    assert client.post('/Motifs/motif', json=dati).status_code == 400
+    assert client.put('/Motifs/motif/MA0001.1', json=dati).status_code == 400
+
+
+def test_single_motif_with_a_wrong_motif_id(client, motif_store):
+    dati = motivo('MA9000.1')
+    dati['motif_id'] = ['MA9000.1']
+    assert client.post('/Motifs/motif', json=dati).status_code == 400
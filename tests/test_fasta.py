@@ -0,0 +1,53 @@
+import json
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import sequenza_casuale
+
+
+# A pool that only records the records that it receives, scoring them in this process
+class PoolFinto:
+
+    def __init__(self):
+        self.records = []
+
+    def conviene(self, lavoro):
+        return lavoro >= servizio.lavoro_minimo_pool
+
+    def risultati_fasta(self, versione, records, modalita, soglie):
+        for header, sequenza in records:
+            self.records.append(header)
+            yield servizio.risultati_record(header, sequenza, modalita, soglie, versione)
+
+
+def fasta(sequenze):
+    return ''.join(f'>r{i}\n{sequenza}\n' for i, sequenza in enumerate(sequenze))
+
+
+def test_small_files_are_not_sent_to_the_pool(client, monkeypatch):
+    pool = PoolFinto()
+    monkeypatch.setattr(servizio, 'scoring_pool', pool)
+    risposta = client.post('/Motifs/fasta', data=fasta(['ACGTAC', 'ACGTACGT']))
+    righe = [json.loads(riga) for riga in risposta.get_data(as_text=True).splitlines()]
+    assert [riga['id'] for riga in righe] == ['r0', 'r1']
+    assert pool.records == []
+
+
+def test_big_files_are_sent_to_the_pool_in_order(client, monkeypatch):
+    pool = PoolFinto()
+    monkeypatch.setattr(servizio, 'scoring_pool', pool)
+    # 60 motifs: a record of 2000 positions is 120000 of work
+    monkeypatch.setattr(servizio, 'lavoro_minimo_pool', 500000)
+    sequenze = [sequenza_casuale(2000, seme=i) for i in range(8)]
+    risposta = client.post('/Motifs/fasta?mode=scan', data=fasta(sequenze))
+    righe = [json.loads(riga) for riga in risposta.get_data(as_text=True).splitlines()]
+    assert [riga['id'] for riga in righe] == [f'r{i}' for i in range(8)]
+    assert pool.records == [f'r{i}' for i in range(8)]
+
+
+def test_scores_of_the_records(client):
+    sequenza = 'ACGTACGT'
+    risposta = client.post('/Motifs/fasta?format=tsv', data=fasta([sequenza, 'ACGNN']))
+    righe = risposta.get_data(as_text=True).splitlines()
+    attese = servizio.seleziona_punteggi(sequenza, 'probability')[1]
+    assert len([riga for riga in righe if riga.startswith('r0\t')]) == len(attese)
+    assert righe[-1].startswith('r1\tERROR')
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import motivi_casuali, sequenza_casuale
+
+
+# The best window of each motif that fits in the sequence, scoring the windows one by one on each strand: it returns
+# for each motif the key to sort it (the p-value or the opposite of the score) and its score
+def migliori_una_per_una(sequenza, punteggio, filamenti):
+    migliori = {}
+    lunghezze = [lunghezza for lunghezza in servizio.motif_store.buckets if lunghezza <= len(sequenza)]
+    for lunghezza in lunghezze:
+        for inizio in range(len(sequenza) - lunghezza + 1):
+            for filamento in {'forward': ['forward'], 'reverse': ['reverse'], 'both': ['forward', 'reverse']}[filamenti]:
+                _, punteggi = servizio.seleziona_punteggi(sequenza[inizio:inizio + lunghezza], punteggio,
+                                                          filamenti=filamento)
+                for motif_id, score, pvalore, _ in punteggi:
+                    chiave = (pvalore if punteggio == 'logodds' else -score, -score)
+                    if (punteggio == 'logodds' or score > 0) and \
+                            (motif_id not in migliori or chiave < migliori[motif_id]):
+                        migliori[motif_id] = chiave
+    return sum(len(servizio.motif_store.buckets[lunghezza]['motif_ids']) for lunghezza in lunghezze), migliori
+
+
+# Function to score again the window of a hit, on its strand
+def score_hit(sequenza, motif_id, inizio, lunghezza, filamento, punteggio):
+    _, punteggi = servizio.seleziona_punteggi(sequenza[inizio:inizio + lunghezza], punteggio,
+                                              filamenti='forward' if filamento == '+' else 'reverse')
+    return next(score for trovato, score, _, _ in punteggi if trovato == motif_id)
+
+
+@pytest.mark.parametrize('punteggio', ['probability', 'logodds'])
+@pytest.mark.parametrize('filamenti', ['forward', 'reverse', 'both'])
+def test_fit_is_the_best_of_all_the_windows(motif_store, punteggio, filamenti):
+    sequenza = sequenza_casuale(30, seme=3)
+    numero, attesi = migliori_una_per_una(sequenza, punteggio, filamenti)
+    numero_motivi, hits = servizio.cerca_motivi(sequenza, punteggio, 12, filamenti=filamenti)
+
+    assert numero_motivi == numero
+    ordinati = sorted(attesi.values())[:12]
+    assert len(hits) == 12
+    for (_, _, _, _, score, pvalore), (chiave, opposto) in zip(hits, ordinati):
+        assert (pvalore if punteggio == 'logodds' else -score, -score) == pytest.approx((chiave, opposto))
+    for motif_id, inizio, lunghezza, filamento, score, pvalore in hits:
+        assert attesi[motif_id] == pytest.approx((pvalore if punteggio == 'logodds' else -score, -score))
+        assert filamento == ('-' if filamenti == 'reverse' else '+') or filamenti == 'both'
+        assert score_hit(sequenza, motif_id, inizio, lunghezza, filamento, punteggio) == pytest.approx(score)
+
+
+def test_fit_thresholds_and_short_sequences(motif_store):
+    sequenza = sequenza_casuale(9, seme=4)
+    numero, attesi = migliori_una_per_una(sequenza, 'logodds', 'both')
+    numero_motivi, hits = servizio.cerca_motivi(sequenza, 'logodds', 100, min_score=2.0, max_pvalue=0.01,
+                                                filamenti='both')
+
+    # only the motifs of 5, 6 and 8 positions fit in 9 bases
+    assert numero_motivi == numero == 36
+    assert sorted(motif_id for motif_id, *_ in hits) == \
+        sorted(motif_id for motif_id, (pvalore, score) in attesi.items() if -score >= 2.0 and pvalore <= 0.01)
+
+
+# The brute force search: all the windows of each motif scored at once, on each strand (the reverse one with the
+# reverse complement of the matrices, so the starts are on the forward strand), keeping for each motif the best key
+# (the p-value or the opposite of the score) with the best score, and all the windows (strand and start) with that
+# score, apart from the rounding of the sums
+def migliori_finestre(sequenza, punteggio, filamenti):
+    versione = servizio.motif_store.snapshot()
+    campo = 'pwm' if punteggio == 'logodds' else 'log'
+    indici = servizio.codifica_sequenza(sequenza)
+    migliori = {}
+    for lunghezza, bucket in versione.buckets.items():
+        if not 0 < lunghezza <= len(indici):
+            continue
+        righe = np.arange(len(bucket['motif_ids']))
+        finestre = sliding_window_view(indici, lunghezza)
+        for inverso in {'forward': (False,), 'reverse': (True,), 'both': (False, True)}[filamenti]:
+            matrici = bucket[campo][:, ::-1, ::-1] if inverso else bucket[campo]
+            score = matrici[:, np.arange(lunghezza), finestre].sum(axis=2)
+            massimi = score.max(axis=1)
+            chiavi = servizio.pvalori(bucket, righe, massimi, inverso) if punteggio == 'logodds' else -massimi
+            for motif_id, chiave, massimo, riga in zip(bucket['motif_ids'], chiavi, massimi, score):
+                if massimo > -np.inf:
+                    finestre_migliori = {('+-'[inverso], int(colonna)) for colonna in np.flatnonzero(riga >= massimo - 1e-9)}
+                    migliori.setdefault(motif_id, []).append((chiave, -massimo, finestre_migliori))
+    # (the strands with the same key and score are the same one)
+    for motif_id, filamenti_motivo in migliori.items():
+        chiave, opposto, _ = min(filamenti_motivo, key=lambda valori: valori[:2])
+        uguali = [valori[2] for valori in filamenti_motivo if np.isclose(valori[0], chiave, rtol=1e-9, atol=0)
+                  and valori[1] <= opposto + 1e-9]
+        migliori[motif_id] = (chiave, opposto, set().union(*uguali))
+    return migliori
+
+
+@pytest.mark.parametrize('punteggio', ['probability', 'logodds'])
+@pytest.mark.parametrize('filamenti', ['forward', 'both'])
+@pytest.mark.parametrize('top_k', [1, 10, 1000])
+def test_fit_is_the_brute_force(motif_store, punteggio, filamenti, top_k):
+    for seme, lunghezza in enumerate((8, 20, 37, 50, 120)):
+        sequenza = sequenza_casuale(lunghezza, seme=seme + 10)
+        attesi = migliori_finestre(sequenza, punteggio, filamenti)
+        _, hits = servizio.cerca_motivi(sequenza, punteggio, top_k, filamenti=filamenti)
+        assert len(hits) == min(top_k, len(attesi))
+        ordinati = sorted(valori[:2] for valori in attesi.values())[:top_k]
+        for (_, _, _, _, score, pvalore), (chiave, _) in zip(hits, ordinati):
+            assert (pvalore if punteggio == 'logodds' else -np.log(score)) == pytest.approx(chiave)
+        for motif_id, inizio, _, filamento, score, pvalore in hits:
+            chiave, opposto, finestre_migliori = attesi[motif_id]
+            assert (score if punteggio == 'logodds' else np.log(score)) == pytest.approx(-opposto)
+            assert (filamento, inizio) in finestre_migliori
+
+
+def test_fit_with_an_asymmetric_background(motif_store, monkeypatch):
+    # the two strands have different tables of the p-values
+    monkeypatch.setattr(servizio, 'frequenze_fondo', np.array([0.4, 0.3, 0.2, 0.1]))
+    monkeypatch.setattr(servizio, 'motif_store', servizio.MotifStore(motivi_casuali()))
+    sequenza = sequenza_casuale(40, seme=9)
+    attesi = migliori_finestre(sequenza, 'logodds', 'both')
+    _, hits = servizio.cerca_motivi(sequenza, 'logodds', 15, filamenti='both')
+    assert [pvalore for *_, pvalore in hits] == pytest.approx(sorted(valori[0] for valori in attesi.values())[:15])
+    for motif_id, inizio, _, filamento, _, _ in hits:
+        assert (filamento, inizio) in attesi[motif_id][2]
+
+
+def test_fit_skips_the_empty_motifs(monkeypatch):
+    motivi = motivi_casuali(20) + [{'motif_id': 'MA0999.1', 'TF_name': 'empty', 'PFM': np.zeros((4, 0), dtype=np.int64)}]
+    monkeypatch.setattr(servizio, 'motif_store', servizio.MotifStore(motivi))
+    numero_motivi, hits = servizio.cerca_motivi(sequenza_casuale(20, seme=1), 'logodds', 5, filamenti='both')
+    assert numero_motivi == 20
+    assert len(hits) == 5
+
+
+def test_fit_prunes_the_windows(motif_store, monkeypatch):
+    # with few hits asked most of the windows can't be among them, and are not scored to the end
+    monkeypatch.setattr(servizio, 'metriche', servizio.Metriche())
+    servizio.cerca_motivi(sequenza_casuale(50, seme=8), 'probability', 1, filamenti='both')
+    contatori = servizio.metriche.contatori
+    scored = contatori['jaspar_fit_windows_total', (('result', 'scored'),)]
+    pruned = contatori['jaspar_fit_windows_total', (('result', 'pruned'),)]
+    assert scored + pruned == 2 * sum(len(bucket['motif_ids']) * (50 - lunghezza + 1)
+                                      for lunghezza, bucket in servizio.motif_store.buckets.items())
+    assert pruned > 4 * scored
+
+
+def test_fit_route(client):
+    sequenza = sequenza_casuale(25, seme=6)
+    risposta = client.get(f'/Motifs/{sequenza}?mode=fit&top_k=5&scoring=logodds&strand=both&format=json')
+    assert risposta.status_code == 200
+    dati = risposta.get_json()
+    assert len(dati['results']) == 5
+    pvalori = [hit['p_value'] for hit in dati['results']]
+    assert pvalori == sorted(pvalori)
+    assert np.isfinite(pvalori).all()
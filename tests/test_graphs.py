@@ -0,0 +1,79 @@
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+
+
+@pytest.fixture
+def disegnati(monkeypatch):
+    # the images really created, as (motif ID, format)
+    creati = []
+    crea = servizio.create_motif_graph
+
+    def create_motif_graph(motif, formato):
+        creati.append((motif['motif_id'], formato))
+        return crea(motif, formato)
+
+    monkeypatch.setattr(servizio, 'create_motif_graph', create_motif_graph)
+    return creati
+
+
+@pytest.mark.parametrize('argomenti, intestazioni, formato', [
+    ('', {}, 'png'),
+    ('?format=svg', {}, 'svg'),
+    ('', {'Accept': 'image/svg+xml'}, 'svg'),
+    ('', {'Accept': 'image/svg+xml;q=0.5, image/png'}, 'png'),
+    ('?format=png', {'Accept': 'image/svg+xml'}, 'png'),
+])
+def test_png_or_svg(client, argomenti, intestazioni, formato):
+    risposta = client.get(f'/Motifs/motif/graph/MA0001.1{argomenti}', headers=intestazioni)
+    assert risposta.status_code == 200
+    assert risposta.mimetype == servizio.formati_grafici[formato]
+    assert risposta.data.startswith(b'\x89PNG') if formato == 'png' else b'<svg' in risposta.data
+
+
+def test_wrong_graphs(client):
+    assert client.get('/Motifs/motif/graph/MA0001.1?format=gif').status_code == 400
+    assert client.get('/Motifs/motif/graph/MA9999.1').status_code == 400
+
+
+def test_the_images_are_created_once(client, disegnati):
+    primo = client.get('/Motifs/motif/graph/MA0001.1').data
+    assert client.get('/Motifs/motif/graph/MA0001.1').data == primo
+    client.get('/Motifs/motif/graph/MA0001.1?format=svg')
+    assert disegnati == [('MA0001.1', 'png'), ('MA0001.1', 'svg')]
+
+
+def test_a_change_of_the_motif_creates_the_image_again(client, disegnati):
+    primo = client.get('/Motifs/motif/graph/MA0001.1').data
+    pfm = {'A': [90, 1, 1, 1, 1], 'C': [1, 90, 1, 1, 1], 'G': [1, 1, 90, 1, 1], 'T': [1, 1, 1, 90, 90]}
+    assert client.put('/Motifs/motif/MA0001.1', json={'PFM': pfm}).status_code == 200
+    assert client.get('/Motifs/motif/graph/MA0001.1').data != primo
+    assert len(disegnati) == 2
+    assert client.delete('/Motifs/motif/MA0001.1').status_code == 200
+    assert client.get('/Motifs/motif/graph/MA0001.1').status_code == 400
+    assert len(servizio.grafici_cache.immagini) == 0
+
+
+def test_the_least_recently_used_images_are_deleted():
+    cache = servizio.CacheGrafici(10)
+    cache.put(('MA0001.1', 0, 'png'), b'1111')
+    cache.put(('MA0002.1', 0, 'png'), b'2222')
+    assert cache.get(('MA0001.1', 0, 'png')) == b'1111'
+    # the third image doesn't fit: the one used less recently is deleted
+    cache.put(('MA0003.1', 0, 'png'), b'3333')
+    assert list(cache.immagini) == [('MA0001.1', 0, 'png'), ('MA0003.1', 0, 'png')]
+    assert cache.byte == 8
+    # an image bigger than the cache is not kept, and the others stay
+    cache.put(('MA0004.1', 0, 'png'), b'4' * 11)
+    assert cache.get(('MA0004.1', 0, 'png')) is None
+    assert len(cache.immagini) == 2 and cache.byte == 8
+
+
+def test_an_image_of_an_old_version_is_not_saved():
+    cache = servizio.CacheGrafici(100)
+    versione = cache.versione('MA0001.1')
+    # the motif changes while its image is created
+    cache.invalida('MA0001.1')
+    cache.put(('MA0001.1', versione, 'png'), b'old')
+    assert cache.get(('MA0001.1', versione, 'png')) is None
+    assert cache.get(('MA0001.1', cache.versione('MA0001.1'), 'png')) is None
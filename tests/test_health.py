@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import motivi_casuali
+
+
+# The database is loaded in background as at the start of the service, but it's ready only when pronto is set
+# (or it fails, with errore)
+@pytest.fixture
+def caricamento(motif_store, monkeypatch):
+    pronto = threading.Event()
+    errore = []
+
+    def carica_database(opzioni):
+        assert pronto.wait(10)
+        if errore:
+            raise OSError(errore[0])
+        return servizio.MotifStore(motivi_casuali(10))
+
+    monkeypatch.setattr(servizio, 'carica_database', carica_database)
+    monkeypatch.setattr(servizio, 'errore_database', None)
+    servizio.avvia_caricamento({})
+    return pronto, errore
+
+
+def aspetta_fine_caricamento():
+    for _ in range(500):
+        if servizio.stato_database != 'loading':
+            return
+        time.sleep(0.01)
+    raise AssertionError('the database is still loading')
+
+
+def test_while_loading_and_after(client, caricamento):
+    pronto, _ = caricamento
+    assert client.get('/health/live').status_code == 200
+    risposta = client.get('/health/ready')
+    assert risposta.status_code == 503
+    assert 'loading' in risposta.get_data(as_text=True)
+    risposta = client.get('/Motifs/ACGTAC')
+    assert risposta.status_code == 503
+    assert risposta.headers['Retry-After'] == '5'
+    assert 'still loading' in risposta.get_data(as_text=True)
+    assert client.get('/metrics').status_code == 200
+
+    pronto.set()
+    aspetta_fine_caricamento()
+    assert client.get('/health/live').status_code == 200
+    risposta = client.get('/health/ready')
+    assert risposta.status_code == 200
+    assert 'ready' in risposta.get_data(as_text=True)
+    assert client.get('/Motifs/ACGTAC').status_code == 200
+    assert len(servizio.motif_store) == 10
+
+
+def test_a_failed_loading(client, caricamento):
+    pronto, errore = caricamento
+    errore.append('No such file: motifs.txt')
+    pronto.set()
+    aspetta_fine_caricamento()
+    for percorso in ('/health/live', '/health/ready'):
+        risposta = client.get(percorso)
+        assert risposta.status_code == 503
+        assert 'No such file: motifs.txt' in risposta.get_data(as_text=True)
+    risposta = client.get('/Motifs/ACGTAC')
+    assert risposta.status_code == 503
+    assert 'impossible to load' in risposta.get_data(as_text=True)
+
+
+# A service with a single thread for the slow jobs and no queue, whose thread is taken by a job until libero is set
+@pytest.fixture
+def lavori_occupati(monkeypatch):
+    lavori = servizio.LavoriPesanti(1, 0)
+    monkeypatch.setattr(servizio, 'lavori_pesanti', lavori)
+    iniziato, libero = threading.Event(), threading.Event()
+
+    def lavoro_lungo():
+        iniziato.set()
+        assert libero.wait(10)
+
+    filo = threading.Thread(target=lavori.esegui, args=(lavoro_lungo,))
+    filo.start()
+    assert iniziato.wait(10)
+    yield lavori, libero
+    libero.set()
+    filo.join()
+
+
+def test_503_when_the_queue_is_full(client, lavori_occupati):
+    lavori, libero = lavori_occupati
+    with pytest.raises(servizio.ServizioOccupato):
+        lavori.esegui(sum, [1, 2])
+    risposta = client.get('/Motifs/motif/graph/MA0001.1')
+    assert risposta.status_code == 503
+    assert risposta.headers['Retry-After'] == '1'
+    # the short requests don't need the threads of the slow jobs
+    assert client.get('/Motifs/ACGTAC').status_code == 200
+
+    libero.set()
+    # (the place of the job is given back right after its end)
+    for _ in range(500):
+        if lavori.posti.acquire(blocking=False):
+            lavori.posti.release()
+            break
+        time.sleep(0.01)
+    assert client.get('/Motifs/motif/graph/MA0001.1').status_code == 200
+
+
+def test_a_job_can_wait_for_a_place(lavori_occupati):
+    lavori, libero = lavori_occupati
+    threading.Timer(0.1, libero.set).start()
+    assert lavori.esegui(sum, [1, 2], attesa=True) == 3
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+
+
+# The motif MA0004.1 (Arnt) as it's downloaded from the Jaspar website in the three formats
+arnt = np.array([[4, 19, 0, 0, 0, 0], [16, 0, 20, 0, 0, 0], [0, 1, 0, 20, 0, 20], [0, 0, 0, 0, 20, 0]])
+
+jaspar = """>MA0004.1\tArnt
+A  [     4     19      0      0      0      0 ]
+C  [    16      0     20      0      0      0 ]
+G  [     0      1      0     20      0     20 ]
+T  [     0      0      0      0     20      0 ]
+"""
+
+meme = """MEME version 4
+
+ALPHABET= ACGT
+
+strands: + -
+
+Background letter frequencies
+A 0.25 C 0.25 G 0.25 T 0.25
+
+MOTIF MA0004.1 Arnt
+letter-probability matrix: alength= 4 w= 6 nsites= 20 E= 0
+  0.200000  0.800000  0.000000  0.000000
+  0.950000  0.000000  0.050000  0.000000
+  0.000000  1.000000  0.000000  0.000000
+  0.000000  0.000000  1.000000  0.000000
+  0.000000  0.000000  0.000000  1.000000
+  0.000000  0.000000  1.000000  0.000000
+URL http://jaspar.genereg.net/matrix/MA0004.1
+"""
+
+transfac = """AC MA0004.1
+XX
+ID Arnt
+XX
+DE MA0004.1 Arnt ; From JASPAR
+PO      A      C      G      T
+01      4.0     16.0    0.0     0.0
+02      19.0    0.0     1.0     0.0
+03      0.0     20.0    0.0     0.0
+04      0.0     0.0     20.0    0.0
+05      0.0     0.0     0.0     20.0
+06      0.0     0.0     20.0    0.0
+XX
+CC tax_group:vertebrates
+XX
+//
+"""
+
+# files with the IDs of other databases: the first motif of TRANSFAC and a motif found by a run of MEME
+transfac_estraneo = """AC  M00001
+XX
+ID  V$MYOD_01
+XX
+NA  MyoD
+XX
+P0      A      C      G      T
+01      1      2      2      0      S
+02      2      1      2      0      R
+03      3      0      1      1      A
+04      0      5      0      0      C
+05      5      0      0      0      A
+06      0      0      4      1      G
+07      0      1      4      0      G
+08      0      0      0      5      T
+09      0      0      5      0      G
+10      0      1      2      2      K
+11      0      2      0      3      Y
+12      1      0      3      1      G
+XX
+BF  T00526; MyoD; Species: mouse, Mus musculus.
+XX
+//
+"""
+
+meme_estraneo = """MEME version 5.5.4
+
+ALPHABET= ACGT
+
+strands: + -
+
+Background letter frequencies
+A 0.29 C 0.21 G 0.21 T 0.29
+
+MOTIF CACGTGAC MEME-1
+letter-probability matrix: alength= 4 w= 4 nsites= 12 E= 3.1e-005
+ 0.000000  1.000000  0.000000  0.000000
+ 1.000000  0.000000  0.000000  0.000000
+ 0.000000  1.000000  0.000000  0.000000
+ 0.000000  0.000000  0.916667  0.083333
+"""
+
+
+@pytest.mark.parametrize('formato, testo', [('jaspar', jaspar), ('meme', meme), ('transfac', transfac)])
+def test_the_files_of_jaspar_are_read(formato, testo):
+    assert servizio.formato_file_motivi(testo) == formato
+    motifs = list(servizio.formati_import[formato](testo.splitlines()))
+    assert [(motif['motif_id'], motif['TF_name']) for motif in motifs] == [('MA0004.1', 'Arnt')]
+    assert servizio.validate_pfm(motifs[0]['PFM']) == pytest.approx(arnt)
+
+
+@pytest.mark.parametrize('testo', [jaspar, meme, transfac])
+def test_import_of_the_files_of_jaspar(client, motif_store, testo):
+    risposta = client.post('/Motifs/import', data=testo)
+    assert risposta.status_code == 200
+    assert motif_store.snapshot().get('MA0004.1')['PFM'] == pytest.approx(arnt)
+
+
+@pytest.mark.parametrize('formato, testo, motif_id', [('transfac', transfac_estraneo, 'M00001'),
+                                                      ('meme', meme_estraneo, 'CACGTGAC')])
+def test_the_ids_of_other_databases_are_refused(client, motif_store, formato, testo, motif_id):
+    # the file is read...
+    motifs = list(servizio.formati_import[formato](testo.splitlines()))
+    assert [motif['motif_id'] for motif in motifs] == [motif_id]
+    # ...but its IDs are not Jaspar IDs
+    vecchia = motif_store.snapshot()
+    risposta = client.post('/Motifs/import', data=testo)
+    assert risposta.status_code == 400
+    errore = risposta.get_data(as_text=True)
+    assert motif_id in errore and 'MA0004.1' in errore and formato in errore
+    assert motif_store.snapshot() is vecchia
@@ -0,0 +1,87 @@
+import re
+
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import sequenza_casuale
+
+
+@pytest.fixture
+def metriche(monkeypatch):
+    monkeypatch.setattr(servizio, 'metriche', servizio.Metriche())
+
+
+# A request measured as by a server, that closes the response when it's sent
+def chiedi(client, percorso):
+    risposta = client.get(percorso)
+    risposta.get_data()
+    risposta.close()
+    return risposta
+
+
+# The metrics in the text format of Prometheus, as a dictionary 'name{labels}' -> value, and the names with their type
+def leggi_metriche(client):
+    risposta = chiedi(client, '/metrics')
+    assert risposta.status_code == 200
+    assert risposta.mimetype == 'text/plain'
+    valori, tipi = {}, {}
+    for riga in risposta.get_data(as_text=True).splitlines():
+        if riga.startswith('# TYPE'):
+            _, _, nome, tipo = riga.split()
+            tipi[nome] = tipo
+        elif not riga.startswith('#'):
+            serie, valore = riga.rsplit(' ', 1)
+            valori[serie] = float(valore)
+    return valori, tipi
+
+
+def test_names_and_types(client, metriche):
+    chiedi(client, '/Motifs/ACGTAC')
+    valori, tipi = leggi_metriche(client)
+    assert tipi['jaspar_http_requests_total'] == 'counter'
+    assert tipi['jaspar_http_request_duration_seconds'] == 'histogram'
+    assert tipi['jaspar_stage_duration_seconds'] == 'histogram'
+    for nome in ('jaspar_motifs', 'jaspar_motif_lengths', 'jaspar_requests_in_progress',
+                 'process_resident_memory_bytes', 'jaspar_result_cache_entries', 'jaspar_graph_cache_bytes'):
+        assert tipi[nome] == 'gauge'
+    assert valori['jaspar_motifs'] == 60
+    assert valori['jaspar_motif_lengths'] == 5
+    # the request for the metrics is in progress while they are written
+    assert valori['jaspar_requests_in_progress'] == 1
+    assert all(re.fullmatch(r'[a-z_]+', nome) for nome in tipi)
+
+
+def test_the_counters_go_up(client, metriche):
+    serie = 'jaspar_http_requests_total{route="/Motifs/<sequenza>",method="GET",status="200"}'
+    durata = 'jaspar_http_request_duration_seconds_count{route="/Motifs/<sequenza>"}'
+    fasi = 'jaspar_stage_duration_seconds_count{stage="score_compute"}'
+    chiedi(client, '/Motifs/ACGTAC')
+    prima, _ = leggi_metriche(client)
+    # a different sequence is the same route, and the same sequence is taken from the cache of the results
+    chiedi(client, f'/Motifs/{sequenza_casuale(8)}')
+    chiedi(client, '/Motifs/ACGTAC')
+    chiedi(client, '/Motifs/ACGT1')
+    dopo, _ = leggi_metriche(client)
+    assert dopo[serie] == prima[serie] + 2
+    assert dopo['jaspar_http_requests_total{route="/Motifs/<sequenza>",method="GET",status="400"}'] == 1
+    assert dopo[durata] == prima[durata] + 3
+    assert dopo[fasi] == prima[fasi] + 2
+    assert dopo['jaspar_result_cache_hits_total'] == prima['jaspar_result_cache_hits_total'] + 1
+    assert dopo['jaspar_http_requests_total{route="/metrics",method="GET",status="200"}'] == 1
+
+
+def test_the_histograms_are_cumulative(client, metriche):
+    for _ in range(3):
+        chiedi(client, '/Motifs/ACGTAC')
+    valori, _ = leggi_metriche(client)
+    nome = 'jaspar_http_request_duration_seconds'
+    etichetta = 'route="/Motifs/<sequenza>"'
+    intervalli = [valori[f'{nome}_bucket{{{etichetta},le="{limite}"}}']
+                  for limite in servizio.limiti_istogrammi + ('+Inf',)]
+    assert intervalli == sorted(intervalli)
+    assert intervalli[-1] == valori[f'{nome}_count{{{etichetta}}}'] == 3
+    assert valori[f'{nome}_sum{{{etichetta}}}'] > 0
+
+
+def test_the_labels_are_escaped():
+    assert servizio.formato_etichette((('route', 'a"b\\c\nd'),)) == '{route="a\\"b\\\\c\\nd"}'
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+
+# (the motifs are streamed, so each response is read to the end to close it)
+def leggi(risposta):
+    risposta.get_data()
+    return risposta
+
+
+def test_etag_changes_with_every_version(client, motif_store):
+    risposta = leggi(client.get('/Motifs/motif?limit=5'))
+    etag = risposta.headers['ETag']
+    assert risposta.headers['Vary'] == 'Accept'
+    assert 'Last-Modified' not in risposta.headers
+    assert client.get('/Motifs/motif?limit=5', headers={'If-None-Match': etag}).status_code == 304
+
+    # two changes in the same second give two different answers
+    for numero in range(2):
+        with motif_store.scrittura() as modifica:
+            modifica.add(f'MA900{numero}.1', 'new', np.ones((4, 6), dtype=np.int64))
+        risposta = leggi(client.get('/Motifs/motif?limit=5', headers={'If-None-Match': etag}))
+        assert risposta.status_code == 200
+        assert risposta.headers['ETag'] != etag
+        etag = risposta.headers['ETag']
+
+
+def test_if_modified_since_is_not_used(client):
+    risposta = leggi(client.get('/Motifs/motif', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}))
+    assert risposta.status_code == 200
+
+
+def test_format_from_accept(client):
+    risposta = leggi(client.get('/Motifs/motif?limit=2', headers={'Accept': 'application/x-ndjson'}))
+    assert risposta.mimetype == 'application/x-ndjson'
+    assert risposta.headers['Vary'] == 'Accept'
+
+
+@pytest.mark.parametrize('argomenti', ['length=six', 'limit=abc', 'limit=0', 'length=6.5'])
+def test_wrong_numbers_of_the_list(client, argomenti):
+    assert client.get(f'/Motifs/motif?{argomenti}').status_code == 400
@@ -0,0 +1,88 @@
+import threading
+
+import numpy as np
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import motivi_casuali
+
+
+def pfm(lunghezza, seme):
+    return np.random.default_rng(seme).integers(1, 100, size=(4, lunghezza))
+
+
+def controlla_buckets(versione):
+    # every row of the buckets must be the one computed from zero for its motif
+    for lunghezza, bucket in versione.buckets.items():
+        righe = servizio.righe_bucket([versione.get(motif_id)['PFM'] for motif_id in bucket['motif_ids']])
+        for campo in servizio.campi_bucket:
+            np.testing.assert_array_equal(bucket[campo], righe[campo])
+        for posizione, motif_id in enumerate(bucket['motif_ids']):
+            assert versione.posizioni[motif_id] == posizione
+
+
+def test_old_version_is_not_changed(motif_store):
+    vecchia = motif_store.snapshot()
+    copie = {lunghezza: {campo: bucket[campo].copy() for campo in servizio.campi_bucket}
+             for lunghezza, bucket in vecchia.buckets.items()}
+    with motif_store.scrittura() as modifica:
+        modifica.add('MA9000.1', 'new', pfm(6, 1))
+        modifica.update('MA0002.1', pfm=pfm(6, 2))
+        modifica.update('MA0003.1', pfm=pfm(9, 3))
+        modifica.delete('MA0004.1')
+
+    nuova = motif_store.snapshot()
+    assert nuova.numero == vecchia.numero + 1
+    assert 'MA9000.1' not in vecchia and 'MA9000.1' in nuova
+    assert 'MA0004.1' in vecchia and 'MA0004.1' not in nuova
+    assert vecchia.get('MA0003.1')['PFM'].shape[1] == 8 and 9 in nuova.buckets and 9 not in vecchia.buckets
+    for lunghezza, bucket in vecchia.buckets.items():
+        for campo in servizio.campi_bucket:
+            np.testing.assert_array_equal(bucket[campo], copie[lunghezza][campo])
+    controlla_buckets(vecchia)
+    controlla_buckets(nuova)
+    # the buckets of the lengths not changed are shared between the versions
+    assert nuova.buckets[15] is vecchia.buckets[15]
+
+
+def test_failed_change_publishes_nothing(motif_store):
+    vecchia = motif_store.snapshot()
+    with pytest.raises(ValueError):
+        with motif_store.scrittura() as modifica:
+            modifica.add('MA9000.1', 'new', pfm(6, 1))
+            modifica.delete('MA9999.1')
+    assert motif_store.snapshot() is vecchia
+    assert 'MA9000.1' not in motif_store
+
+
+def test_published_arrays_are_read_only(motif_store):
+    with motif_store.scrittura() as modifica:
+        modifica.add('MA9000.1', 'new', pfm(5, 1))
+    for bucket in motif_store.snapshot().buckets.values():
+        for campo in servizio.campi_bucket:
+            assert not bucket[campo].flags.writeable
+
+
+def test_readers_always_see_a_complete_version(motif_store):
+    fine = threading.Event()
+    errori = []
+
+    def lettore():
+        while not fine.is_set():
+            versione = motif_store.snapshot()
+            for bucket in versione.buckets.values():
+                if not len(bucket['motif_ids']) == len(bucket['prob']) == len(bucket['pwm']):
+                    errori.append(versione.numero)
+
+    lettori = [threading.Thread(target=lettore) for _ in range(2)]
+    for thread in lettori:
+        thread.start()
+    for i, motif in enumerate(motivi_casuali(20, seme=5)):
+        with motif_store.scrittura() as modifica:
+            modifica.add(f'MA8{i:03d}.1', motif['TF_name'], motif['PFM'])
+            modifica.delete(f'MA{i + 1:04d}.1')
+    fine.set()
+    for thread in lettori:
+        thread.join()
+    assert not errori
+    controlla_buckets(motif_store.snapshot())
@@ -0,0 +1,78 @@
+import os
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import motivi_casuali
+
+
+def nuovo_motivo(motif_id):
+    return {'motif_id': motif_id, 'TF_name': 'new',
+            'PFM': {'A': [10, 0, 5], 'C': [0, 10, 5], 'G': [0, 0, 0], 'T': [0, 0, 0]}}
+
+
+# A start of the service with the data directory: the previous log (if there is one) is closed like when the
+# process stops
+class Servizio:
+
+    def __init__(self, cartella, monkeypatch):
+        self.cartella = str(cartella)
+        self.monkeypatch = monkeypatch
+        self.log = None
+
+    def avvia(self):
+        if self.log is not None:
+            self.log.file.close()
+        store, self.log = servizio.apri_dati_persistenti(self.cartella, lambda: servizio.MotifStore(motivi_casuali(10)))
+        self.monkeypatch.setattr(servizio, 'motif_store', store)
+        self.monkeypatch.setattr(servizio, 'motif_log', self.log)
+        return servizio.app.test_client()
+
+    def tronca_log(self, testo):
+        with open(os.path.join(self.cartella, servizio.nome_log_dati), 'a') as file:
+            file.write(testo)
+
+
+def test_torn_line_does_not_lose_the_next_changes(motif_store, tmp_path, monkeypatch):
+    dati = Servizio(tmp_path, monkeypatch)
+    client = dati.avvia()
+    assert client.post('/Motifs/motif', json=nuovo_motivo('MA9000.1')).status_code == 200
+    # the change is done again at the next start, and then the log is emptied in the snapshot
+    client = dati.avvia()
+    # the service stops while writing a change, that was never confirmed
+    dati.tronca_log('{"seq": 2, "op": "put", "motif_id": "MA90')
+    client = dati.avvia()
+    assert client.post('/Motifs/motif', json=nuovo_motivo('MA9001.1')).status_code == 200
+    assert client.delete('/Motifs/motif/MA0002.1').status_code == 200
+    dati.avvia()
+    assert 'MA9000.1' in servizio.motif_store and 'MA9001.1' in servizio.motif_store
+    assert 'MA0002.1' not in servizio.motif_store
+
+
+def test_torn_line_after_changes_of_the_log(motif_store, tmp_path, monkeypatch):
+    dati = Servizio(tmp_path, monkeypatch)
+    client = dati.avvia()
+    assert client.post('/Motifs/motif', json=nuovo_motivo('MA9000.1')).status_code == 200
+    dati.tronca_log('{"seq": 2, "op": "del')
+    client = dati.avvia()
+    assert client.post('/Motifs/motif', json=nuovo_motivo('MA9001.1')).status_code == 200
+    dati.tronca_log('garbage without a new line')
+    client = dati.avvia()
+    assert client.post('/Motifs/motif', json=nuovo_motivo('MA9002.1')).status_code == 200
+    dati.avvia()
+    assert {'MA9000.1', 'MA9001.1', 'MA9002.1'} <= {motif['motif_id'] for motif in servizio.motif_store}
+
+
+def test_all_kinds_of_changes_survive_a_restart(motif_store, tmp_path, monkeypatch):
+    dati = Servizio(tmp_path, monkeypatch)
+    client = dati.avvia()
+    assert client.post('/Motifs/motif', json=nuovo_motivo('MA9000.1')).status_code == 200
+    assert client.put('/Motifs/motif/MA0001.1', json={'TF_name': 'renamed'}).status_code == 200
+    assert client.delete('/Motifs/motif/MA0003.1').status_code == 200
+    assert client.post('/Motifs/bulk', json={'upsert': [nuovo_motivo('MA9001.1')],
+                                             'delete': ['MA0004.1']}).status_code == 200
+    prima = {motif['motif_id']: motif for motif in servizio.motif_store}
+
+    dati.avvia()
+    dopo = {motif['motif_id']: motif for motif in servizio.motif_store}
+    assert sorted(dopo) == sorted(prima)
+    assert dopo['MA0001.1']['TF_name'] == 'renamed'
+    assert servizio.pfm_to_dict(dopo['MA9001.1']['PFM']) == nuovo_motivo('MA9001.1')['PFM']
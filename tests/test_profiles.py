@@ -0,0 +1,39 @@
+import os
+import pstats
+
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import sequenza_casuale
+
+
+@pytest.fixture
+def profili(monkeypatch, tmp_path):
+    monkeypatch.setattr(servizio, 'soglia_profilo', 0)
+    monkeypatch.setattr(servizio, 'cartella_profili', str(tmp_path))
+    return tmp_path
+
+
+# The names of the functions in the profile saved for a request (there is one file for each request)
+def funzioni_profilate(cartella, prima):
+    nomi = sorted(set(os.listdir(cartella)) - prima)
+    assert len(nomi) == 1
+    return {funzione for _, _, funzione in pstats.Stats(os.path.join(cartella, nomi[0])).stats}
+
+
+# The slow jobs are done in the threads of LavoriPesanti, and their functions are in the profile of the request
+@pytest.mark.parametrize('richiesta, funzione', [
+    (lambda client: client.get('/Motifs/motif/graph/MA0001.1'), 'create_motif_graph'),
+    (lambda client: client.post('/Motifs/scan', data=sequenza_casuale(3000)), 'scansiona_sequenza'),
+    (lambda client: client.get('/Motifs/LPSRW?mode=best&top_k=3'), 'migliori_sequenze_dna'),
+])
+def test_the_jobs_are_in_the_profile(client, profili, richiesta, funzione):
+    prima = set(os.listdir(profili))
+    risposta = richiesta(client)
+    assert risposta.status_code == 200
+    risposta.get_data()
+    risposta.close()
+    assert funzione in funzioni_profilate(profili, prima)
+    # and the next request can be profiled
+    assert servizio.lock_profilo.acquire(blocking=False)
+    servizio.lock_profilo.release()
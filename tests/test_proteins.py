@@ -0,0 +1,51 @@
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+
+
+# All the DNA sequences of the protein scored with all the motifs of their length, to compare with the search
+def tutte_le_coppie(proteina, punteggio, filamenti):
+    coppie = {}
+    for dna in servizio.dna_sequences_from_protein(proteina, servizio.gencode):
+        _, punteggi = servizio.seleziona_punteggi(dna, punteggio, filamenti=filamenti)
+        for motif_id, score, pvalore, filamento in punteggi:
+            coppie[dna, motif_id] = (score, pvalore, filamento)
+    return coppie
+
+
+@pytest.mark.parametrize('punteggio', ['probability', 'logodds'])
+@pytest.mark.parametrize('filamenti', ['forward', 'reverse', 'both'])
+def test_best_sequences_are_the_best_couples(motif_store, punteggio, filamenti):
+    # 5 amino acids are 15 bases, and their 6 * 4 * 6 * 6 = 864 DNA sequences can be scored one by one
+    proteina = 'LPSRW'
+    coppie = tutte_le_coppie(proteina, punteggio, filamenti)
+    migliori = servizio.migliori_sequenze_dna(proteina, servizio.gencode, 10, punteggio, filamenti)
+
+    assert len(migliori) == 10
+    assert len({(dna, motif_id) for dna, motif_id, *_ in migliori}) == 10
+    if punteggio == 'logodds':
+        ordinate = sorted(coppie.values(), key=lambda valori: (valori[1], -valori[0]))
+        chiavi = [pvalore for dna, motif_id, score, pvalore, filamento in migliori]
+        assert chiavi == pytest.approx([valori[1] for valori in ordinate[:10]])
+    else:
+        ordinate = sorted((valori[0] for valori in coppie.values()), reverse=True)
+        assert [score for _, _, score, _, _ in migliori] == pytest.approx(ordinate[:10])
+    for dna, motif_id, score, pvalore, filamento in migliori:
+        atteso = coppie[dna, motif_id]
+        assert score == pytest.approx(atteso[0])
+        assert filamento == atteso[2]
+
+
+def test_best_sequences_route(client):
+    testo = client.get('/Motifs/LPSRW?mode=best&top_k=3&scoring=logodds&strand=both').get_data(as_text=True)
+    righe = testo.splitlines()
+    inizio = righe.index('DNA sequence\tMotif ID\tLog-odds score\tP-value\tStrand')
+    assert [len(riga.split('\t')) for riga in righe[inizio + 1:inizio + 4]] == [5, 5, 5]
+
+
+@pytest.mark.parametrize('argomenti', ['mode=best&min_score=0.1', 'mode=best&format=json', 'scoring=logodds',
+                                       'strand=both&cursor=0'])
+def test_options_that_cant_be_used_with_proteins(client, argomenti):
+    risposta = client.get(f'/Motifs/LPSRW?{argomenti}')
+    assert risposta.status_code == 400
+    assert "can't be used with a protein" in risposta.get_data(as_text=True)
@@ -0,0 +1,87 @@
+from itertools import product
+
+import numpy as np
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import motivi_casuali, sequenza_casuale
+
+
+# Short motifs (all their words can be scored one by one) with a uniform background and with one that doesn't have
+# A=T and C=G, where the two strands have different tables
+@pytest.fixture(params=[(0.25, 0.25, 0.25, 0.25), (0.4, 0.3, 0.2, 0.1)], ids=['uniform', 'asymmetric'])
+def motivi_corti(request, motif_store, monkeypatch):
+    monkeypatch.setattr(servizio, 'frequenze_fondo', np.array(request.param))
+    store = servizio.MotifStore(motivi_casuali(12, lunghezze=(4, 5, 6)))
+    monkeypatch.setattr(servizio, 'motif_store', store)
+    return store
+
+
+# The score of each motif of a length for each word of that length on a strand, and the probability of each word
+def tutte_le_parole(lunghezza, filamento):
+    parole = [''.join(parola) for parola in product('ACGT', repeat=lunghezza)]
+    score = {}
+    for parola in parole:
+        for motif_id, punteggio, pvalore, _ in servizio.seleziona_punteggi(parola, 'logodds', filamenti=filamento)[1]:
+            score[motif_id, parola] = (punteggio, pvalore)
+    probabilita = {parola: np.prod(servizio.frequenze_fondo[servizio.codifica_sequenza(parola)]) for parola in parole}
+    return parole, score, probabilita
+
+
+@pytest.mark.parametrize('filamento', ['forward', 'reverse'])
+def test_pvalues_of_all_the_words(motivi_corti, filamento):
+    versione = motivi_corti.snapshot()
+    for lunghezza, bucket in versione.buckets.items():
+        parole, score, probabilita = tutte_le_parole(lunghezza, filamento)
+        for motif_id in bucket['motif_ids']:
+            punteggi = np.array([score[motif_id, parola][0] for parola in parole])
+            pesi = np.array([probabilita[parola] for parola in parole])
+            attesi = [pesi[punteggi >= punteggio - 1e-9].sum() for punteggio in punteggi]
+            assert [score[motif_id, parola][1] for parola in parole] == pytest.approx(attesi, rel=1e-9)
+
+
+def test_the_best_word_is_not_impossible(client):
+    # only the word with the best score of each motif reaches it, so its p-value is the probability of that word
+    for lunghezza, bucket in servizio.motif_store.buckets.items():
+        for motif_id, pwm in zip(bucket['motif_ids'], bucket['pwm']):
+            parola = ''.join('ACGT'[nucleotide] for nucleotide in pwm.argmax(axis=1))
+            risultati = client.get(f'/Motifs/{parola}?scoring=logodds&format=json').get_json()['results']
+            pvalore = next(risultato['p_value'] for risultato in risultati if risultato['motif_id'] == motif_id)
+            assert pvalore == pytest.approx(0.25 ** lunghezza)
+
+
+# On a random sequence the scan with max_pvalue must find all the windows, on both strands, that scored one by one
+# have at most that p-value, and with the same p-values
+def test_scan_finds_the_windows_of_both_strands(motivi_corti):
+    sequenza = sequenza_casuale(300, seme=7)
+    versione = motivi_corti.snapshot()
+    hits = servizio.scansiona_sequenza(servizio.codifica_sequenza(sequenza),
+                                       servizio.soglie_scan(versione, None, 0.01), versione)
+
+    attesi = {}
+    for lunghezza in versione.buckets:
+        for inizio in range(len(sequenza) - lunghezza + 1):
+            for filamento, segno in (('forward', '+'), ('reverse', '-')):
+                _, punteggi = servizio.seleziona_punteggi(sequenza[inizio:inizio + lunghezza], 'logodds',
+                                                          max_pvalue=0.01, filamenti=filamento)
+                for motif_id, score, pvalore, _ in punteggi:
+                    attesi[motif_id, inizio, segno] = (score, pvalore)
+    trovati = {(motif_id, inizio, filamento): (score, pvalore) for motif_id, inizio, _, filamento, score, pvalore in hits}
+    assert len(attesi) > 50
+    assert trovati.keys() == attesi.keys()
+    for chiave, valori in attesi.items():
+        assert trovati[chiave] == pytest.approx(valori)
+
+
+def test_both_strands_keep_the_smallest_pvalue(motivi_corti):
+    versione = motivi_corti.snapshot()
+    bucket = versione.buckets[6]
+    for parola in ('ACGTTA', 'GGGCCA', 'TTTTTT', 'CAGTAC'):
+        avanti = dict((motif_id, valori) for motif_id, *valori in servizio.seleziona_punteggi(parola, 'logodds')[1])
+        indietro = dict((motif_id, valori) for motif_id, *valori in
+                        servizio.seleziona_punteggi(parola, 'logodds', filamenti='reverse')[1])
+        for motif_id, score, pvalore, filamento in servizio.seleziona_punteggi(parola, 'logodds', filamenti='both')[1]:
+            migliore = min(avanti[motif_id][:2], indietro[motif_id][:2], key=lambda valori: (valori[1], -valori[0]))
+            assert (score, pvalore) == pytest.approx(migliore)
+            assert (score, pvalore) == pytest.approx((avanti if filamento == '+' else indietro)[motif_id][:2])
+        assert len(avanti) == len(bucket['motif_ids'])
@@ -0,0 +1,73 @@
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import sequenza_casuale
+
+
+def pfm(lunghezza, conteggio=50):
+    return {'A': [conteggio] * lunghezza, 'C': [1] * lunghezza, 'G': [2] * lunghezza, 'T': [3] * lunghezza}
+
+
+# The scores of a sequence, as a dictionary motif ID -> score
+def punteggi(client, sequenza, argomenti=''):
+    risposta = client.get(f'/Motifs/{sequenza}?format=json{argomenti}')
+    assert risposta.status_code == 200
+    return {risultato['motif_id']: risultato['score'] for risultato in risposta.get_json()['results']}
+
+
+def statistiche():
+    return servizio.risultati_cache.statistiche()
+
+
+def test_hits_and_misses(client):
+    sequenza = sequenza_casuale(6, seme=1)
+    primi = punteggi(client, sequenza)
+    assert punteggi(client, sequenza) == primi
+    # other options are another result
+    punteggi(client, sequenza, '&scoring=logodds')
+    assert (statistiche()['hits'], statistiche()['misses'], statistiche()['entries']) == (1, 2, 2)
+
+
+# (MA0002.1 is a motif of 6 positions and MA0003.1 of 8, see motivi_casuali)
+@pytest.mark.parametrize('modifica, lunghezze', [
+    (lambda client: client.put('/Motifs/motif/MA0002.1', json={'PFM': pfm(6)}), {6}),
+    (lambda client: client.put('/Motifs/motif/MA0002.1', json={'PFM': pfm(8)}), {6, 8}),
+    (lambda client: client.delete('/Motifs/motif/MA0002.1'), {6}),
+    (lambda client: client.post('/Motifs/bulk', json={'upsert': [{'motif_id': 'MA0002.1', 'TF_name': 'new',
+                                                                  'PFM': pfm(6)}], 'delete': ['MA0003.1']}), {6, 8}),
+], ids=['put', 'put_other_length', 'delete', 'bulk'])
+def test_a_change_deletes_the_results_of_its_lengths(client, modifica, lunghezze):
+    sequenze = {lunghezza: sequenza_casuale(lunghezza, seme=lunghezza) for lunghezza in (6, 8, 11)}
+    prima = {lunghezza: punteggi(client, sequenza) for lunghezza, sequenza in sequenze.items()}
+    assert modifica(client).status_code == 200
+
+    mancati = statistiche()['misses']
+    dopo = {lunghezza: punteggi(client, sequenza) for lunghezza, sequenza in sequenze.items()}
+    # only the results of the lengths changed are computed again, and they are the ones of the new motifs
+    assert statistiche()['misses'] - mancati == len(lunghezze)
+    assert statistiche()['invalidations'] == len(lunghezze)
+    for lunghezza, sequenza in sequenze.items():
+        attesi = {motif_id: score for motif_id, score, _, _ in servizio.seleziona_punteggi(sequenza, 'probability')[1]}
+        assert dopo[lunghezza] == pytest.approx(attesi)
+        assert (dopo[lunghezza] != prima[lunghezza]) == (lunghezza in lunghezze)
+
+
+def test_the_results_expire(client, monkeypatch):
+    adesso = [1000.0]
+    monkeypatch.setattr(servizio.time, 'monotonic', lambda: adesso[0])
+    sequenza = sequenza_casuale(6, seme=5)
+    punteggi(client, sequenza)
+    adesso[0] += servizio.risultati_cache.durata - 1
+    punteggi(client, sequenza)
+    assert (statistiche()['hits'], statistiche()['misses']) == (1, 1)
+    adesso[0] += 2
+    punteggi(client, sequenza)
+    assert (statistiche()['hits'], statistiche()['misses'], statistiche()['entries']) == (1, 2, 1)
+
+
+def test_a_cache_of_0_megabytes_keeps_nothing(client, monkeypatch):
+    # as with the option --result-cache-mb 0
+    monkeypatch.setattr(servizio.risultati_cache, 'byte_massimi', 0)
+    sequenza = sequenza_casuale(6, seme=6)
+    assert punteggi(client, sequenza) == punteggi(client, sequenza)
+    assert (statistiche()['hits'], statistiche()['misses'], statistiche()['entries']) == (0, 2, 0)
@@ -0,0 +1,57 @@
+import numpy as np
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import sequenza_casuale
+
+
+def righe_hits(testo):
+    return [riga for riga in testo.splitlines() if riga.startswith('MA')]
+
+
+def test_default_threshold_is_a_pvalue(client):
+    risposta = client.post('/Motifs/scan', data=sequenza_casuale(5000))
+    assert risposta.status_code == 200
+    testo = risposta.get_data(as_text=True)
+    assert f'p-value below {servizio.pvalore_scan_predefinito}' in testo
+    hits = righe_hits(testo)
+    # about one hit every 10000 windows for each motif and strand, far from one for each window
+    assert len(hits) < 5000 * 60 * 2 * 1e-3
+    assert all(float(riga.split('\t')[5]) <= servizio.pvalore_scan_predefinito for riga in hits)
+    assert testo.endswith(f'Number of hits: {len(hits)}\n')
+
+
+def test_min_score_keeps_probability_scan(client):
+    testo = client.post('/Motifs/scan?min_score=0.01', data=sequenza_casuale(2000)).get_data(as_text=True)
+    assert 'score above 0.01' in testo
+    assert all(float(riga.split('\t')[4]) >= 0.01 for riga in righe_hits(testo))
+
+
+def test_pieces_give_the_hits_of_the_whole_sequence(motif_store, monkeypatch):
+    indici = servizio.codifica_sequenza(sequenza_casuale(3000, seme=1))
+    versione = motif_store.snapshot()
+    soglie = servizio.soglie_scan(versione, None, 1e-3)
+    attesi = servizio.scansiona_sequenza(indici, soglie, versione)
+
+    monkeypatch.setattr(servizio, 'finestre_per_pezzo_scan', 250)
+    pezzi = list(servizio.genera_hits(indici, soglie, versione))
+    assert len(pezzi) == 12
+    assert [hit for hits in pezzi for hit in hits] == attesi
+
+
+def test_scan_errors(client):
+    assert client.post('/Motifs/scan?min_score=-1', data='ACGT').status_code == 400
+    assert client.post('/Motifs/scan', data='').status_code == 400
+    assert client.post('/Motifs/scan?max_pvalue=2', data='ACGTACGT').status_code == 400
+
+
+def test_one_fasta_record_only(client):
+    sequenza = sequenza_casuale(200, seme=2)
+    uno = client.post('/Motifs/scan', data=f'>chr1 a record\n{sequenza[:100]}\n{sequenza[100:]}\n')
+    assert uno.status_code == 200
+    assert righe_hits(uno.get_data(as_text=True)) == righe_hits(client.post('/Motifs/scan', data=sequenza)
+                                                                .get_data(as_text=True))
+    # two records would be scanned as a single sequence, with hits across them
+    due = client.post('/Motifs/scan', data=f'>chr1\n{sequenza[:100]}\n>chr2\n{sequenza[100:]}\n')
+    assert due.status_code == 400
+    assert '/Motifs/fasta?mode=scan' in due.get_data(as_text=True)
+    assert client.post('/Motifs/scan', json={'sequence': f'>a\n{sequenza}\n>b\n{sequenza}'}).status_code == 400
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import sequenza_casuale
+
+
+# A number that can't be read is an error, not the same as not giving it
+@pytest.mark.parametrize('argomenti', ['top_k=abc', 'top_k=2.5', 'min_score=x', 'max_pvalue=abc', 'max_pvalue=nan',
+                                       'scoring=logodds&min_score=inf'])
+def test_wrong_numbers_of_the_scores(client, argomenti):
+    risposta = client.get(f'/Motifs/ACGTAC?{argomenti}')
+    assert risposta.status_code == 400
+    assert argomenti.split('&')[-1].split('=')[0] in risposta.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('argomenti', ['mode=best&top_k=ten', 'cursor=a', 'limit=1e3'])
+def test_wrong_numbers_of_the_proteins(client, argomenti):
+    assert client.get(f'/Motifs/LPSRW?{argomenti}').status_code == 400
+
+
+@pytest.mark.parametrize('percorso', ['/Motifs/scan', '/Motifs/fasta'])
+@pytest.mark.parametrize('argomenti', ['min_score=abc', 'max_pvalue=0,01'])
+def test_wrong_thresholds_of_the_scan(client, percorso, argomenti):
+    assert client.post(f'{percorso}?{argomenti}', data='>a\n' + sequenza_casuale(50)).status_code == 400
+
+
+def test_right_numbers_are_used(client):
+    risultati = client.get('/Motifs/ACGTAC?scoring=logodds&top_k=3&max_pvalue=0.5&format=json').get_json()['results']
+    assert 0 < len(risultati) <= 3
+    assert all(risultato['p_value'] <= 0.5 for risultato in risultati)
+
+
+# The whole numbers too big for numpy are read as the others (too big for the limits, or simply more than needed)
+@pytest.mark.parametrize('percorso, codice', [('/Motifs/ACGTAC?top_k=99999999999999999999999', 200),
+                                              ('/Motifs/ACGTACGTACGT?mode=fit&top_k=99999999999999999999999', 400),
+                                              ('/Motifs/LPSRW?cursor=36893488147419103232', 200),
+                                              ('/Motifs/LPSRW?mode=best&top_k=99999999999999999999999', 400),
+                                              ('/Motifs/motif?limit=99999999999999999999999', 200),
+                                              ('/Motifs/motif?length=99999999999999999999999', 200)])
+def test_huge_whole_numbers(client, percorso, codice):
+    risposta = client.get(percorso)
+    risposta.get_data()
+    assert risposta.status_code == codice
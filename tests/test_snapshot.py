@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import motivi_casuali
+
+
+def scrivi_jaspar(percorso, motifs):
+    with open(percorso, 'w') as file:
+        for motif in motifs:
+            file.write(f">{motif['motif_id']}\t{motif['TF_name']}\n")
+            for nucleotide, riga in zip('ACGT', motif['PFM']):
+                file.write(f"{nucleotide}  [ {' '.join(str(numero) for numero in riga)} ]\n")
+
+
+def stessi_buckets(prima, dopo):
+    assert sorted(prima.buckets) == sorted(dopo.buckets)
+    for lunghezza, bucket in prima.buckets.items():
+        assert bucket['motif_ids'] == dopo.buckets[lunghezza]['motif_ids']
+        for campo in servizio.campi_bucket:
+            np.testing.assert_array_equal(bucket[campo], dopo.buckets[lunghezza][campo])
+
+
+def test_integer_and_float_pfms_keep_their_type(motif_store, tmp_path):
+    with motif_store.scrittura() as modifica:
+        modifica.add('MA9000.1', 'meme', np.array([[0.5, 0.25], [0.25, 0.25], [0.125, 0.25], [0.125, 0.25]]))
+    servizio.salva_snapshot(motif_store, str(tmp_path / 'db.npz'))
+    caricato, _ = servizio.carica_snapshot(str(tmp_path / 'db.npz'))
+
+    for motif in motif_store.snapshot():
+        copia = caricato.get(motif['motif_id'])
+        assert copia['PFM'].dtype == motif['PFM'].dtype
+        np.testing.assert_array_equal(copia['PFM'], motif['PFM'])
+    assert servizio.pfm_to_dict(caricato.get('MA0001.1')['PFM']) == servizio.pfm_to_dict(motif_store.get('MA0001.1')['PFM'])
+    stessi_buckets(motif_store.snapshot(), caricato.snapshot())
+
+
+def test_buckets_are_loaded_without_computing_them(motif_store, tmp_path, monkeypatch):
+    servizio.salva_snapshot(motif_store, str(tmp_path / 'db.npz'))
+    monkeypatch.setattr(servizio, 'righe_bucket', lambda pfms: pytest.fail('the buckets were computed again'))
+    caricato, _ = servizio.carica_snapshot(str(tmp_path / 'db.npz'))
+    stessi_buckets(motif_store.snapshot(), caricato.snapshot())
+
+
+def test_buckets_are_computed_again_with_other_parameters(motif_store, tmp_path, monkeypatch):
+    servizio.salva_snapshot(motif_store, str(tmp_path / 'db.npz'))
+    monkeypatch.setattr(servizio, 'pseudoconteggio', 0.5)
+    caricato, _ = servizio.carica_snapshot(str(tmp_path / 'db.npz'))
+    stessi_buckets(servizio.MotifStore(list(motif_store)).snapshot(), caricato.snapshot())
+
+
+def test_jaspar_file_uses_the_snapshot_until_it_changes(tmp_path, monkeypatch):
+    percorso_file, percorso_snapshot = str(tmp_path / 'jaspar.txt'), str(tmp_path / 'jaspar.npz')
+    scrivi_jaspar(percorso_file, motivi_casuali(10))
+    opzioni = {'--jaspar-file': percorso_file, '--snapshot': percorso_snapshot}
+    assert len(servizio.carica_database(opzioni)) == 10
+
+    letture = []
+    originale = servizio.carica_file_jaspar
+    monkeypatch.setattr(servizio, 'carica_file_jaspar', lambda percorso: letture.append(percorso) or originale(percorso))
+    assert len(servizio.carica_database(opzioni)) == 10
+    assert letture == []
+
+    scrivi_jaspar(percorso_file, motivi_casuali(12))
+    assert len(servizio.carica_database(opzioni)) == 12
+    assert letture == [percorso_file]
+    assert len(servizio.carica_snapshot(percorso_snapshot)[0]) == 12
@@ -0,0 +1,72 @@
+import pytest
+
+import JASPAR_WEB_SERVICE as servizio
+from conftest import sequenza_casuale
+
+
+def complemento_inverso(sequenza):
+    return sequenza[::-1].translate(str.maketrans('ACGT', 'TGCA'))
+
+
+def per_motivo(punteggi):
+    return {motif_id: (score, pvalore, filamento) for motif_id, score, pvalore, filamento in punteggi}
+
+
+@pytest.mark.parametrize('punteggio', ['probability', 'logodds'])
+def test_reverse_is_the_forward_of_the_reverse_complement(motif_store, punteggio):
+    for lunghezza in (5, 8, 15):
+        sequenza = sequenza_casuale(lunghezza, seme=lunghezza)
+        indietro = per_motivo(servizio.seleziona_punteggi(sequenza, punteggio, filamenti='reverse')[1])
+        avanti = per_motivo(servizio.seleziona_punteggi(complemento_inverso(sequenza), punteggio)[1])
+        assert indietro.keys() == avanti.keys()
+        for motif_id, (score, pvalore, filamento) in indietro.items():
+            assert filamento == '-'
+            assert score == pytest.approx(avanti[motif_id][0])
+            assert pvalore == pytest.approx(avanti[motif_id][1])
+
+
+@pytest.mark.parametrize('punteggio', ['probability', 'logodds'])
+def test_both_strands_keep_the_best_one(motif_store, punteggio):
+    sequenza = sequenza_casuale(11, seme=2)
+    avanti = per_motivo(servizio.seleziona_punteggi(sequenza, punteggio)[1])
+    indietro = per_motivo(servizio.seleziona_punteggi(sequenza, punteggio, filamenti='reverse')[1])
+    numero, entrambi = servizio.seleziona_punteggi(sequenza, punteggio, filamenti='both')
+    assert numero == len(avanti) == len(entrambi)
+    for motif_id, score, pvalore, filamento in entrambi:
+        migliore = '+' if avanti[motif_id][0] >= indietro[motif_id][0] else '-'
+        assert filamento == migliore
+        assert score == pytest.approx(max(avanti[motif_id][0], indietro[motif_id][0]))
+    # from the best to the worst, with top_k the first ones
+    chiavi = [pvalore if punteggio == 'logodds' else -score for _, score, pvalore, _ in entrambi]
+    assert chiavi == sorted(chiavi)
+    assert servizio.seleziona_punteggi(sequenza, punteggio, top_k=3, filamenti='both')[1] == entrambi[:3]
+
+
+def test_both_strands_route(client):
+    sequenza = sequenza_casuale(8, seme=3)
+    dati = client.get(f'/Motifs/{sequenza}?strand=both&format=json').get_json()
+    assert dati['strand'] == 'both'
+    assert {risultato['strand'] for risultato in dati['results']} <= {'+', '-'}
+    testo = client.get(f'/Motifs/{sequenza}?strand=both&format=tsv').get_data(as_text=True)
+    assert [len(riga.split('\t')) for riga in testo.splitlines()[1:]] == [3] * len(dati['results'])
+    assert client.get(f'/Motifs/{sequenza}?strand=up').status_code == 400
+
+
+# The hits of the reverse strand of a sequence are the hits of the forward strand of its reverse complement, with
+# the starts counted from the other end
+def test_scan_reverse_hits(motif_store):
+    sequenza = sequenza_casuale(2000, seme=4)
+    versione = motif_store.snapshot()
+    soglie = servizio.soglie_scan(versione, None, 1e-3)
+    hits = servizio.scansiona_sequenza(servizio.codifica_sequenza(sequenza), soglie, versione)
+    hits_inverso = servizio.scansiona_sequenza(servizio.codifica_sequenza(complemento_inverso(sequenza)), soglie,
+                                               versione)
+
+    indietro = {(motif_id, len(sequenza) - inizio - lunghezza): (score, pvalore)
+                for motif_id, inizio, lunghezza, filamento, score, pvalore in hits_inverso if filamento == '+'}
+    trovati = {(motif_id, inizio): (score, pvalore) for motif_id, inizio, _, filamento, score, pvalore in hits
+               if filamento == '-'}
+    assert len(indietro) > 10
+    assert trovati.keys() == indietro.keys()
+    for chiave, valori in indietro.items():
+        assert trovati[chiave] == pytest.approx(valori)